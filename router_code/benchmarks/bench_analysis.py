@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the packet pattern counting behind `analyze_packet_patterns`.
+
+Compares the per-packet Python loop used before vectorisation with the
+NumPy grouping in `PacketBuffer.count_patterns`, on snapshots of 10k,
+100k and 1M packets, and checks that both produce the same counts and
+the same rule strings.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_analysis
+"""
+import argparse
+import contextlib
+import io
+import logging
+import time
+from collections import Counter, defaultdict
+import numpy as np
+from src.net_manager.buffer import PACKET_DTYPE, PacketBuffer
+from src.net_manager.packet_parser import int_to_ip, PROTO_TCP, PROTO_UDP, TCP_SYN
+
+
+def count_patterns_loop(packets):
+    """Reference implementation: count patterns one packet at a time."""
+    ssh_attempts_by_source = defaultdict(Counter)
+    syn_counts_by_destination = defaultdict(int)
+
+    for _, src, dst, _, dport, proto, flags in packets.tolist():
+        if proto == PROTO_TCP and flags & TCP_SYN:
+            if dport == 22:
+                ssh_attempts_by_source[int_to_ip(src)][int_to_ip(dst)] += 1
+            else:
+                syn_counts_by_destination[int_to_ip(dst)] += 1
+
+    return {
+        'total_packets': len(packets),
+        'ssh_attempts_by_source': ssh_attempts_by_source,
+        'syn_counts_by_destination': syn_counts_by_destination,
+    }
+
+
+def make_snapshot(count, seed=0):
+    """Build a snapshot mixing benign traffic, SSH brute force and a spoofed SYN flood.
+
+    Args:
+        count (int): Number of packets.
+        seed (int): Random seed.
+
+    Returns:
+        numpy.ndarray: Packets (PACKET_DTYPE rows).
+    """
+    rng = np.random.default_rng(seed)
+    packets = np.zeros(count, dtype=PACKET_DTYPE)
+    kind = rng.random(count)
+    packets['time'] = np.arange(count) * 1e-5
+    packets['proto'] = np.where(kind < 0.1, PROTO_UDP, PROTO_TCP)
+    packets['sport'] = rng.integers(1024, 65536, count)
+
+    # 40% benign traffic between a few hosts
+    packets['src'] = 0x0a010000 + rng.integers(2, 50, count)
+    packets['dst'] = 0x0a020000 + rng.integers(2, 50, count)
+    packets['dport'] = 443
+    packets['flags'] = 0x10
+
+    # 10% SSH SYNs from a handful of sources
+    ssh = (kind >= 0.5) & (kind < 0.6)
+    packets['src'][ssh] = 0x0a030000 + rng.integers(2, 6, ssh.sum())
+    packets['dport'][ssh] = 22
+    packets['flags'][ssh] = TCP_SYN
+
+    # 40% spoofed-source SYN flood towards two targets
+    flood = kind >= 0.6
+    packets['src'][flood] = rng.integers(0x01000000, 0xdf000000, flood.sum())
+    packets['dst'][flood] = 0x0a020000 + rng.integers(7, 9, flood.sum())
+    packets['dport'][flood] = 80
+    packets['flags'][flood] = TCP_SYN
+    return packets
+
+
+def best_time(function, packets, repeat):
+    """Return the best wall time of `repeat` calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(packets)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet pattern analysis benchmark")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Runs per implementation, best is reported (default: 3)")
+    args = parser.parse_args()
+
+    logging.getLogger('BasicLogger').setLevel(logging.WARNING)
+    packet_buffer = PacketBuffer(capacity=1)
+    print(f"{'packets':>9} {'loop ms':>10} {'numpy ms':>10} {'speedup':>8} {'same':>5}")
+    for count in (10000, 100000, 1000000):
+        packets = make_snapshot(count)
+        loop = best_time(count_patterns_loop, packets, args.repeat)
+        vectorized = best_time(packet_buffer.count_patterns, packets, args.repeat)
+
+        # Silence the analysis report while comparing outputs
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = packet_buffer.analyze_counts(count_patterns_loop(packets))
+            actual = packet_buffer.analyze_counts(packet_buffer.count_patterns(packets))
+        same = expected == actual
+        print(f"{count:>9} {loop * 1000:>10.1f} {vectorized * 1000:>10.1f} "
+              f"{loop / vectorized:>7.1f}x {str(same):>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the packet callback latency with inline and background analysis.
+
+Drives the same buffer -> lookup -> verdict steps as
+`Filter.check_packet` with synthetic packet records. In inline mode the
+analysis cycle runs inside the callback every `period` seconds (the old
+behaviour); in worker mode it runs on an `AnalysisWorker` thread. The
+latency histogram of every callback is printed for both modes.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_callback_latency
+"""
+import argparse
+import contextlib
+import io
+import logging
+import random
+import time
+from src.net_manager.analysis_worker import AnalysisWorker
+from src.net_manager.buffer import PacketBuffer
+from src.net_manager.packet_parser import ip_to_int, PacketRecord, PROTO_TCP, TCP_SYN
+from src.net_manager.rules import Rules
+from src.tools.latency import LatencyHistogram
+
+
+def make_records(count, seed=0):
+    """Build a mix of benign traffic, SSH SYNs and a spoofed SYN flood.
+
+    Args:
+        count (int): Number of records to generate.
+        seed (int): Random seed.
+
+    Returns:
+        list of PacketRecord: Synthetic packet headers.
+    """
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            src, dst, dport, flags = f"10.1.0.{rng.randint(2, 20)}", "10.2.0.5", 443, 0x10
+        elif kind < 0.6:
+            src, dst, dport, flags = f"10.3.0.{rng.randint(2, 4)}", "10.2.0.7", 22, TCP_SYN
+        else:
+            src = ".".join(str(rng.randint(1, 254)) for _ in range(4))
+            dst, dport, flags = "10.2.0.9", 80, TCP_SYN
+        records.append(PacketRecord(src, dst, PROTO_TCP, rng.randint(1024, 65535), dport, flags,
+                                    ip_to_int(src), ip_to_int(dst)))
+    return records
+
+
+def run(records, period, inline):
+    """Feed records through the callback steps and time every callback.
+
+    Args:
+        records (list of PacketRecord): Packets to process.
+        period (float): Seconds between analysis cycles.
+        inline (bool): Run analysis inside the callback instead of a worker.
+
+    Returns:
+        LatencyHistogram: Callback latencies.
+    """
+    packet_buffer = PacketBuffer()
+    rules = Rules()
+    histogram = LatencyHistogram()
+    worker = AnalysisWorker(packet_buffer, rules, lambda: [], lambda rules: None, period)
+    if not inline:
+        worker.start()
+
+    last_cycle = time.time()
+    for record in records:
+        start = time.perf_counter_ns()
+        flag = "SYN" if record.flags & TCP_SYN else ""
+        packet_buffer.add_packet(record)
+        if inline and time.time() - last_cycle > period:
+            last_cycle = time.time()
+            worker.run_cycle()
+        rules.blocking_rules(record.src, record.dst, flag)
+        histogram.record(time.perf_counter_ns() - start)
+
+    worker.stop()
+    return histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet callback latency benchmark")
+    parser.add_argument("-n", "--packets", type=int, default=500000,
+                        help="Number of packets to process (default: 500000)")
+    parser.add_argument("-p", "--period", type=float, default=0.5,
+                        help="Seconds between analysis cycles (default: 0.5)")
+    args = parser.parse_args()
+
+    logging.getLogger('BasicLogger').setLevel(logging.WARNING)
+    records = make_records(args.packets)
+
+    print(f"{'mode':>8} {'p50 us':>9} {'p99 us':>9} {'p99.9 us':>9} {'max us':>10}")
+    for mode, inline in (("inline", True), ("worker", False)):
+        # Silence the analysis report printed every cycle
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run(records, args.period, inline).summary()
+        print(f"{mode:>8} {summary['p50_us']:>9.2f} {summary['p99_us']:>9.2f} "
+              f"{summary['p999_us']:>9.2f} {summary['max_us']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark of `Logger.log` calls per second.
+
+Compares the previous synchronous logger, which called
+`inspect.getframeinfo` and `os.path.relpath` on every call before the
+level check, with the current one (level check first, context cached per
+code object, I/O on a QueueListener thread). Both write to a temporary
+file only. Calls below the logger level and enabled calls are measured
+separately; for the queued logger the time to drain the queue is reported
+as well.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_logger
+"""
+import argparse
+import inspect
+import logging
+import os
+import tempfile
+import time
+from src.tools import logger as logger_module
+from src.tools.logger import Logger
+
+
+class LegacyLogger:
+    """Reference implementation: the synchronous logger used before."""
+
+    def __init__(self, log_file, log_level=logging.INFO):
+        self.logger = logging.getLogger('BenchLegacyLogger')
+        self.logger.setLevel(log_level)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(logging.Formatter(
+                '%(asctime)s [%(context)s] [%(levelname)s] %(message)s'))
+            self.logger.addHandler(file_handler)
+
+    def _get_context(self):
+        frame = inspect.currentframe().f_back.f_back
+        file_path = inspect.getframeinfo(frame).filename
+        rel_path = os.path.relpath(file_path)
+        func_name = frame.f_code.co_name
+        try:
+            class_name = frame.f_locals['self'].__class__.__name__
+            return f"{rel_path}:{class_name}.{func_name}"
+        except (KeyError, AttributeError):
+            return f"{rel_path}:{func_name}"
+
+    def log(self, message, level=logging.INFO):
+        extra = {'context': self._get_context()}
+        if level == logging.DEBUG:
+            self.logger.debug(message, extra=extra)
+        else:
+            self.logger.log(level, message, extra=extra)
+
+
+class Caller:
+    """Logs from a method, like the call sites in the filter."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def run(self, calls, level):
+        log = self.log
+        start = time.perf_counter()
+        for i in range(calls):
+            log.log("===== Added Rule - src 10.0.0.1", level)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logger throughput benchmark")
+    parser.add_argument("-n", "--calls", type=int, default=100000,
+                        help="Log calls per measurement (default: 100000)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    legacy = LegacyLogger(os.path.join(directory, 'legacy.log'), logging.INFO)
+    current = Logger(log_file=os.path.join(directory, 'current.log'), log_level=logging.INFO, console=False)
+
+    print(f"{'logger':>8} {'filtered calls/s':>17} {'enabled calls/s':>16} {'drain ms':>9}")
+    for name, log in (('legacy', legacy), ('queued', current)):
+        caller = Caller(log)
+        filtered = caller.run(args.calls, logging.DEBUG)
+        enabled = caller.run(args.calls, logging.INFO)
+        drain_start = time.perf_counter()
+        if log is current:
+            logger_module.flush_logs()
+        drain = time.perf_counter() - drain_start
+        print(f"{name:>8} {args.calls / filtered:>17,.0f} {args.calls / enabled:>16,.0f} "
+              f"{drain * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
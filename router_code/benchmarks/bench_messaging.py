@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark of inter-router rule messaging on loopback.
+
+Measures the time from `queue_rules` until the datagram is in
+`incoming_messages` (rule-propagation latency through the network loop)
+and the CPU used by an idle loop, for the event-driven
+`run_network_loop` and for the previous select loop that polled the
+outgoing queue every 0.1 s and sent one message per writable event.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_messaging
+"""
+import argparse
+import logging
+import queue
+import select
+import socket
+import threading
+import time
+from src.net_manager.intra_sys_coms import (incoming_messages, outgoing_messages, queue_rules,
+                                            run_network_loop, stop_network_thread)
+
+
+def legacy_network_loop(sock, stop_event):
+    """Reference implementation: the polling select loop used before."""
+    outputs = []
+    while not stop_event.is_set():
+        if not outgoing_messages.empty() and sock not in outputs:
+            outputs.append(sock)
+        readable, writable, _ = select.select([sock], outputs, [sock], 0.1)
+        for _ in readable:
+            incoming_messages.put([sock.recvfrom(65535)])
+        for _ in writable:
+            try:
+                message, destination = outgoing_messages.get_nowait()
+                sock.sendto(message, destination)
+                outgoing_messages.task_done()
+            except queue.Empty:
+                outputs.remove(sock)
+
+
+def measure(loop, rounds, rules_per_round, idle_seconds):
+    """Run a network loop on loopback and time rule round trips through it.
+
+    Returns:
+        tuple: (sorted latencies in seconds, CPU seconds used while idle)
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.setblocking(False)
+    port = sock.getsockname()[1]
+    stop_event = threading.Event()
+    thread = threading.Thread(target=loop, args=(sock, stop_event), daemon=True)
+    thread.start()
+
+    rules = [f"src/10.0.{i >> 8}.{i & 255}/SYN/30" for i in range(rules_per_round)]
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        queue_rules('127.0.0.1', rules, 1, port=port)
+        incoming_messages.get(timeout=5)
+        latencies.append(time.perf_counter() - start)
+        # Collect the rest of a multi-datagram batch
+        while not incoming_messages.empty() or not outgoing_messages.empty():
+            try:
+                incoming_messages.get(timeout=0.2)
+            except queue.Empty:
+                break
+
+    time.sleep(0.2)
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = time.process_time() - cpu_start
+
+    stop_network_thread(stop_event)
+    thread.join(timeout=1)
+    sock.close()
+    return sorted(latencies), idle_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inter-router messaging benchmark")
+    parser.add_argument("-n", "--rounds", type=int, default=200,
+                        help="Rule batches sent per loop (default: 200)")
+    parser.add_argument("-r", "--rules", type=int, default=100,
+                        help="Rules per batch (default: 100)")
+    parser.add_argument("--idle", type=float, default=2.0,
+                        help="Seconds of idle CPU measurement (default: 2)")
+    args = parser.parse_args()
+
+    logging.getLogger('BasicLogger').setLevel(logging.WARNING)
+    print(f"{'loop':>8} {'p50 us':>9} {'p99 us':>9} {'max us':>9} {'idle cpu %':>11}")
+    for name, loop in (('legacy', legacy_network_loop), ('event', run_network_loop)):
+        latencies, idle_cpu = measure(loop, args.rounds, args.rules, args.idle)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:>8} {p50 * 1e6:>9.0f} {p99 * 1e6:>9.0f} {latencies[-1] * 1e6:>9.0f} "
+              f"{idle_cpu / args.idle * 100:>10.2f}%")
+
+
+if __name__ == '__main__':
+    main()
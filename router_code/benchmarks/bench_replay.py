@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Offline replay of pcap files through the filter pipeline.
+
+Feeds every IPv4 packet of the given captures to the same
+`PacketPipeline.print_and_check` callback NFQUEUE calls, through a
+`ReplayPacket` implementing `get_payload`/`accept`/`drop`, and runs an
+analysis cycle of an `AnalysisWorker` whenever `period` seconds of
+capture time have passed, and once more after the last packet. Rules sent
+by the cycle are delivered back to the next one, as the network thread
+does. Needs no root, iptables or live queue: ARP protection levels are
+written to a temporary fake /proc/sys and the host ARP table is not
+polled.
+
+Packets are loaded before the measurement and replayed as fast as the
+pipeline allows. Detection windows, rule timestamps and expiry follow the
+capture clock, so the rules generated depend only on the traffic, not on
+the replay throughput.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_replay capture.pcap [more.pcap ...] [--json out.json]
+or on a synthetic trace generated in memory (see benchmarks.traffic):
+    python -m benchmarks.bench_replay --scenario benign:500000 --scenario syn_flood:200000
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import tempfile
+import time
+from collections import Counter
+from benchmarks.traffic import generate
+from src.net_manager.analysis_worker import AnalysisWorker
+from src.net_manager.arp_protection import ArpProtection, make_fake_proc_sys
+from src.net_manager.buffer import PacketBuffer
+from src.net_manager.pipeline import PacketPipeline
+from src.net_manager.rules import Rules
+from src.tools.latency import LatencyHistogram
+from src.tools.pcap import ReplayPacket, read_ipv4_packets
+
+
+def load_packets(paths, limit=None):
+    """Read the IPv4 packets of pcap files, in file order.
+
+    Args:
+        paths (list of str): pcap files.
+        limit (int, optional): Stop after this many packets.
+
+    Returns:
+        list of tuple: (capture time, IPv4 packet bytes).
+    """
+    packets = []
+    for path in paths:
+        for packet in read_ipv4_packets(path):
+            packets.append(packet)
+            if limit is not None and len(packets) >= limit:
+                return packets
+    return packets
+
+
+def replay(packets, period=5.0, pacify=True, flow_cache_size=65536, buffer_options=None):
+    """Run captured packets through the verdict pipeline and analysis cycles.
+
+    Args:
+        packets (list of tuple): (capture time, IPv4 packet bytes).
+        period (float): Seconds of capture time between analysis cycles.
+        pacify (bool): Filter packets; when False every packet is accepted.
+        flow_cache_size (int): Flows whose verdict is cached (0 disables).
+        buffer_options (dict, optional): Keyword arguments of the PacketBuffer.
+
+    Returns:
+        dict: Packets, elapsed seconds, packets per second, callback and
+            analysis cycle latency summaries, verdict counts and the rules
+            generated (rule string -> times sent).
+    """
+    # Capture time of the packet being replayed
+    now = [packets[0][0] if packets else 0.0]
+
+    def clock():
+        return now[0]
+
+    packet_buffer = PacketBuffer(**(buffer_options or {}), clock=clock)
+    packet_buffer.arp_polling = False
+    params = make_fake_proc_sys(tempfile.mkdtemp())
+    rules = Rules(arp_protection=ArpProtection(params=params), clock=clock)
+    pipeline = PacketPipeline(packet_buffer, rules, pacify, flow_cache_size=flow_cache_size)
+
+    # Rules sent to the peers come back through the network thread
+    in_flight = []
+    generated = Counter()
+
+    def send_rules(rule_strs):
+        generated.update(rule_strs)
+        in_flight.extend(rule_strs)
+
+    def read_messages():
+        received = list(in_flight)
+        in_flight.clear()
+        return received
+
+    # No callback_latency: the worker would reset the histogram every cycle
+    worker = AnalysisWorker(packet_buffer, rules, read_messages, send_rules, period, clock=clock)
+    cycle_latency = LatencyHistogram()
+    queued = [(timestamp, ReplayPacket(payload)) for timestamp, payload in packets]
+
+    def run_cycle():
+        cycle_start = time.perf_counter_ns()
+        worker.run_cycle()
+        cycle_latency.record(time.perf_counter_ns() - cycle_start)
+
+    callback = pipeline.print_and_check
+    next_cycle = now[0] + period
+    start = time.perf_counter()
+    for timestamp, packet in queued:
+        now[0] = timestamp
+        if timestamp >= next_cycle:
+            next_cycle = timestamp + period
+            run_cycle()
+        callback(packet)
+    # Analyse the packets since the last cycle, e.g. a trace shorter than the period
+    if queued:
+        run_cycle()
+    elapsed = time.perf_counter() - start
+
+    verdicts = Counter({'accept': pipeline.accepted, 'drop': pipeline.dropped})
+    missing = sum(1 for _, packet in queued if packet.verdict is None)
+    if missing:
+        verdicts['none'] = missing
+    return {
+        'packets': len(queued),
+        'elapsed_s': elapsed,
+        'packets_per_second': len(queued) / elapsed if elapsed > 0 else 0.0,
+        'callback_latency': pipeline.callback_latency.summary(),
+        'analysis_cycles': cycle_latency.summary(),
+        'verdicts': dict(verdicts),
+        'rules_generated': dict(generated.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay pcap files through the filter pipeline")
+    parser.add_argument("pcaps", nargs="*", help="pcap files to replay, in order")
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="Replay a generated scenario:count trace instead (repeatable)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed of the generated trace (default: 0)")
+    parser.add_argument("-p", "--period", type=float, default=5.0,
+                        help="Seconds of capture time between analysis cycles (default: 5.0)")
+    parser.add_argument("-n", "--limit", type=int, help="Replay at most this many packets")
+    parser.add_argument("--no-pacify", action="store_true", help="Accept every packet without lookup")
+    parser.add_argument("--flow-cache-size", type=int, default=65536,
+                        help="Flows whose verdict is cached, 0 disables (default: 65536)")
+    parser.add_argument("--detection", default="window", choices=("window", "sketch", "snapshot"),
+                        help="Detection backend of the packet buffer (default: window)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if not args.pcaps and not args.scenario:
+        parser.error("give pcap files or at least one --scenario")
+
+    logging.getLogger('BasicLogger').setLevel(logging.WARNING)
+    if args.scenario:
+        packets = generate(args.scenario, args.seed).ipv4_packets()[:args.limit]
+    else:
+        packets = load_packets(args.pcaps, args.limit)
+    # Silence the analysis report printed every cycle
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = replay(packets, args.period, not args.no_pacify, args.flow_cache_size,
+                         {'detection': args.detection})
+
+    latency = results['callback_latency']
+    print(f"packets        {results['packets']}")
+    print(f"packets/s      {results['packets_per_second']:,.0f}")
+    print(f"callback us    p50 {latency['p50_us']:.2f}  p90 {latency['p90_us']:.2f}  "
+          f"p99 {latency['p99_us']:.2f}  p99.9 {latency['p999_us']:.2f}  max {latency['max_us']:.2f}")
+    cycles = results['analysis_cycles']
+    print(f"analysis ms    {cycles['count']} cycles, p50 {cycles['p50_us'] / 1000:.2f}  "
+          f"max {cycles['max_us'] / 1000:.2f}")
+    print(f"verdicts       {results['verdicts']}")
+    print(f"rules          {len(results['rules_generated'])} distinct")
+    for rule, count in results['rules_generated'].items():
+        print(f"  {count:>5}  {rule}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the rule matching engine.
+
+Measures the cost of a single `Rules.blocking_rules` verdict with an
+increasing number of active rules, for both a packet that matches no rule
+and a packet that is blocked by one.
+
+Run from the router_code directory:
+    python -m benchmarks.bench_rules
+"""
+import argparse
+import time
+from src.net_manager.rules import Rule, Rules
+
+
+def build_rules(rule_count):
+    """Create a Rules object holding `rule_count` spoofed-source SYN rules.
+
+    Args:
+        rule_count (int): Number of rules to activate.
+
+    Returns:
+        Rules: Populated rule set.
+    """
+    rules = Rules()
+    for i in range(rule_count):
+        target = f"10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}"
+        rules.add_rule(Rule("src", target, "SYN"))
+    return rules
+
+
+def time_verdicts(rules, src, dst, flag, iterations):
+    """Return the mean cost of one verdict in nanoseconds.
+
+    Args:
+        rules (Rules): Rule set under test.
+        src (str): Packet source address.
+        dst (str): Packet destination address.
+        flag (str): Packet TCP flag.
+        iterations (int): Number of verdicts to time.
+
+    Returns:
+        float: Mean nanoseconds per verdict.
+    """
+    check = rules.blocking_rules
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        check(src, dst, flag)
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule lookup benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=200000,
+                        help="Verdicts timed per rule count (default: 200000)")
+    args = parser.parse_args()
+
+    print(f"{'rules':>8} {'miss ns':>10} {'hit ns':>10}")
+    for rule_count in (10, 100, 1000, 10000, 100000):
+        rules = build_rules(rule_count)
+        miss = time_verdicts(rules, "192.168.1.1", "10.1.0.5", "SYN", args.iterations)
+        hit = time_verdicts(rules, "10.0.0.7", "10.1.0.5", "SYN", args.iterations)
+        print(f"{rule_count:>8} {miss:>10.1f} {hit:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Synthetic traffic traces for benchmarks.
+
+Builds packets directly as rows of a NumPy byte array (one 60-byte
+Ethernet frame per row, the minimum Ethernet frame size), filling every
+header field for all packets at once, checksums included. Traces are kept
+in memory or written to pcap files; nothing is ever sent on a wire.
+Generation is seeded so benchmark runs are reproducible.
+
+Scenarios mirror the attack tools in `attacks/`:
+    benign       - TCP client/server mix (ACK, PSH/ACK, some SYN and FIN)
+    syn_flood    - SYNs to one port, from one host or spoofed sources
+                   (attacks/synflood_tool.py)
+    ssh          - repeated SSH SYNs from a few sources
+    arp_flood    - ARP request/reply pairs with random 02:xx MACs and
+                   addresses in a prefix (attacks/arpflood_tool.py)
+
+Write a trace from the router_code directory:
+    python -m benchmarks.traffic trace.pcap benign:1000000 syn_flood:500000 --seed 1
+"""
+import argparse
+import socket
+import time
+import numpy as np
+
+FRAME_SIZE = 60
+ETH_HEADER = 14
+IP_HEADER = 20
+TCP_HEADER = 20
+IP_PACKET_SIZE = IP_HEADER + TCP_HEADER
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_ARP = 0x0806
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+ROUTER_MAC = bytes.fromhex('020000000001')
+HOST_MAC = bytes.fromhex('020000000002')
+BROADCAST_MAC = b'\xff' * 6
+
+PCAP_RECORD_DTYPE = np.dtype([
+    ('ts_sec', '<u4'),
+    ('ts_usec', '<u4'),
+    ('incl_len', '<u4'),
+    ('orig_len', '<u4'),
+    ('frame', 'u1', (FRAME_SIZE,)),
+])
+
+
+def ip_array(address):
+    """Return a dotted IPv4 address as a NumPy uint32."""
+    return np.uint32(int.from_bytes(socket.inet_aton(address), 'big'))
+
+
+def _put(frames, offset, values, width):
+    """Write big-endian unsigned integers of `width` bytes into a column of every frame."""
+    values = np.broadcast_to(np.asarray(values, dtype=np.uint64), (len(frames),))
+    for i in range(width):
+        frames[:, offset + i] = (values >> np.uint64(8 * (width - 1 - i))) & np.uint64(0xff)
+
+
+def _put_bytes(frames, offset, data):
+    """Write the same bytes (or one row of bytes per frame) at an offset of every frame."""
+    data = np.asarray(data if isinstance(data, np.ndarray) else np.frombuffer(data, np.uint8))
+    frames[:, offset:offset + data.shape[-1]] = data
+
+
+def _checksum(words):
+    """Return the Internet checksum of each row of big-endian 16-bit words."""
+    total = words.sum(axis=1, dtype=np.uint64)
+    while np.any(total >> np.uint64(16)):
+        total = (total & np.uint64(0xffff)) + (total >> np.uint64(16))
+    return (~total) & np.uint64(0xffff)
+
+
+def _words(frames, start, end):
+    """Return bytes start:end of every frame as big-endian 16-bit words."""
+    return np.ascontiguousarray(frames[:, start:end]).view('>u2').astype(np.uint64)
+
+
+def _arrival_times(rng, count, rate, start):
+    """Return Poisson arrival times of `count` packets at `rate` packets per second."""
+    return start + np.cumsum(rng.exponential(1.0 / rate, count))
+
+
+class Trace:
+    """Packets as capture times plus a (count, FRAME_SIZE) array of Ethernet frames."""
+
+    def __init__(self, times, frames):
+        self.times = times
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def merge(cls, *traces):
+        """Interleave traces by capture time."""
+        times = np.concatenate([trace.times for trace in traces])
+        frames = np.concatenate([trace.frames for trace in traces])
+        order = np.argsort(times, kind='stable')
+        return cls(times[order], frames[order])
+
+    def ipv4_packets(self):
+        """Return the IPv4 packets as NFQUEUE delivers them.
+
+        Returns:
+            list of tuple: (capture time, IPv4 packet bytes), ARP frames skipped.
+        """
+        ethertype = (self.frames[:, 12].astype(np.uint16) << 8) | self.frames[:, 13]
+        selected = np.flatnonzero(ethertype == ETHERTYPE_IPV4)
+        # Every generated IPv4 packet is IP_PACKET_SIZE bytes long
+        payloads = self.frames[selected, ETH_HEADER:ETH_HEADER + IP_PACKET_SIZE]
+        return list(zip(self.times[selected].tolist(), map(bytes, payloads)))
+
+    def write_pcap(self, path):
+        """Write the trace as a pcap file (Ethernet, microsecond timestamps)."""
+        records = np.empty(len(self), dtype=PCAP_RECORD_DTYPE)
+        microseconds = np.round(self.times * 1e6).astype(np.uint64)
+        records['ts_sec'] = microseconds // 1000000
+        records['ts_usec'] = microseconds % 1000000
+        records['incl_len'] = FRAME_SIZE
+        records['orig_len'] = FRAME_SIZE
+        records['frame'] = self.frames
+        with open(path, 'wb') as file:
+            file.write(np.array([0xa1b2c3d4], '<u4').tobytes())
+            file.write(np.array([2, 4], '<u2').tobytes())
+            file.write(np.array([0, 0, 65535, 1], '<u4').tobytes())
+            records.tofile(file)
+
+
+def tcp_frames(src, dst, sport, dport, flags, seq, window, ip_id):
+    """Build Ethernet/IPv4/TCP frames with valid checksums.
+
+    Every argument is an array with one value per packet (or a scalar).
+
+    Returns:
+        numpy.ndarray: (count, FRAME_SIZE) uint8 frames.
+    """
+    count = len(src)
+    frames = np.zeros((count, FRAME_SIZE), dtype=np.uint8)
+    _put_bytes(frames, 0, ROUTER_MAC)
+    _put_bytes(frames, 6, HOST_MAC)
+    _put(frames, 12, ETHERTYPE_IPV4, 2)
+
+    ip = ETH_HEADER
+    frames[:, ip] = 0x45
+    _put(frames, ip + 2, IP_PACKET_SIZE, 2)
+    _put(frames, ip + 4, ip_id, 2)
+    _put(frames, ip + 6, 0x4000, 2)  # Don't fragment
+    frames[:, ip + 8] = 64
+    frames[:, ip + 9] = socket.IPPROTO_TCP
+    _put(frames, ip + 12, src, 4)
+    _put(frames, ip + 16, dst, 4)
+    _put(frames, ip + 10, _checksum(_words(frames, ip, ip + IP_HEADER)), 2)
+
+    tcp = ip + IP_HEADER
+    _put(frames, tcp, sport, 2)
+    _put(frames, tcp + 2, dport, 2)
+    _put(frames, tcp + 4, seq, 4)
+    frames[:, tcp + 12] = 0x50
+    _put(frames, tcp + 13, flags, 1)
+    _put(frames, tcp + 14, window, 2)
+    # Pseudo header: addresses, protocol and TCP length
+    pseudo = (_words(frames, ip + 12, ip + 20).sum(axis=1, dtype=np.uint64)
+              + np.uint64(socket.IPPROTO_TCP + TCP_HEADER))
+    words = np.concatenate((_words(frames, tcp, tcp + TCP_HEADER), pseudo[:, None]), axis=1)
+    _put(frames, tcp + 16, _checksum(words), 2)
+    return frames
+
+
+def arp_frames(op, src_mac, src_ip, dst_mac, target_ip):
+    """Build Ethernet/ARP frames broadcast from `src_mac`.
+
+    Args:
+        op (numpy.ndarray): ARP operation per packet (1 request, 2 reply).
+        src_mac (numpy.ndarray): (count, 6) sender hardware addresses.
+        src_ip (numpy.ndarray): Sender protocol addresses.
+        dst_mac (numpy.ndarray): (count, 6) target hardware addresses.
+        target_ip (int): Target protocol address.
+
+    Returns:
+        numpy.ndarray: (count, FRAME_SIZE) uint8 frames.
+    """
+    frames = np.zeros((len(op), FRAME_SIZE), dtype=np.uint8)
+    _put_bytes(frames, 0, BROADCAST_MAC)
+    _put_bytes(frames, 6, src_mac)
+    _put(frames, 12, ETHERTYPE_ARP, 2)
+    arp = ETH_HEADER
+    _put(frames, arp, 1, 2)  # Ethernet
+    _put(frames, arp + 2, ETHERTYPE_IPV4, 2)
+    frames[:, arp + 4] = 6
+    frames[:, arp + 5] = 4
+    _put(frames, arp + 6, op, 2)
+    _put_bytes(frames, arp + 8, src_mac)
+    _put(frames, arp + 14, src_ip, 4)
+    _put_bytes(frames, arp + 18, dst_mac)
+    _put(frames, arp + 24, target_ip, 4)
+    return frames
+
+
+def random_ips(rng, count):
+    """Random addresses with every octet in 1-254, like `generate_random_ip` of the SYN flood tool."""
+    octets = rng.integers(1, 255, size=(count, 4), dtype=np.uint32)
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def hosts_in(rng, count, prefix, first=2, last=254):
+    """Random host addresses `prefix.first` to `prefix.last` of a /24 given as 'a.b.c'."""
+    return ip_array(prefix + '.0') + rng.integers(first, last + 1, size=count, dtype=np.uint32)
+
+
+def benign(count, rng, rate=50000.0, start=0.0, clients='10.1.0', servers='10.2.0',
+           server_count=8, ports=(443, 80, 8080), syn_fraction=0.01):
+    """TCP traffic between a client /24 and a few servers.
+
+    Args:
+        count (int): Packets.
+        rng (numpy.random.Generator): Random source.
+        rate (float): Packets per second.
+        start (float): Capture time of the trace start.
+        clients (str): /24 of the clients, as 'a.b.c'.
+        servers (str): /24 of the servers, as 'a.b.c'.
+        server_count (int): Servers, `servers.10` upwards.
+        ports (tuple of int): Server ports.
+        syn_fraction (float): Fraction of connection-opening SYNs.
+
+    Returns:
+        Trace: The packets.
+    """
+    src = hosts_in(rng, count, clients)
+    dst = ip_array(servers + '.10') + rng.integers(0, server_count, size=count, dtype=np.uint32)
+    kind = rng.random(count)
+    fin_fraction = syn_fraction
+    flags = np.where(kind < syn_fraction, TCP_SYN,
+                     np.where(kind < syn_fraction + fin_fraction, TCP_FIN | TCP_ACK,
+                              np.where(kind < 0.7, TCP_ACK, TCP_PSH | TCP_ACK)))
+    frames = tcp_frames(src, dst,
+                        rng.integers(1024, 65536, size=count),
+                        rng.choice(np.asarray(ports), size=count),
+                        flags,
+                        rng.integers(0, 1 << 32, size=count, dtype=np.uint64),
+                        rng.integers(1024, 65536, size=count),
+                        rng.integers(0, 65536, size=count))
+    return Trace(_arrival_times(rng, count, rate, start), frames)
+
+
+def syn_flood(count, rng, rate=100000.0, start=0.0, target='10.2.0.9', port=80, spoof=True,
+              source='10.4.0.2'):
+    """SYN flood to one port, as sent by attacks/synflood_tool.py.
+
+    Args:
+        count (int): Packets.
+        rng (numpy.random.Generator): Random source.
+        rate (float): Packets per second.
+        start (float): Capture time of the trace start.
+        target (str): Target host.
+        port (int): Target port.
+        spoof (bool): Random source address per packet instead of `source`.
+        source (str): Attacker address when not spoofing.
+
+    Returns:
+        Trace: The packets.
+    """
+    src = random_ips(rng, count) if spoof else np.full(count, ip_array(source), dtype=np.uint32)
+    frames = tcp_frames(src, ip_array(target),
+                        rng.integers(0, 65536, size=count),
+                        port,
+                        TCP_SYN,
+                        rng.integers(1000, 9001, size=count),
+                        rng.integers(1000, 9001, size=count),
+                        rng.integers(0, 65536, size=count))
+    return Trace(_arrival_times(rng, count, rate, start), frames)
+
+
+def ssh(count, rng, rate=2000.0, start=0.0, target='10.2.0.7', sources=('10.3.0.2', '10.3.0.3', '10.3.0.4')):
+    """Repeated SSH connection attempts (SYNs to port 22) from a few sources.
+
+    Args:
+        count (int): Packets.
+        rng (numpy.random.Generator): Random source.
+        rate (float): Packets per second.
+        start (float): Capture time of the trace start.
+        target (str): SSH server.
+        sources (tuple of str): Attacking hosts.
+
+    Returns:
+        Trace: The packets.
+    """
+    src = np.array([ip_array(source) for source in sources], dtype=np.uint32)[
+        rng.integers(0, len(sources), size=count)]
+    frames = tcp_frames(src, ip_array(target),
+                        rng.integers(1024, 65536, size=count),
+                        22,
+                        TCP_SYN,
+                        rng.integers(0, 1 << 32, size=count, dtype=np.uint64),
+                        64240,
+                        rng.integers(0, 65536, size=count))
+    return Trace(_arrival_times(rng, count, rate, start), frames)
+
+
+def arp_flood(count, rng, rate=20000.0, start=0.0, target='10.2.0.1', network='10.2.0'):
+    """ARP request/reply pairs with random MACs, as sent by attacks/arpflood_tool.py.
+
+    Every random sender sends a who-has request for `target` followed by an
+    is-at reply, both broadcast.
+
+    Args:
+        count (int): Packets (rounded up to an even number).
+        rng (numpy.random.Generator): Random source.
+        rate (float): Packets per second.
+        start (float): Capture time of the trace start.
+        target (str): Router or device the requests are for.
+        network (str): Prefix of the spoofed sender addresses, e.g. '192.168.1'.
+
+    Returns:
+        Trace: The packets.
+    """
+    pairs = (count + 1) // 2
+    macs = np.empty((pairs, 6), dtype=np.uint8)
+    macs[:, 0] = 0x02
+    macs[:, 1:] = rng.integers(0, 256, size=(pairs, 5), dtype=np.uint8)
+    octets = network.split('.')
+    free = 4 - len(octets)
+    base = int.from_bytes(socket.inet_aton('.'.join(octets + ['0'] * free)), 'big')
+    src_ip = np.full(pairs, base, dtype=np.uint32)
+    for i in range(free):
+        src_ip |= rng.integers(1, 255, size=pairs, dtype=np.uint32) << np.uint32(8 * i)
+
+    op = np.tile(np.array([1, 2], dtype=np.uint16), pairs)
+    dst_mac = np.zeros((2 * pairs, 6), dtype=np.uint8)
+    dst_mac[1::2] = 0xff
+    frames = arp_frames(op, np.repeat(macs, 2, axis=0), np.repeat(src_ip, 2), dst_mac, ip_array(target))
+    times = np.repeat(_arrival_times(rng, pairs, rate / 2, start), 2)
+    return Trace(times, frames)
+
+
+SCENARIOS = {
+    'benign': benign,
+    'syn_flood': lambda count, rng, **options: syn_flood(count, rng, spoof=True, **options),
+    'syn_flood_direct': lambda count, rng, **options: syn_flood(count, rng, spoof=False, **options),
+    'ssh': ssh,
+    'arp_flood': arp_flood,
+}
+
+
+def generate(specs, seed=0, start=0.0):
+    """Build and interleave several scenarios.
+
+    Args:
+        specs (list of str): 'scenario:count' entries, e.g. 'benign:100000';
+            all scenarios start at `start` and overlap.
+        seed (int): Random seed.
+        start (float): Capture time of the trace start.
+
+    Returns:
+        Trace: The merged packets.
+
+    Raises:
+        ValueError: If a spec names an unknown scenario or has no valid count.
+    """
+    rng = np.random.default_rng(seed)
+    traces = []
+    for spec in specs:
+        name, _, count = spec.partition(':')
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+        try:
+            count = int(count)
+        except ValueError:
+            raise ValueError(f"Scenario {spec} needs a packet count, e.g. {name}:100000")
+        traces.append(SCENARIOS[name](count, rng, start=start))
+    return Trace.merge(*traces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic traffic trace to a pcap file")
+    parser.add_argument("output", help="pcap file to write")
+    parser.add_argument("scenarios", nargs="+",
+                        help=f"scenario:count entries; scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    trace = generate(args.scenarios, args.seed)
+    generated = time.perf_counter() - start
+    trace.write_pcap(args.output)
+    print(f"{len(trace)} packets generated in {generated:.2f}s "
+          f"({len(trace) / generated:,.0f} packets/s), written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
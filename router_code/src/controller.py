@@ -14,8 +14,10 @@ import yaml
 import threading
 import netifaces
 import ipaddress
+from src.tools.event_log import configure_event_log
 from src.tools.logger import Logger
 from src.net_manager.filter import Filter
+from src.net_manager.multi_queue import MultiQueueFilter
 from src.route_setup.route_setup import RouterSetup
 
 log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
@@ -45,6 +47,32 @@ class Controller:
         """
         default_config = {
             'test': '1234',
+            'debug_decode': False,
+            'kernel_offload': 'none',
+            'flow_cache_size': 65536,
+            'queue_balance': '',
+            'buffer_capacity': 524288,
+            'detection_backend': 'window',
+            'detection_window': 5.0,
+            'detection_bucket': 1.0,
+            'sketch_epsilon': 0.001,
+            'sketch_delta': 0.01,
+            'sketch_top_k': 64,
+            'aggregate_density': 0.0625,
+            'neighbour_monitor': True,
+            'arp_hold_time': 30.0,
+            'event_log': 'events.jsonl',
+            'event_log_max_bytes': 16777216,
+            'event_log_backups': 5,
+            'event_log_queue_size': 65536,
+            'metrics_port': 9101,
+            'profile_socket': '/tmp/router_profile.sock',
+            'profile_sample_every': 100,
+            'packet_source': 'nfqueue',
+            'capture_interface': '',
+            'pcap_file': '',
+            'pcap_speed': 1.0,
+            'inline_routers': [],
         }
 
         try:
@@ -71,6 +99,64 @@ class Controller:
 
         # Set system variable from config
         self.config_test = config.get('test', '4567')
+        # Decode every queued packet with scapy (slow, debugging only)
+        self.debug_decode = bool(config.get('debug_decode', False))
+        # Kernel offload backend for block rules: none, nftables or dry-run
+        self.kernel_offload = config.get('kernel_offload', 'none')
+        # Number of flows whose verdict is cached (0 disables the cache)
+        self.flow_cache_size = int(config.get('flow_cache_size', 65536))
+        # NFQUEUE range "first:last" matching iptables --queue-balance;
+        # empty to bind a single queue chosen at startup
+        self.queue_balance = config.get('queue_balance', '') or ''
+        # Packet buffer settings: ring size (per queue), detection backend
+        # (window, sketch or snapshot), sliding window length and expiry
+        # granularity in seconds, sketch error bounds, and the fraction of
+        # a /24 or /16 that must offend before it is blocked as a prefix
+        self.buffer_options = {
+            'capacity': int(config.get('buffer_capacity', 524288)),
+            'detection': config.get('detection_backend', 'window'),
+            'window': float(config.get('detection_window', 5.0)),
+            'bucket': float(config.get('detection_bucket', 1.0)),
+            'sketch_epsilon': float(config.get('sketch_epsilon', 0.001)),
+            'sketch_delta': float(config.get('sketch_delta', 0.01)),
+            'sketch_top_k': int(config.get('sketch_top_k', 64)),
+            'aggregate_density': float(config.get('aggregate_density', 0.0625)),
+        }
+        # Raise ARP rules from rtnetlink neighbour events as they happen
+        # instead of polling the ARP table every analysis cycle
+        self.neighbour_monitor = bool(config.get('neighbour_monitor', True))
+        # Seconds a lower ARP alert level must persist before relaxing the
+        # kernel protection (avoids flapping during a flood)
+        self.arp_hold_time = float(config.get('arp_hold_time', 30.0))
+        # Structured JSONL event log of analysis results, rule changes and
+        # ARP level changes (empty to disable), rotated by size; events are
+        # dropped and counted when more than the queue size are pending
+        self.event_log = config.get('event_log', 'events.jsonl') or ''
+        self.event_log_options = {
+            'max_bytes': int(config.get('event_log_max_bytes', 16777216)),
+            'backups': int(config.get('event_log_backups', 5)),
+            'queue_size': int(config.get('event_log_queue_size', 65536)),
+        }
+        # Local HTTP port serving Prometheus metrics on /metrics (0 to disable);
+        # the single-queue process of queue N uses metrics_port + N - 1
+        self.metrics_port = int(config.get('metrics_port', 9101) or 0)
+        # Per-stage profiling, off until toggled with SIGUSR2 or a command on
+        # this Unix socket (empty to disable the socket), suffixed with the
+        # queue number of single-queue and multi-queue worker processes;
+        # samples 1 in N packets
+        self.profile_socket = config.get('profile_socket', '/tmp/router_profile.sock') or ''
+        self.profile_sample_every = int(config.get('profile_sample_every', 100))
+        # Where packets come from: 'nfqueue' (inline filtering), 'af_packet'
+        # (passive, detection-only capture on capture_interface, e.g. a
+        # mirror port) or 'pcap' (replay of pcap_file)
+        self.packet_source = config.get('packet_source', 'nfqueue') or 'nfqueue'
+        self.capture_interface = config.get('capture_interface', '') or ''
+        self.pcap_file = config.get('pcap_file', '') or ''
+        # Replay speed of the pcap source relative to its timestamps (0: unpaced)
+        self.pcap_speed = float(config.get('pcap_speed', 1.0))
+        # Router numbers generated rules are sent to, e.g. the inline routers
+        # enforcing what a passive source detects (empty: this router)
+        self.inline_routers = [int(router) for router in config.get('inline_routers') or []]
 
     def __init__(self):
         """Initialize the Controller.
@@ -94,19 +180,42 @@ class Controller:
         """Execute the main system workflow.
 
         Prompts the user for:
-          - Queue number selection (1 or 2)
+          - Queue number selection (1 or 2), unless a queue range is
+            configured with `queue_balance`
           - Router pacify option (yes/no)
+        Neither is asked for a passive packet source, which analyses every
+        packet and is not bound to a queue.
 
         Then initializes the packet filter with the chosen parameters
-        and enters the processing loop.
+        and enters the processing loop. With a queue range, one filtering
+        process is started per queue.
 
         Returns:
             None
         """
         log.log("===== Starting System =====", logging.INFO)
+        configure_event_log(self.event_log, **self.event_log_options)
+
+        queue_range = None
+        if self.queue_balance:
+            try:
+                first_queue, last_queue = (int(q) for q in str(self.queue_balance).split(':'))
+                if first_queue <= last_queue:
+                    queue_range = (first_queue, last_queue)
+            except ValueError:
+                pass
+            if queue_range is None:
+                log.log(f"Invalid queue_balance: {self.queue_balance}", logging.ERROR)
+            elif self.packet_source != 'nfqueue':
+                log.log("queue_balance only applies to the nfqueue packet source, ignoring it",
+                        logging.WARNING)
+                queue_range = None
+
+        inline = self.packet_source == 'nfqueue'
+        queue_num = 0
 
         # Prompt for queue number
-        while True:
+        while queue_range is None and inline:
             try:
                 queue_num = int(input("Queue Number (1 or 2): "))
                 if queue_num in (1, 2):
@@ -116,7 +225,8 @@ class Controller:
                 print("Invalid input, please enter a number.")
 
         # Prompt for pacify option
-        while True:
+        pacify = True
+        while inline:
             try:
                 pacify_input = input("Pacify router? (y/n): ").strip().lower()
                 if pacify_input in ('y', 'n'):
@@ -126,11 +236,44 @@ class Controller:
             except Exception:
                 print("Invalid input, please try again.")
 
+        if queue_range is not None:
+            self.filer_2 = MultiQueueFilter(
+                queue_range[0],
+                queue_range[1],
+                self.route_manager.return_router_number(),
+                pacify,
+                debug_decode=self.debug_decode,
+                offload_backend=self.kernel_offload,
+                flow_cache_size=self.flow_cache_size,
+                buffer_options=self.buffer_options,
+                neighbour_monitor=self.neighbour_monitor,
+                arp_hold_time=self.arp_hold_time,
+                metrics_port=self.metrics_port,
+                profile_socket=self.profile_socket,
+                profile_sample_every=self.profile_sample_every
+            )
+            log.log("===== System Terminated =====", logging.INFO)
+            return
+
         # Initialize packet filter with user parameters
         self.filer_2 = Filter(
             queue_num,
             self.route_manager.return_router_number(),
-            pacify
+            pacify,
+            debug_decode=self.debug_decode,
+            offload_backend=self.kernel_offload,
+            flow_cache_size=self.flow_cache_size,
+            buffer_options=self.buffer_options,
+            neighbour_monitor=self.neighbour_monitor,
+            arp_hold_time=self.arp_hold_time,
+            metrics_port=self.metrics_port,
+            profile_socket=self.profile_socket,
+            profile_sample_every=self.profile_sample_every,
+            packet_source=self.packet_source,
+            capture_interface=self.capture_interface,
+            pcap_file=self.pcap_file,
+            pcap_speed=self.pcap_speed,
+            inline_routers=self.inline_routers
         )
 
         log.log("===== System Terminated =====", logging.INFO)
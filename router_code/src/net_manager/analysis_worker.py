@@ -0,0 +1,185 @@
+"""
+Background analysis worker for the packet filter.
+
+Runs the periodic work that used to happen inside the NFQUEUE callback
+(reading inter-router messages, expiring and adding rules, analysing the
+packet buffer and sending the generated rules) on a dedicated thread, so
+the callback only parses, buffers, looks up and issues a verdict.
+"""
+import logging
+import threading
+import time
+from src.net_manager.rules import RuleSendFilter
+from src.tools import event_log
+from src.tools.logger import Logger
+from src.tools.profiler import PROFILER
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+
+class AnalysisWorker(threading.Thread):
+    """Thread running one analysis cycle every `period` seconds."""
+
+    def __init__(self, packet_buffer, rules, read_messages, send_rules, period=5,
+                 callback_latency=None, flow_cache=None, metrics=None, profiler=PROFILER,
+                 clock=time.time):
+        """Initialise the worker.
+
+        Args:
+            packet_buffer (PacketBuffer): Buffer filled by the packet callback.
+            rules (Rules): Active rule set shared with the packet callback.
+            read_messages (callable): Returns the rules received from other
+                routers since the last call.
+            send_rules (callable): Sends a list of generated rule strings to
+                the peers.
+            period (float): Seconds between analysis cycles.
+            callback_latency (LatencyHistogram, optional): Histogram filled by
+                the packet callback; summarised and reset every cycle.
+            flow_cache (FlowCache, optional): Verdict cache whose counters
+                are logged every cycle.
+            metrics (MetricsRegistry, optional): Registry the callback
+                latency, analysis duration and packet rate are exposed in.
+            profiler (StageProfiler): Times the stages of each cycle while enabled.
+            clock (callable): Returns the current time in seconds, used for
+                cycle deadlines and rule expiry (a replay passes the capture
+                clock and calls `run_cycle` itself).
+        """
+        super().__init__(name="analysis-worker", daemon=True)
+        self.packet_buffer = packet_buffer
+        self.rules = rules
+        self.read_messages = read_messages
+        self.send_rules = send_rules
+        self.period = period
+        self.clock = clock
+        self.callback_latency = callback_latency
+        self.flow_cache = flow_cache
+        self.profiler = profiler
+        # Rules still active from an earlier send are not sent again until
+        # they would expire before the cycle after next
+        self.send_filter = RuleSendFilter(2 * period)
+        self.stop_event = threading.Event()
+        # Set to re-evaluate the next deadline (stop, or rules added by
+        # another thread that may expire first)
+        self.wakeup = threading.Event()
+        # Packets per second over the last cycle, from the callback latency samples
+        self.packets_per_second = 0.0
+        self.last_cycle = time.time()
+        self.latency_metric = None
+        self.analysis_metric = None
+        if metrics is not None:
+            self.latency_metric = metrics.histogram(
+                'router_callback_latency_seconds', 'NFQUEUE callback latency')
+            self.analysis_metric = metrics.histogram(
+                'router_analysis_duration_seconds', 'Duration of the buffer analysis of a cycle')
+            metrics.gauge('router_packets_per_second', 'Packets per second over the last analysis cycle',
+                          lambda: self.packets_per_second)
+
+    def run(self):
+        """Run analysis cycles until `stop` is called.
+
+        Between cycles the worker also wakes up when the next rule expires,
+        so rules are removed on time rather than up to a period late.
+        """
+        next_cycle = self.clock() + self.period
+        while not self.stop_event.is_set():
+            deadline = next_cycle
+            with self.rules.update_lock:
+                next_expiry = self.rules.next_expiry()
+            if next_expiry is not None:
+                deadline = min(deadline, next_expiry)
+            self.wakeup.wait(max(0.0, deadline - self.clock()))
+            self.wakeup.clear()
+            if self.stop_event.is_set():
+                break
+
+            now = self.clock()
+            try:
+                if now >= next_cycle:
+                    next_cycle = max(next_cycle + self.period, now)
+                    self.run_cycle()
+                else:
+                    self.expire_rules(now)
+            except Exception as e:
+                log.log(f"Analysis cycle failed: {e}", logging.ERROR)
+
+    def stop(self):
+        """Ask the worker to exit after the current cycle."""
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def expire_rules(self, time_current=None):
+        """Remove expired rules in place, without rebuilding the index.
+
+        Args:
+            time_current (float, optional): Expiry reference time, defaults
+                to the current time.
+
+        Returns:
+            list of Rule: The rules removed.
+        """
+        if time_current is None:
+            time_current = self.clock()
+        with self.rules.update_lock:
+            return self.rules.clear_rules(time_current)
+
+    def apply_rules(self, rule_strs, time_current=None):
+        """Expire old rules and add new ones as a single published update.
+
+        Safe to call from other threads, e.g. the neighbour monitor.
+
+        Args:
+            rule_strs (list): Rule strings or Rule objects to add.
+            time_current (float, optional): Expiry reference time, defaults
+                to the current time.
+        """
+        if time_current is None:
+            time_current = self.clock()
+        with self.rules.update_lock:
+            # Readers keep using the old rule set until the new one is complete
+            self.rules.begin_update()
+            try:
+                self.rules.clear_rules(time_current)
+                self.rules.add_rules(rule_strs)
+            finally:
+                self.rules.publish()
+        if threading.current_thread() is not self:
+            self.wakeup.set()
+
+    def run_cycle(self):
+        """Update the rule set and analyse the packets buffered since the last cycle.
+
+        Returns:
+            tuple:
+                results (dict): Analysis metrics from the packet buffer.
+                new_rules (list of str): Rules generated and sent this cycle
+                    (new, or refreshing ones about to expire).
+        """
+        profiler = self.profiler
+        with profiler.stage('messages'):
+            rule_strs = self.read_messages()
+        with profiler.stage('expiry'):
+            self.apply_rules(rule_strs)
+
+        analysis_start = time.perf_counter_ns()
+        with profiler.stage('analysis'):
+            results, new_rules = self.packet_buffer.analyze_packet_patterns()
+        if self.analysis_metric is not None:
+            self.analysis_metric.observe(time.perf_counter_ns() - analysis_start)
+        event_log.emit(event_log.ANALYSIS, **self.packet_buffer.results_summary(results, new_rules))
+        new_rules = self.send_filter.filter(new_rules, self.clock())
+        if new_rules:
+            self.send_rules(new_rules)
+
+        if self.callback_latency is not None:
+            window = self.callback_latency.reset()
+            now = time.time()
+            self.packets_per_second = window.total / max(now - self.last_cycle, 1e-6)
+            self.last_cycle = now
+            if self.latency_metric is not None:
+                self.latency_metric.merge(window)
+            log.log(f"Callback latency: {window.summary()}", logging.DEBUG)
+        if self.flow_cache is not None:
+            log.log(f"Flow cache: {self.flow_cache.stats()}", logging.DEBUG)
+        profiler.end_cycle()
+
+        return results, new_rules
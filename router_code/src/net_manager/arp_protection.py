@@ -1,7 +1,147 @@
-import subprocess
+"""
+Kernel ARP protection levels.
+
+Each level maps to a set of neighbour-table and reverse-path-filter
+sysctls. Values are read from and written to `/proc/sys` in-process, and
+only the ones that differ from the running kernel are written, so an
+unchanged or repeated level costs a few small reads instead of a sudo
+sysctl fork per parameter.
+"""
 import logging
+import os
+import subprocess
+import time
+from src.tools import event_log
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+PROC_SYS_ROOT = '/proc/sys'
+
+# Level 1: Normal/Baseline Protection
+# Level 2: Elevated Awareness
+# Level 3: High Alert
+# Level 4: Under ARP Attack
+ARP_PROTECTION_LEVELS = {
+    1: {
+        'net.ipv4.neigh.default.gc_stale_time': 60,
+        'net.ipv4.neigh.default.gc_thresh1': 128,
+        'net.ipv4.neigh.default.gc_thresh2': 512,
+        'net.ipv4.neigh.default.gc_thresh3': 1024,
+        'net.ipv4.conf.all.rp_filter': 1,
+        'net.ipv4.conf.default.rp_filter': 1,
+    },
+    2: {
+        'net.ipv4.neigh.default.gc_stale_time': 45,
+        'net.ipv4.neigh.default.gc_thresh1': 256,
+        'net.ipv4.neigh.default.gc_thresh2': 768,
+        'net.ipv4.neigh.default.gc_thresh3': 1536,
+        'net.ipv4.conf.all.rp_filter': 1,
+        'net.ipv4.conf.default.rp_filter': 1,
+    },
+    3: {
+        'net.ipv4.neigh.default.gc_stale_time': 30,
+        'net.ipv4.neigh.default.gc_thresh1': 512,
+        'net.ipv4.neigh.default.gc_thresh2': 1024,
+        'net.ipv4.neigh.default.gc_thresh3': 2048,
+        'net.ipv4.conf.all.rp_filter': 1,
+        'net.ipv4.conf.default.rp_filter': 1,
+    },
+    4: {
+        'net.ipv4.neigh.default.gc_stale_time': 15,
+        'net.ipv4.neigh.default.gc_thresh1': 1024,
+        'net.ipv4.neigh.default.gc_thresh2': 2048,
+        'net.ipv4.neigh.default.gc_thresh3': 4096,
+        'net.ipv4.conf.all.rp_filter': 1,
+        'net.ipv4.conf.default.rp_filter': 1,
+    },
+}
+
+
+class KernelParams:
+    """Idempotent, batched access to sysctls under a `/proc/sys` root."""
+
+    def __init__(self, root=PROC_SYS_ROOT):
+        """Initialise the parameter manager.
+
+        Args:
+            root (str): Directory mirroring `/proc/sys`; a fake root can be
+                given for testing.
+        """
+        self.root = root
+
+    def path(self, key):
+        """Return the file of a dotted sysctl name, e.g. net.ipv4.conf.all.rp_filter."""
+        return os.path.join(self.root, *key.split('.'))
+
+    def read(self, key):
+        """Return the current value of a sysctl as a string, or None if unreadable."""
+        try:
+            with open(self.path(key), 'r') as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    def apply(self, values):
+        """Write the values that differ from the current ones, as one batch.
+
+        Falls back to a single `sudo sysctl -w` call for all differing
+        values if the files cannot be written directly.
+
+        Args:
+            values (dict): Sysctl name -> wanted value.
+
+        Returns:
+            dict: The values that were changed (empty if already applied),
+                or None if the batch could not be applied.
+        """
+        changes = {key: str(value) for key, value in values.items()
+                   if self.read(key) != str(value)}
+        if not changes:
+            return changes
+
+        try:
+            for key, value in changes.items():
+                with open(self.path(key), 'w') as file:
+                    file.write(value)
+            return changes
+        except OSError as e:
+            log.log(f"Direct sysctl write failed ({e}), using sysctl", logging.WARNING)
+
+        if self.root != PROC_SYS_ROOT:
+            return None
+        try:
+            subprocess.run(['sudo', 'sysctl', '-q', '-w'] +
+                           [f'{key}={value}' for key, value in changes.items()], check=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            log.log(f"sysctl batch failed: {e}", logging.ERROR)
+            return None
+        return changes
+
+
+def make_fake_proc_sys(root, level=1):
+    """Create a fake `/proc/sys` tree holding the sysctls of a protection level.
 
-def set_arp_protection_level(level):
+    Args:
+        root (str): Directory to populate.
+        level (int): Protection level whose values are written.
+
+    Returns:
+        KernelParams: Manager operating on the fake tree.
+    """
+    params = KernelParams(root)
+    for key, value in ARP_PROTECTION_LEVELS[level].items():
+        path = params.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(f'{value}\n')
+    return params
+
+
+_default_params = KernelParams()
+
+
+def set_arp_protection_level(level, params=None):
     """
     Configure the Linux kernel with ARP protection measures based on threat level.
 
@@ -11,95 +151,82 @@ def set_arp_protection_level(level):
                2 = Elevated Awareness
                3 = High Alert
                4 = Under ARP Attack
+        params (KernelParams, optional): Sysctl manager, defaults to the
+            live `/proc/sys`.
 
     Returns:
         bool: True if successful, False otherwise
     """
-    if level not in [1, 2, 3, 4]:
+    if level not in ARP_PROTECTION_LEVELS:
         return False
+    if params is None:
+        params = _default_params
+    return params.apply(ARP_PROTECTION_LEVELS[level]) is not None
 
-    try:
-        # Get all network interfaces
-        result = subprocess.run(['ip', 'link', 'show'], capture_output=True, text=True, check=True)
-        interfaces = []
-        for line in result.stdout.split('\n'):
-            if ': ' in line and not line.startswith(' '):
-                # Extract interface name (remove number and colon)
-                interface = line.split(': ')[1].split(':')[0]
-                if interface != 'lo':  # Skip loopback
-                    interfaces.append(interface)
-
-        # Configure protection based on level
-        if level == 1:
-            # Level 1: Normal/Baseline Protection
-            arp_rate_limit = 30
-            gc_stale_time = 60
-            gc_thresh1 = 128
-            gc_thresh2 = 512
-            gc_thresh3 = 1024
-            rp_filter = 1
-        elif level == 2:
-            # Level 2: Elevated Awareness
-            arp_rate_limit = 15
-            gc_stale_time = 45
-            gc_thresh1 = 256
-            gc_thresh2 = 768
-            gc_thresh3 = 1536
-            rp_filter = 1
-        elif level == 3:
-            # Level 3: High Alert
-            arp_rate_limit = 5
-            gc_stale_time = 30
-            gc_thresh1 = 512
-            gc_thresh2 = 1024
-            gc_thresh3 = 2048
-            rp_filter = 1
-        else:  # level == 4
-            # Level 4: Under ARP Attack
-            arp_rate_limit = 2
-            gc_stale_time = 15
-            gc_thresh1 = 1024
-            gc_thresh2 = 2048
-            gc_thresh3 = 4096
-            rp_filter = 1
-            #subprocess.run([
-            #'sudo', 'ip', 'neigh', 'flush', 'all'
-        #], check=True)
-            
-
-        # Configure kernel ARP settings
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.neigh.default.gc_stale_time={gc_stale_time}'
-        ], check=True)
-
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.neigh.default.gc_thresh1={gc_thresh1}'
-        ], check=True)
-
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.neigh.default.gc_thresh2={gc_thresh2}'
-        ], check=True)
-
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.neigh.default.gc_thresh3={gc_thresh3}'
-        ], check=True)
-
-        # Configure Reverse Path Filtering
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.conf.all.rp_filter={rp_filter}'
-        ], check=True)
-
-        subprocess.run([
-            'sudo', 'sysctl', '-w',
-            f'net.ipv4.conf.default.rp_filter={rp_filter}'
-        ], check=True)
-
-        return True
-
-    except subprocess.CalledProcessError as e:
-        return False
+
+class ArpProtection:
+    """Apply ARP alert levels to the kernel with hysteresis.
+
+    A higher level is applied immediately. A lower level is only applied
+    once the requested level has stayed below the current one for
+    `hold_time` seconds, and then to the highest level requested during
+    that time, so the level does not bounce every cycle during a flood.
+    """
+
+    def __init__(self, hold_time=30.0, params=None, enforce=True):
+        """Initialise at level 1.
+
+        Args:
+            hold_time (float): Seconds a lower level must persist before the
+                protection is relaxed.
+            params (KernelParams, optional): Sysctl manager, defaults to the
+                live `/proc/sys`.
+            enforce (bool): Write the levels to the kernel; when False they
+                are only tracked, e.g. on a passive capture host.
+        """
+        self.hold_time = hold_time
+        self.params = params
+        self.enforce = enforce
+        self.level = 1
+        # Start of the current run of lower requests, and their maximum
+        self.lower_since = None
+        self.lower_peak = 1
+
+    def update(self, requested, now=None):
+        """Request an alert level.
+
+        Args:
+            requested (int): Wanted level, clamped to 1-4.
+            now (float, optional): Current time.
+
+        Returns:
+            int: The level in effect after the request.
+        """
+        if now is None:
+            now = time.time()
+        requested = max(1, min(4, requested))
+
+        if requested >= self.level:
+            self.lower_since = None
+            if requested > self.level:
+                self._apply(requested)
+            return self.level
+
+        if self.lower_since is None:
+            self.lower_since = now
+            self.lower_peak = requested
+        else:
+            self.lower_peak = max(self.lower_peak, requested)
+        if now - self.lower_since >= self.hold_time:
+            self.lower_since = None
+            self._apply(self.lower_peak)
+        return self.level
+
+    def _apply(self, level):
+        """Write a level to the kernel and make it current."""
+        if not self.enforce or set_arp_protection_level(level, self.params):
+            log.log(f"===== Arp Protection Level set to - {level}", logging.WARNING)
+            event_log.emit(event_log.ARP_LEVEL, level=level, previous=self.level)
+            self.level = level
+        else:
+            log.log(f"Failed to set Arp Protection Level {level}", logging.ERROR)
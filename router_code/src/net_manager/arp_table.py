@@ -0,0 +1,85 @@
+"""
+In-process reader of the kernel ARP table.
+
+Parses `/proc/net/arp` directly instead of forking a shell pipeline, and
+remembers the MAC addresses seen on the previous read so that each update
+reports the table size, the newly seen MACs and a per-interface breakdown.
+"""
+import logging
+import subprocess
+from collections import Counter, namedtuple
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+ARP_TABLE_PATH = '/proc/net/arp'
+
+ArpSnapshot = namedtuple('ArpSnapshot', ['count', 'new_macs', 'per_interface'])
+
+
+def read_arp_entries(path=ARP_TABLE_PATH):
+    """Read the (MAC address, interface) pairs of the ARP table.
+
+    Falls back to a single `ip neigh show` call if the proc file cannot be read.
+
+    Args:
+        path (str): Location of the proc ARP table.
+
+    Returns:
+        list of tuple: (mac, interface) per neighbour entry.
+    """
+    try:
+        with open(path, 'r') as file:
+            lines = file.read().splitlines()[1:]
+        entries = []
+        for line in lines:
+            # IP address, HW type, Flags, HW address, Mask, Device
+            fields = line.split()
+            if len(fields) >= 6:
+                entries.append((fields[3], fields[5]))
+        return entries
+    except OSError as e:
+        log.log(f"Error reading {path}: {e}", logging.ERROR)
+
+    # Fallback: "<ip> dev <iface> lladdr <mac> <state>"
+    try:
+        output = subprocess.check_output(['ip', 'neigh', 'show'], timeout=10, universal_newlines=True)
+    except (subprocess.SubprocessError, OSError) as e:
+        log.log(f"Error with fallback method: {e}", logging.ERROR)
+        return []
+    entries = []
+    for line in output.splitlines():
+        fields = line.split()
+        interface = fields[fields.index('dev') + 1] if 'dev' in fields[:-1] else ''
+        mac = fields[fields.index('lladdr') + 1] if 'lladdr' in fields[:-1] else ''
+        entries.append((mac, interface))
+    return entries
+
+
+class ArpTable:
+    """Track the ARP table between reads."""
+
+    def __init__(self, path=ARP_TABLE_PATH):
+        """Initialise the tracker with an empty previous MAC set.
+
+        Args:
+            path (str): Location of the proc ARP table.
+        """
+        self.path = path
+        self.macs = set()
+
+    def update(self):
+        """Read the ARP table once and compare it with the previous read.
+
+        Returns:
+            ArpSnapshot: Number of unique MAC addresses, the set of MACs not
+                present on the previous read, and the number of unique MACs
+                per interface.
+        """
+        entries = read_arp_entries(self.path)
+        macs = {mac for mac, _ in entries}
+        per_interface = Counter(interface for _, interface in set(entries))
+
+        new_macs = macs - self.macs
+        self.macs = macs
+        return ArpSnapshot(len(macs), new_macs, dict(per_interface))
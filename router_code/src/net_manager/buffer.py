@@ -1,54 +1,146 @@
 import threading
 import time
+import numpy as np
 from src.net_manager.rules import Rule
+from src.net_manager.arp_table import ArpTable, read_arp_entries
+from src.net_manager.prefix_trie import aggregate_prefixes
+from src.net_manager.packet_parser import int_to_ip, PROTO_TCP, TCP_SYN
+from src.net_manager.sketches import SketchPatternCounter
+from src.net_manager.window_counters import WindowPatternCounter
 import logging
 from src.tools.logger import Logger
 from collections import Counter, defaultdict
-import subprocess
 import re
 from src.net_manager.arp_protection import set_arp_protection_level
 
 log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
 
 
+# One compact row per buffered packet (22 bytes instead of a Python object)
+PACKET_DTYPE = np.dtype([
+    ('time', 'f8'),
+    ('src', 'u4'),
+    ('dst', 'u4'),
+    ('sport', 'u2'),
+    ('dport', 'u2'),
+    ('proto', 'u1'),
+    ('flags', 'u1'),
+])
+
+
 class PacketBuffer:
-    """Buffer incoming packets and analyze them for security threat patterns."""
+    """Buffer incoming packets and analyze them for security threat patterns.
 
-    def __init__(self, max_size=1000, processing_interval=0.5):
+    Packets are stored in a preallocated fixed-capacity ring of compact
+    records (a NumPy structured array), so memory use is predictable and
+    appending a packet does not allocate. When the ring is full the oldest
+    packets are overwritten.
+    """
+
+    def __init__(self, max_size=1000, processing_interval=0.5, capacity=1 << 19,
+                 detection='window', window=5.0, bucket=1.0,
+                 sketch_epsilon=0.001, sketch_delta=0.01, sketch_top_k=64,
+                 aggregate_density=0.0625, clock=time.time):
         """Initialize the packet buffer.
 
         Args:
-            max_size (int): Maximum number of packets to hold before processing.
+            max_size (int): Number of packets of each analysed snapshot that
+                are analysed again with the next one.
             processing_interval (float): Minimum time interval (in seconds)
                 between automatic buffer processing.
+            capacity (int): Number of packets the ring can hold.
+            detection (str): How pattern counts are gathered for detection:
+                'window' - streaming counters over a sliding time window,
+                'sketch' - fixed-memory Count-Min/Space-Saving heavy hitters
+                           per analysis period,
+                'snapshot' - rescan of the ring snapshot every analysis cycle.
+            window (float): Length in seconds of the sliding detection window.
+            bucket (float): Granularity in seconds at which counts expire
+                from the sliding window.
+            sketch_epsilon (float): Count-Min relative error bound.
+            sketch_delta (float): Count-Min failure probability.
+            sketch_top_k (int): Heavy hitters tracked per pattern.
+            aggregate_density (float): Offending sources are blocked with one
+                /24 or /16 rule once they make up this fraction of the
+                prefix's addresses (0 disables aggregation).
+            clock (callable): Returns the current time in seconds; packets
+                are timestamped and detection windows advance with it (a
+                replay passes the capture clock).
         """
-        self.buffer = []
+        self.ring = np.zeros(capacity, dtype=PACKET_DTYPE)
+        self.capacity = capacity
+        # Total packets ever written; the next row is written % capacity
+        self.written = 0
+        # Ring position where the next snapshot starts
+        self.snapshot_start = 0
         self.max_size = max_size
+        # Pattern counter updated as packets arrive (None: rescan snapshots)
+        if detection == 'window':
+            self.detector = WindowPatternCounter(window, bucket)
+        elif detection == 'sketch':
+            self.detector = SketchPatternCounter(sketch_epsilon, sketch_delta, sketch_top_k)
+        else:
+            if detection != 'snapshot':
+                log.log(f"Unknown detection backend {detection}, using snapshot", logging.WARNING)
+            self.detector = None
+        self.aggregate_density = aggregate_density
         self.processing_interval = processing_interval
-        self.last_processed = time.time()
-        self.current_mac = get_mac_addresses()
+        self.clock = clock
+        self.last_processed = clock()
+        # Read in-process once per cycle; remembers the previous MAC set
+        self.arp_table = ArpTable()
+        self.current_mac = self.arp_table.update().count
         self.past_mac = self.current_mac
+        # Cleared when a NeighbourMonitor raises the ARP rules from
+        # rtnetlink events instead
+        self.arp_polling = True
+
+    def __len__(self):
+        """Return the number of packets currently held in the ring."""
+        return min(self.written, self.capacity)
 
     def add_packet(self, packet):
         """Add a packet to the buffer and trigger processing if conditions met.
 
         Args:
-            packet: A network packet (e.g., Scapy packet) to append to the buffer.
+            packet (PacketRecord): Parsed packet header to append to the buffer.
         """
-        self.buffer.append(packet)
+        now = self.clock()
+        written = self.written
+        self.ring[written % self.capacity] = (
+            now, packet.src_ip, packet.dst_ip,
+            packet.sport, packet.dport, packet.proto, packet.flags)
+        # Publish the row only once it is fully written
+        self.written = written + 1
 
-        # Process buffer if it's full or enough time has passed
-        current_time = time.time()
-        if (len(self.buffer)) >= self.max_size:
-            # current_time - self.last_processed > self.processing_interval):
-            # self.process_buffer()
-            pass
+        if self.detector is not None:
+            self.detector.add(packet, now)
+
+    def swap_buffer(self):
+        """Take a snapshot of the packets collected since the last snapshot.
+
+        The packet callback keeps writing into the ring while the copied
+        snapshot is analysed, so analysis never blocks verdicts. The last
+        `max_size` packets of each snapshot are included again in the next
+        one.
+
+        Returns:
+            numpy.ndarray: Packets to analyse, oldest first (PACKET_DTYPE rows).
+        """
+        end = self.written
+        start = max(self.snapshot_start, end - self.capacity)
+        self.snapshot_start = max(start, end - self.max_size)
+
+        first = start % self.capacity
+        last = first + (end - start)
+        if last <= self.capacity:
+            return self.ring[first:last].copy()
+        return np.concatenate((self.ring[first:], self.ring[:last - self.capacity]))
 
     def process_buffer(self):
         """Process and clear all packets currently in the buffer."""
-        packets_to_process = self.buffer.copy()
-        self.buffer = []
-        self.last_processed = time.time()
+        packets_to_process = self.swap_buffer()
+        self.last_processed = self.clock()
 
         log.log(f"===== Starting Buffer Analysis - {len(packets_to_process)} packets to analyse =====", logging.INFO)
         try:
@@ -59,7 +151,117 @@ class PacketBuffer:
         finally:
             pass
 
-    def analyze_packet_patterns(self):
+    @property
+    def counts_drain(self):
+        """True if each `pattern_counts` call only covers packets not reported before.
+
+        Snapshot and sketch counts are consumed when read, so counts read
+        from several buffers or cycles add up; sliding-window counts cover
+        the whole window every time and must not be summed over cycles.
+        """
+        return self.detector is None or self.detector.drains
+
+    def pattern_counts(self):
+        """Return the pattern counts detection should run on this cycle.
+
+        Reads the streaming detector (sliding window or sketches) when
+        enabled, in O(distinct keys); otherwise takes a ring snapshot and
+        counts it with `count_patterns`.
+
+        Returns:
+            dict: Pattern counts, as returned by `count_patterns`.
+        """
+        if self.detector is None:
+            return self.count_patterns(self.swap_buffer())
+        return self.detector.pattern_counts(self.clock())
+
+    @staticmethod
+    def count_patterns(packets):
+        """Count the per-key SYN statistics that detection is based on.
+
+        Args:
+            packets (numpy.ndarray): Packets to count (PACKET_DTYPE rows).
+
+        Returns:
+            dict: Pattern counts with keys
+                total_packets (int),
+                ssh_attempts_by_source (dict of src -> Counter of dst -> SSH SYNs),
+                syn_counts_by_destination (dict of dst -> non-SSH SYNs).
+        """
+        ssh_attempts_by_source = defaultdict(Counter)
+        syn_counts_by_destination = defaultdict(int)
+
+        # TCP packets with the SYN flag set, split by SSH destination port
+        syn = (packets['proto'] == PROTO_TCP) & ((packets['flags'] & TCP_SYN) != 0)
+        ssh = syn & (packets['dport'] == 22)
+        other = syn & ~ssh
+
+        # Count SSH attempts per (src, dst) pair packed into one 64-bit key
+        pairs = (packets['src'][ssh].astype(np.uint64) << np.uint64(32)) | packets['dst'][ssh]
+        for pair, count in zip(*_unique_counts(pairs)):
+            ssh_attempts_by_source[int_to_ip(pair >> 32)][int_to_ip(pair & 0xffffffff)] = count
+
+        for dst, count in zip(*_unique_counts(packets['dst'][other])):
+            syn_counts_by_destination[int_to_ip(dst)] = count
+
+        return {
+            'total_packets': len(packets),
+            'ssh_attempts_by_source': ssh_attempts_by_source,
+            'syn_counts_by_destination': syn_counts_by_destination,
+        }
+
+    @staticmethod
+    def results_summary(results, new_rules):
+        """Return the JSON-serialisable summary of an analysis cycle for the event log.
+
+        Args:
+            results (dict): Metrics returned by `analyze_counts`.
+            new_rules (list of str): Rules generated by the analysis.
+
+        Returns:
+            dict: Event fields.
+        """
+        summary = {
+            'total_packets': results['total_packets'],
+            'ssh_syn_count': results['ssh_syn_count'],
+            'ssh_brute_force_count': results['ssh_brute_force_count'],
+            'ssh_brute_force_sources': sorted(results['ssh_brute_force_sources']),
+            'syn_flood_targets': dict(results['potential_syn_flood_targets']),
+            'syn_flood_percentage': results['syn_flood_percentage'],
+            'rules': list(new_rules),
+        }
+        if 'arp_new_macs' in results:
+            summary['arp_new_macs'] = len(results['arp_new_macs'])
+            summary['arp_per_interface'] = results['arp_per_interface']
+        return summary
+
+    @staticmethod
+    def merge_counts(counts_list):
+        """Merge pattern counts gathered from several buffers.
+
+        Args:
+            counts_list (list of dict): Outputs of `count_patterns`.
+
+        Returns:
+            dict: Combined pattern counts.
+        """
+        total_packets = 0
+        ssh_attempts_by_source = defaultdict(Counter)
+        syn_counts_by_destination = defaultdict(int)
+        for counts in counts_list:
+            total_packets += counts['total_packets']
+            for src, targets in counts['ssh_attempts_by_source'].items():
+                ssh_attempts_by_source[src].update(targets)
+            for dst, count in counts['syn_counts_by_destination'].items():
+                syn_counts_by_destination[dst] += count
+
+        return {
+            'total_packets': total_packets,
+            'ssh_attempts_by_source': ssh_attempts_by_source,
+            'syn_counts_by_destination': syn_counts_by_destination,
+        }
+
+    def analyze_packet_patterns(self, packets=None):
         """Analyze buffered packets for TCP/UDP patterns and generate mitigation rules.
 
         Scans the buffer for:
@@ -67,57 +269,63 @@ class PacketBuffer:
           - SYN flood targets
           - MAC address anomalies
 
+        Args:
+            packets (numpy.ndarray, optional): Snapshot from `swap_buffer`
+                to analyse. Defaults to the counts of the current detection
+                window (see `pattern_counts`).
+
+        Returns:
+            tuple:
+                results (dict): Metrics and percentages of detected patterns.
+                new_rules (list of str): Generated rule strings based on thresholds.
+        """
+        if packets is None:
+            return self.analyze_counts(self.pattern_counts())
+
+        return self.analyze_counts(self.count_patterns(packets))
+
+    def analyze_counts(self, counts):
+        """Evaluate pattern counts against the detection thresholds.
+
+        Args:
+            counts (dict): Output of `count_patterns` or `merge_counts`.
+
         Returns:
             tuple:
                 results (dict): Metrics and percentages of detected patterns.
                 new_rules (list of str): Generated rule strings based on thresholds.
         """
-        total_packets = len(self.buffer)
+        total_packets = counts['total_packets']
         log.log(f"=====> {total_packets} Packets in Buffer", logging.DEBUG)
 
         results = {}
 
         # Pattern 1: TCP SYN to port 22 (SSH)
+        ssh_attempts_by_source = counts['ssh_attempts_by_source']
         ssh_syn_connections = set()
         ssh_syn_packets = 0
 
         # SSH brute force detection
-        ssh_attempts_by_source = defaultdict(Counter)
         ssh_brute_force_threshold = 5  # Adjust based on your environment
         ssh_brute_force_packets = 0
         ssh_brute_force_sources = set()
 
         # Pattern 2: SYN flood detection
-        syn_counts_by_destination = defaultdict(int)
+        syn_counts_by_destination = counts['syn_counts_by_destination']
         syn_flood_threshold = 10  # Adjust this threshold as needed
 
         # Pattern 3: Unique MAC addresses
         mac_addresses = set()
 
-        for ip_packet in self.buffer:
-            flag = None
-            # If TCP or UDP, print port information
-            if ip_packet.haslayer('TCP'):
-                # Now you can access TCP properties
-                tcp_layer = ip_packet['TCP']
-
-                # Check for SYN flag
-                if tcp_layer.flags & 0x02:  # 0x02 is the SYN flag
-                    flag = "SYN"
-                    if ip_packet.dport == 22:
-                        connection = (ip_packet.src, ip_packet.dst)
-                        ssh_syn_connections.add(connection)
-                        ssh_syn_packets += 1
-
-                        # SSH brute force detection
-                        ssh_attempts_by_source[ip_packet.src][ip_packet.dst] += 1
-
-                        # Check if this source has made multiple attempts to the same destination
-                        if ssh_attempts_by_source[ip_packet.src][ip_packet.dst] >= ssh_brute_force_threshold:
-                            ssh_brute_force_sources.add(ip_packet.src)
-                            ssh_brute_force_packets += 1
-                    else:
-                        syn_counts_by_destination[ip_packet.dst] += 1
+        for src, targets in ssh_attempts_by_source.items():
+            for dst, count in targets.items():
+                ssh_syn_connections.add((src, dst))
+                ssh_syn_packets += count
+
+                # Every attempt from the threshold onwards counts as brute force
+                if count >= ssh_brute_force_threshold:
+                    ssh_brute_force_sources.add(src)
+                    ssh_brute_force_packets += count - ssh_brute_force_threshold + 1
 
         # Find destinations receiving many SYNs (potential SYN flood targets)
         potential_syn_flood_targets = {
@@ -145,12 +353,16 @@ class PacketBuffer:
         results['mac_percentage'] = (len(mac_addresses) / (total_packets * 2)) * 100 if total_packets > 0 else 0
 
         self.print_analysis_report(results)
-        self.buffer = self.buffer[-1000:]
 
         new_rules = []
 
         if results['ssh_syn_connections']:
-            for src in sorted(results['ssh_brute_force_sources']):
+            prefixes, covered = aggregate_prefixes(results['ssh_brute_force_sources'], self.aggregate_density)
+            for prefix in prefixes:
+                rule_str = f"src/{prefix}/SYN/30"
+                new_rules.append(rule_str)
+                print(rule_str)
+            for src in sorted(results['ssh_brute_force_sources'] - covered):
                 targets = results['ssh_attempts_by_source'][src].most_common()
                 for dst, count in targets:
                     if count >= 5:
@@ -161,19 +373,30 @@ class PacketBuffer:
         if results['potential_syn_flood_targets']:
             sorted_targets = sorted(results['potential_syn_flood_targets'].items(),
                                     key=lambda x: x[1], reverse=True)
+            # Targets are victims: a prefix rule would also cut the hosts
+            # next to them, so they are only ever blocked one by one
             for dst, count in sorted_targets:
                 if count > 20:
                     rule_str = f"dst/{dst}//10"
                     new_rules.append(rule_str)
                     print(rule_str)
         
+        if not self.arp_polling:
+            return results, new_rules
+
         #def add_rules_arp(self):
-        self.current_mac = get_mac_addresses()
+        arp_snapshot = self.arp_table.update()
+        self.current_mac = arp_snapshot.count
+        results['arp_new_macs'] = arp_snapshot.new_macs
+        results['arp_per_interface'] = arp_snapshot.per_interface
 
         print(f"\n3. MAC Address Analysis:")
         print(f"   - {self.current_mac} unique MAC addresses")
         mac_delta = self.current_mac - self.past_mac
         print(f"   - {mac_delta} new MAC addresses")
+        print(f"   - {len(arp_snapshot.new_macs)} MAC addresses not seen last cycle")
+        for interface, count in sorted(arp_snapshot.per_interface.items()):
+            print(f"     * {interface}: {count}")
 
         rule_str = 'arp///20'
         if self.current_mac > 1024:
@@ -246,28 +469,30 @@ class PacketBuffer:
             print("\n⚠️ Unusually high number of MAC addresses detected!")
 
 
+def _unique_counts(values):
+    """Count the occurrences of each distinct value.
+
+    Args:
+        values (numpy.ndarray): 1-D integer array.
+
+    Returns:
+        tuple:
+            keys (list of int): Distinct values, in order of first occurrence.
+            counts (list of int): Occurrences of each value.
+    """
+    keys, first_index, counts = np.unique(values, return_index=True, return_counts=True)
+    # Keep first-seen order so ties are reported in arrival order
+    order = np.argsort(first_index, kind='stable')
+    return keys[order].tolist(), counts[order].tolist()
+
+
 def get_mac_addresses():
     """Get all MAC addresses from the current ARP table.
 
-    Attempts to count unique MAC addresses via /proc/net/arp,
+    Counts unique MAC addresses by parsing /proc/net/arp in-process,
     falling back to `ip neigh show` on failure.
 
     Returns:
         int: Number of unique MAC addresses found.
     """
-    try:
-        # Direct approach using shell commands to count unique MAC addresses
-        cmd = "cat /proc/net/arp | tail -n +2 | awk '{print $4}' | sort -u | wc -l"
-        output = subprocess.check_output(cmd, shell=True, timeout=10, universal_newlines=True)
-        return int(output.strip())
-    except (subprocess.SubprocessError, ValueError) as e:
-        log.log(f"Error counting MAC addresses: {e}", logging.ERROR)
-
-        # Fallback method if the command pipeline fails
-        try:
-            cmd = "ip neigh show | awk '{print $5}' | sort -u | wc -l"
-            output = subprocess.check_output(cmd, shell=True, timeout=10, universal_newlines=True)
-            return int(output.strip())
-        except (subprocess.SubprocessError, ValueError) as e:
-            log.log(f"Error with fallback method: {e}", logging.ERROR)
-            return 0
+    return len({mac for mac, _ in read_arp_entries()})
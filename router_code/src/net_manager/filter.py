@@ -2,57 +2,121 @@
 import socket
 import struct
 import time
-from netfilterqueue import NetfilterQueue
-from scapy.all import IP
 #from src.net_manager.intra_sys_coms import Intra_Sys_Com
 from src.route_setup.route_setup import RouterSetup
 from src.net_manager.buffer import PacketBuffer
 from src.net_manager.rules import Rules
+from src.net_manager.analysis_worker import AnalysisWorker
+from src.net_manager.kernel_offload import make_offload
+from src.net_manager.pipeline import PacketPipeline
+from src.net_manager.neigh_monitor import start_neighbour_monitor
+from src.net_manager.packet_sources import make_packet_source
 import threading
 import queue
-from src.net_manager.intra_sys_coms import network_thread, outgoing_messages, incoming_messages
+from src.net_manager.intra_sys_coms import network_thread, queue_message, queue_rules, drain_messages
+from src.net_manager.intra_sys_coms import register_metrics as register_message_metrics
+from src.tools.metrics import REGISTRY, serve_metrics
+from src.tools.profiler import PROFILER, install_signal_toggle, serve_control_socket
 import logging
 from src.tools.logger import Logger
 import subprocess
-from src.net_manager.arp_protection import set_arp_protection_level
+from src.net_manager.arp_protection import ArpProtection, set_arp_protection_level
 log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
 
 
 class Filter():
-    def __init__(self, queue_num, router_id, pacify = False):
+    def __init__(self, queue_num, router_id, pacify = False, debug_decode=False,
+                 offload_backend=None, flow_cache_size=65536, buffer_options=None,
+                 neighbour_monitor=True, arp_hold_time=30.0, metrics_port=0,
+                 profile_socket='', profile_sample_every=100, packet_source='nfqueue',
+                 capture_interface='', pcap_file='', pcap_speed=1.0, inline_routers=None):
 
         try:
-            # Start the network thread
             self.router_id = router_id
+            # Routers whose inline filters enforce the rules detected here
+            self.rule_destinations = ["172.16.0."+str(router) for router in (inline_routers or [router_id])]
+            # Inline NFQUEUE, passive AF_PACKET capture or pcap replay
+            self.packet_source = make_packet_source(packet_source, queue_num, capture_interface,
+                                                    pcap_file, pcap_speed)
+            inline = self.packet_source.inline
+            # Passive sources are not bound to a queue: number 0
+            if not inline:
+                queue_num = 0
+
+            # Start the network thread; a passive source only sends rules,
+            # from an ephemeral port
             self.network_thread = threading.Thread(
                 target=network_thread,
                 daemon=True,
-                args=(router_id, queue_num))
+                args=(router_id, queue_num),
+                kwargs={'port': None if inline else 0})
             self.network_thread.start()
 
-            self.pacify = pacify
-            set_arp_protection_level(1)
-            subprocess.run([
-                'sudo', 'ip', 'neigh', 'flush', 'all'
-            ], check=True)
-
-            # self.coms = Intra_Sys_Com(router_id)
-            # Create a new NetfilterQueue object
-            self.nfqueue = NetfilterQueue()
-            # Bind to queue number 1
-            # Make sure your iptables rule uses the same queue number
-            self.nfqueue.bind(queue_num, self.print_and_check)
-            log.log(f"[*] Waiting for packets in NFQUEUE {queue_num}...", logging.INFO)
-            print("[*] Press Ctrl+C to exit")
+            # The kernel of this host is only hardened when it forwards the
+            # filtered traffic
+            if inline:
+                set_arp_protection_level(1)
+                subprocess.run([
+                    'sudo', 'ip', 'neigh', 'flush', 'all'
+                ], check=True)
 
             freq = 0.2
             self.period = 1/freq
 
-            self.packer_buffer = PacketBuffer()
-            self.rules = Rules()
-            self.time_last_exec = time.time()
+            self.packer_buffer = PacketBuffer(**(buffer_options or {}))
+            # Mirror active block rules into the kernel when configured
+            self.offload = make_offload(offload_backend) if inline else None
+            if self.offload is not None and not self.offload.setup():
+                log.log("Kernel offload unavailable, filtering in userspace only", logging.WARNING)
+                self.offload = None
+            self.rules = Rules(offload=self.offload,
+                               arp_protection=ArpProtection(arp_hold_time, enforce=inline))
+            self.pipeline = PacketPipeline(
+                self.packer_buffer,
+                self.rules,
+                pacify,
+                debug_decode,
+                flow_cache_size,
+                inline=inline)
+
+            # self.coms = Intra_Sys_Com(router_id)
+            if not inline:
+                log.log(f"[*] Passive source: detection only, rules are sent to "
+                        f"{', '.join(self.rule_destinations)}", logging.INFO)
+            print("[*] Press Ctrl+C to exit")
+
+            # Rule updates and buffer analysis run off the packet callback
+            self.analysis_worker = AnalysisWorker(
+                self.packer_buffer,
+                self.rules,
+                self.read_messages,
+                self.send_rules,
+                self.period,
+                callback_latency=self.pipeline.callback_latency,
+                flow_cache=self.pipeline.flow_cache,
+                metrics=REGISTRY)
+            self.analysis_worker.start()
+            # Metrics are read from the pipeline state when scraped
+            self.pipeline.register_metrics(REGISTRY)
+            register_message_metrics(REGISTRY)
+            # Both queue processes of a router serve metrics: queue 1 on
+            # metrics_port, queue 2 on the next port, a passive source
+            # (queue 0) on the one before
+            self.metrics_server = serve_metrics(metrics_port + queue_num - 1 if metrics_port else 0)
+            # Stage profiling is off until toggled by SIGUSR2 or the control socket
+            PROFILER.sample_every = max(1, profile_sample_every)
+            install_signal_toggle()
+            # One socket per queue process: <profile_socket>.<queue_num>
+            self.profile_server = serve_control_socket(f"{profile_socket}.{queue_num}" if profile_socket else '')
+            # ARP rules are raised from neighbour events as they happen,
+            # falling back to polling the table every cycle
+            self.neighbour_monitor = None
+            if neighbour_monitor:
+                self.neighbour_monitor = start_neighbour_monitor(self.analysis_worker.apply_rules, self.resume_arp_polling)
+                if self.neighbour_monitor is not None:
+                    self.packer_buffer.arp_polling = False
             # Run the packet processing loop
-            self.nfqueue.run()
+            self.packet_source.run(self.pipeline.print_and_check)
 
         except socket.error as e:
             log.log(f"\n[!] Socket error: {e}", logging.ERROR)
@@ -60,78 +124,34 @@ class Filter():
         except Exception as e:
             log.log(f"\n[!] Error: {e}", logging.ERROR)
         finally:
-            # Unbind from the queue when done
-            try:
-                self.nfqueue.unbind()
-            except:
-                pass
+            # Unbind from the queue or release the capture ring when done
+            if getattr(self, 'packet_source', None) is not None:
+                self.packet_source.stop()
+                self.packet_source.close()
+            if getattr(self, 'analysis_worker', None) is not None:
+                self.analysis_worker.stop()
+            if getattr(self, 'neighbour_monitor', None) is not None:
+                self.neighbour_monitor.stop()
+            if getattr(self, 'metrics_server', None) is not None:
+                self.metrics_server.shutdown()
+            if getattr(self, 'profile_server', None) is not None:
+                self.profile_server.shutdown()
+            if getattr(self, 'offload', None) is not None:
+                self.offload.teardown()
+
+    def resume_arp_polling(self):
+        """Poll the ARP table every cycle again once the neighbour monitor has stopped."""
+        self.packer_buffer.arp_polling = True
 
     # Example: Sending a message
     def send_example(self, dest, message_txt=""):
-        message = message_txt.encode()
-        # message = "Hello, UDP world!".encode()
-        destination = (dest, 5002) 
-        outgoing_messages.put((message, destination))
-        log.log(f"Queued message to {destination}", logging.INFO)
+        queue_message(dest, message_txt)
+
+    def send_rules(self, rule_strs):
+        """Send generated rules to the inline routers, batched."""
+        for dest in self.rule_destinations:
+            queue_rules(dest, rule_strs, self.router_id)
 
     # Example: Reading received messages
     def read_messages(self):
-        messages = []
-        while True:
-            try:
-                data, addr = incoming_messages.get_nowait()
-                log.log(f"Processing message from {addr}: {data}", logging.INFO)
-                messages.append(str(data))
-                incoming_messages.task_done()
-            except queue.Empty:
-                log.log("No messages to process", logging.INFO)
-                break
-
-        return messages
-
-    def print_and_check(self, pkt):
-        """
-        Callback function that prints packet info and accepts the packet
-        to be forwarded through iptables
-        """
-
-        # Convert the packet payload to a scapy IP packet for easier parsing
-        ip_packet = IP(pkt.get_payload())
-        if self.pacify:
-            flag = ""
-            # If TCP or UDP, print port information
-            if ip_packet.haslayer('TCP'):
-                tcp_layer = ip_packet['TCP'] # Now you can access TCP properties
-
-                # Check for SYN flag
-                if tcp_layer.flags & 0x02:  # 0x02 is the SYN flag
-                    # print("SYN flag is set")
-                    flag = "SYN"
-
-            self.packer_buffer.add_packet(ip_packet)
-            time_current = time.time()
-
-            if time_current - self.time_last_exec > self.period:
-
-                self.time_last_exec = time_current
-                in_messages = self.read_messages()
-                self.rules.clear_rules(time_current)
-                #for messages in in_messages:
-                    #print(str(in_messages))
-                self.rules.add_rules(in_messages)
-                results, new_rules = self.packer_buffer.analyze_packet_patterns()
-                #self.rules.add_rules_arp()
-                for out_message in new_rules:
-                    dest = "172.16.0."+str(self.router_id)
-                    self.send_example(dest, out_message)
-                # self.send_example("src/10.1.0.55/None/5")
-
-            # Accept the packet - this puts it back into the iptables flow to be forwarded
-            if self.rules.blocking_rules(ip_packet.src, ip_packet.dst, flag):
-                pkt.accept()
-                # log.log("Packet accepted for forwarding", logging.INFO)
-            else:
-                pkt.drop()
-                # log.log("Packet rejected for forwarding", logging.INFO)
-        else:
-            pkt.accept()
+        return drain_messages()
@@ -0,0 +1,86 @@
+"""
+Bounded per-flow verdict cache placed in front of the rule engine.
+
+Stores the accept/drop decision of recently seen flows so that consecutive
+packets of the same flow skip `Rules.blocking_rules`. Every entry is tagged
+with the rule-set generation it was computed under; bumping the generation
+in `Rules` invalidates all cached verdicts at once.
+"""
+from collections import OrderedDict
+
+
+class FlowCache:
+    """LRU cache of flow verdicts keyed by 5-tuple (plus the SYN flag)."""
+
+    def __init__(self, capacity=65536):
+        """Initialise an empty cache.
+
+        Args:
+            capacity (int): Maximum number of flows to remember.
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def lookup(self, key, generation):
+        """Return the cached verdict of a flow.
+
+        Args:
+            key (tuple): Flow key (src, dst, proto, sport, dport, flag).
+            generation (int): Current rule-set generation.
+
+        Returns:
+            bool or None: Cached verdict (True to accept), or None on a miss
+                or if the entry predates the current rule set.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != generation:
+            self.stale += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def store(self, key, generation, verdict):
+        """Cache the verdict of a flow, evicting the least recently used flow if full.
+
+        Args:
+            key (tuple): Flow key (src, dst, proto, sport, dport, flag).
+            generation (int): Rule-set generation the verdict was computed under.
+            verdict (bool): True to accept, False to drop.
+        """
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        elif len(entries) >= self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        entries[key] = (generation, verdict)
+
+    def hit_rate(self):
+        """Return the fraction of lookups answered from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns:
+            dict: Sizes, hit/miss/stale/eviction counters and the hit rate.
+        """
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+        }
@@ -1,68 +1,273 @@
-from scapy.all import IP, UDP, Raw, send
 import sys
+import os
 import time
 import socket
 import select
+import selectors
 import threading
 import queue
+import itertools
 import logging
+from collections import Counter, deque
+from src.net_manager.rules import Rule, parse_rule
+from src.net_manager.rule_protocol import (MAX_RULES_PER_DATAGRAM, SequenceTracker, decode_rules,
+                                           encode_rules, is_rule_datagram)
 from src.tools.logger import Logger
 
 log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
 
+# UDP port rules are sent to: that of the queue-2 process (5000+queue), or of
+# the multi-queue coordinator
+RULE_PORT = 5002
+# Datagrams read per receive wakeup before yielding to pending sends
+RECEIVE_BATCH = 64
+
 # Thread-safe queues for inter-thread communication
-outgoing_messages = queue.Queue()  # For messages to send out
-incoming_messages = queue.Queue()  # For received messages
+outgoing_messages = queue.Queue()  # (message, destination) to send out
+incoming_messages = queue.Queue()  # Lists of received (data, addr)
+
+# Sequence numbers of the rule datagrams we send, and of those we receive.
+# The epoch tells this process's numbering apart from that of other
+# processes of the router and from our own before a restart.
+rule_epoch = int.from_bytes(os.urandom(4), 'big') or 1
+rule_sequence = itertools.count(1)
+sequence_tracker = SequenceTracker()
+
+# Datagrams sent and received by the network thread
+datagram_counts = Counter()
+
+
+class Wakeup:
+    """File descriptor that wakes a selector loop from other threads.
+
+    Uses an eventfd where available and a non-blocking pipe otherwise.
+    """
+
+    def __init__(self):
+        if hasattr(os, 'eventfd'):
+            self.read_fd = self.write_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+
+    def notify(self):
+        """Make the read end readable."""
+        try:
+            os.write(self.write_fd, (1).to_bytes(8, sys.byteorder))
+        except BlockingIOError:
+            # A wakeup is already pending
+            pass
+
+    def clear(self):
+        """Consume pending wakeups."""
+        try:
+            while os.read(self.read_fd, 4096):
+                if self.read_fd == self.write_fd:
+                    break
+        except BlockingIOError:
+            pass
+
 
+# Signalled whenever a message is queued or the network thread should stop
+outgoing_wakeup = Wakeup()
 
-def network_thread(router_Number, queue_number):
+
+def queue_message(dest, message_txt=""):
+    """Queue a text message for the network thread to send to a router.
+
+    Args:
+        dest (str): IP address of the destination router.
+        message_txt (str): Message to send.
+    """
+    message = message_txt.encode()
+    destination = (dest, RULE_PORT)
+    outgoing_messages.put((message, destination))
+    outgoing_wakeup.notify()
+    log.log(f"Queued message to {destination}", logging.DEBUG)
+
+
+def queue_rules(dest, rules, sender, port=RULE_PORT):
+    """Queue rules for the network thread, packed into as few datagrams as possible.
+
+    Args:
+        dest (str): IP address of the destination router.
+        rules (list): Rule objects or rule strings.
+        sender (int): Router number of this router.
+        port (int): UDP port of the destination.
+    """
+    parsed = [rule if isinstance(rule, Rule) else parse_rule(rule) for rule in rules]
+    parsed = [rule for rule in parsed if rule is not None]
+    destination = (dest, port)
+    queued = 0
+    for start in range(0, len(parsed), MAX_RULES_PER_DATAGRAM):
+        batch = parsed[start:start + MAX_RULES_PER_DATAGRAM]
+        try:
+            message = encode_rules(batch, sender, next(rule_sequence), rule_epoch)
+        except ValueError as e:
+            log.log(f"Dropping rule batch: {e}", logging.WARNING)
+            continue
+        outgoing_messages.put((message, destination))
+        queued += 1
+    if queued:
+        outgoing_wakeup.notify()
+        log.log(f"Queued {len(parsed)} rules in {queued} datagram(s) to {destination}", logging.DEBUG)
+
+
+def drain_messages():
+    """Return every rule received by the network thread since the last call.
+
+    Binary rule datagrams are decoded into Rule objects (duplicates and
+    replays are dropped); legacy text datagrams are returned as strings.
+
+    Returns:
+        list: Received Rule objects and rule strings.
+    """
+    received = []
+    while True:
+        try:
+            received.extend(incoming_messages.get_nowait())
+            incoming_messages.task_done()
+        except queue.Empty:
+            break
+    if not received:
+        log.log("No messages to process", logging.DEBUG)
+
+    messages = []
+    for data, addr in received:
+        if is_rule_datagram(data):
+            try:
+                sender, epoch, sequence, rules = decode_rules(data)
+            except ValueError as e:
+                log.log(f"Invalid rule datagram from {addr}: {e}", logging.WARNING)
+                continue
+            if sequence_tracker.accept(sender, sequence, epoch, addr):
+                log.log(f"Processing {len(rules)} rules from {addr} (seq {sequence})", logging.INFO)
+                messages.extend(rules)
+        else:
+            log.log(f"Processing message from {addr}: {data}", logging.INFO)
+            messages.append(data.decode('utf-8', errors='replace'))
+
+    return messages
+
+
+def network_thread(router_Number, queue_number, stop_event=None, port=None):
     # Set up the socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock_ip = '172.16.0.'+str(router_Number)
-    sock_port = 5000+queue_number
+    # Defaults to the port of the queue's process, 5000+queue_number
+    sock_port = 5000+queue_number if port is None else port
     sock.bind((sock_ip, sock_port))
     sock.setblocking(False)  # Make socket non-blocking
+    run_network_loop(sock, stop_event)
 
-    inputs = [sock]  # Sockets to monitor for input
-    outputs = []     # Sockets to monitor for output capability
 
-    while True:
-        # Check if we need to monitor for output capability
-        if not outgoing_messages.empty() and sock not in outputs:
-            outputs.append(sock)
+def stop_network_thread(stop_event):
+    """Set a network loop's stop event and wake it up."""
+    stop_event.set()
+    outgoing_wakeup.notify()
 
-        # Use select to monitor sockets without blocking
-        readable, writable, exceptional = select.select(inputs, outputs, inputs, 0.1)
 
-        # Handle readable sockets (incoming data)
-        for s in readable:
-            if s is sock:
-                try:
-                    data, addr = sock.recvfrom(1024)
-                    #log.log(f"Received {len(data)} bytes {data} from {addr}", logging.INFO)
-                    # Put received message in queue for processing thread
-                    incoming_messages.put((data, addr))
-                except Exception as e:
-                    log.log(f"Error receiving data: {e}", logging.WARNING)
-
-        # Handle writable sockets (ready to send)
-        for s in writable:
-            if s is sock and not outgoing_messages.empty():
+def run_network_loop(sock, stop_event=None):
+    """Send queued messages and receive datagrams on a bound, non-blocking socket.
+
+    Blocks in epoll (or the platform's best selector) until a datagram
+    arrives, a message is queued (eventfd wakeup) or a send that would
+    have blocked can proceed. Every wakeup drains the whole outgoing queue
+    and reads up to RECEIVE_BATCH datagrams, which are handed over as a
+    single item of `incoming_messages`.
+
+    Args:
+        sock (socket.socket): Bound non-blocking UDP socket.
+        stop_event (threading.Event, optional): Ends the loop once set, see
+            `stop_network_thread`.
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(outgoing_wakeup.read_fd, selectors.EVENT_READ)
+    # Messages taken from the queue that the socket could not accept yet
+    pending = deque()
+    waiting_for_write = False
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            for key, mask in selector.select():
+                if key.fd == outgoing_wakeup.read_fd:
+                    outgoing_wakeup.clear()
+                elif mask & selectors.EVENT_READ:
+                    receive_datagrams(sock)
+
+            while True:
                 try:
-                    message, destination = outgoing_messages.get_nowait()
-                    sock.sendto(message, destination)
-                    log.log(f"Sent {message} to {destination}", logging.INFO)
+                    pending.append(outgoing_messages.get_nowait())
                     outgoing_messages.task_done()
                 except queue.Empty:
-                    # If we've sent all messages, stop monitoring for output
-                    outputs.remove(sock)
-                except Exception as e:
-                    log.log(f"Error sending to {destination}: {e}", logging.WARNING)
-                    outgoing_messages.task_done()
+                    break
+            if pending:
+                send_datagrams(sock, pending)
+
+            # Only watch for writability while sends are backed up
+            if bool(pending) != waiting_for_write:
+                waiting_for_write = bool(pending)
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if waiting_for_write else 0)
+                selector.modify(sock, events)
+    finally:
+        selector.close()
+
+
+def receive_datagrams(sock):
+    """Read the datagrams waiting on a socket into one incoming_messages item."""
+    batch = []
+    for _ in range(RECEIVE_BATCH):
+        try:
+            batch.append(sock.recvfrom(65535))
+        except BlockingIOError:
+            break
+        except OSError as e:
+            log.log(f"Error receiving data: {e}", logging.WARNING)
+            break
+    if batch:
+        datagram_counts['received'] += len(batch)
+        incoming_messages.put(batch)
+
+
+def send_datagrams(sock, pending):
+    """Send pending (message, destination) pairs until the socket would block.
+
+    A datagram whose send fails is dropped and counted as a send error.
+    """
+    sent = failed = 0
+    while pending:
+        message, destination = pending[0]
+        try:
+            sock.sendto(message, destination)
+            sent += 1
+        except BlockingIOError:
+            break
+        except OSError as e:
+            log.log(f"Error sending to {destination}: {e}", logging.WARNING)
+            failed += 1
+        pending.popleft()
+    datagram_counts['sent'] += sent
+    datagram_counts['send_errors'] += failed
+    log.log(f"Sent {sent} datagram(s), {failed} failed, {len(pending)} pending", logging.DEBUG)
+
+
+def register_metrics(registry):
+    """Expose the inter-router messaging counters.
 
-        # Handle exceptional conditions
-        for s in exceptional:
-            log.log(f"Exception condition on {s}", logging.ERROR)
+    Args:
+        registry (MetricsRegistry): Registry the metrics are added to.
+    """
+    registry.counter('router_messages_total', 'Inter-router datagrams, by direction',
+                     lambda: {'sent': datagram_counts['sent'], 'received': datagram_counts['received']},
+                     label='direction')
+    registry.counter('router_message_send_errors_total', 'Inter-router datagrams dropped after a failed send',
+                     lambda: datagram_counts['send_errors'])
+    registry.counter('router_rule_datagrams_lost_total', 'Rule datagrams missing from sequence numbers',
+                     lambda: sequence_tracker.lost)
+    registry.counter('router_rule_datagrams_duplicate_total', 'Duplicate or replayed rule datagrams dropped',
+                     lambda: sequence_tracker.duplicates)
 
 
 class Intra_Sys_Com():
@@ -0,0 +1,212 @@
+"""
+Kernel offload of active blocking rules.
+
+Mirrors the `src`/`dst` rules held by `Rules` into nftables sets so that
+packets from blocked sources or to blocked destinations are dropped in the
+kernel, before they are copied to userspace through NFQUEUE. Set elements
+carry a timeout matching the rule TTL, and changes are applied
+incrementally in a single `nft -f -` batch per update cycle.
+"""
+import logging
+import subprocess
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+TABLE_NAME = 'elec0138_offload'
+
+# Kernel timeouts are padded so Python expiry normally removes elements first
+TIMEOUT_GRACE = 5
+
+
+class NftablesOffload:
+    """Mirror active rules into nftables sets checked ahead of the NFQUEUE.
+
+    Rules without a flag go into `blocked_src`/`blocked_dst`, SYN rules go
+    into `blocked_src_syn`/`blocked_dst_syn`. Other fields (e.g. `arp`),
+    flags and prefix targets are left to the userspace filter.
+    """
+
+    SETS = ('blocked_src', 'blocked_dst', 'blocked_src_syn', 'blocked_dst_syn')
+
+    def __init__(self, table=TABLE_NAME, priority=-10):
+        """Initialise the backend.
+
+        Args:
+            table (str): Name of the nftables table (family ip) to manage.
+            priority (int): Forward hook priority; must run before the
+                iptables filter table (priority 0) holding the NFQUEUE rules.
+        """
+        self.table = table
+        self.priority = priority
+        # (set, address) -> number of active rules mapping to that element
+        self.elements = {}
+        self.pending = []
+
+    @staticmethod
+    def set_for(rule):
+        """Return the set a rule is offloaded to, or None if it is not offloadable.
+
+        Args:
+            rule (Rule): Rule to map.
+
+        Returns:
+            str or None: Name of the nftables set.
+        """
+        # Prefixes would need interval sets, which reject overlapping elements
+        if rule.field not in ('src', 'dst') or not rule.target or '/' in rule.target:
+            return None
+        if rule.flag == "":
+            return f"blocked_{rule.field}"
+        if rule.flag == "SYN":
+            return f"blocked_{rule.field}_syn"
+        return None
+
+    def setup(self):
+        """Create the table, sets and drop rules, replacing any previous copy.
+
+        Returns:
+            bool: True if the kernel accepted the ruleset.
+        """
+        lines = [
+            f"add table ip {self.table}",
+            f"delete table ip {self.table}",
+            f"add table ip {self.table}",
+        ]
+        for set_name in self.SETS:
+            lines.append(f"add set ip {self.table} {set_name} "
+                         "{ type ipv4_addr; flags timeout; }")
+        lines.append(f"add chain ip {self.table} forward "
+                     f"{{ type filter hook forward priority {self.priority}; policy accept; }}")
+        lines += [
+            f"add rule ip {self.table} forward ip saddr @blocked_src drop",
+            f"add rule ip {self.table} forward ip daddr @blocked_dst drop",
+            f"add rule ip {self.table} forward tcp flags & syn == syn ip saddr @blocked_src_syn drop",
+            f"add rule ip {self.table} forward tcp flags & syn == syn ip daddr @blocked_dst_syn drop",
+        ]
+        self.elements = {}
+        self.pending = []
+        return self._execute(lines)
+
+    def teardown(self):
+        """Remove the table and every offloaded element."""
+        self.elements = {}
+        self.pending = []
+        self._execute([f"delete table ip {self.table}"])
+
+    def add(self, rule):
+        """Queue the kernel update for a newly activated rule.
+
+        Args:
+            rule (Rule): Rule that was added to the active set.
+        """
+        set_name = self.set_for(rule)
+        if set_name is None:
+            return
+        key = (set_name, rule.target)
+        element = f"{{ {rule.target} }}"
+        timeout = f"{{ {rule.target} timeout {int(rule.ttl) + TIMEOUT_GRACE}s }}"
+        if self.elements.get(key, 0):
+            # Already present, re-add to restart the kernel timeout
+            self.pending.append(f"delete element ip {self.table} {set_name} {element}")
+        self.pending.append(f"add element ip {self.table} {set_name} {timeout}")
+        self.elements[key] = self.elements.get(key, 0) + 1
+
+    def refresh(self, rule):
+        """Queue the kernel update for an active rule whose TTL was extended.
+
+        Args:
+            rule (Rule): Rule that was refreshed in the active set.
+        """
+        set_name = self.set_for(rule)
+        if set_name is None or not self.elements.get((set_name, rule.target), 0):
+            return
+        element = f"{{ {rule.target} }}"
+        timeout = f"{{ {rule.target} timeout {int(rule.ttl) + TIMEOUT_GRACE}s }}"
+        # Re-add to restart the kernel timeout
+        self.pending.append(f"delete element ip {self.table} {set_name} {element}")
+        self.pending.append(f"add element ip {self.table} {set_name} {timeout}")
+
+    def remove(self, rule):
+        """Queue the kernel update for an expired rule.
+
+        The element is only deleted once no other active rule maps to it.
+
+        Args:
+            rule (Rule): Rule that was removed from the active set.
+        """
+        set_name = self.set_for(rule)
+        if set_name is None:
+            return
+        key = (set_name, rule.target)
+        count = self.elements.get(key, 0)
+        if count > 1:
+            self.elements[key] = count - 1
+        elif count == 1:
+            del self.elements[key]
+            self.pending.append(f"delete element ip {self.table} {set_name} {{ {rule.target} }}")
+
+    def commit(self):
+        """Apply all queued updates to the kernel in one batch."""
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        if not self._execute(lines):
+            # An element may already have timed out in the kernel, which
+            # aborts the whole batch; retry the commands one by one
+            for line in lines:
+                self._execute([line])
+
+    def _execute(self, lines):
+        """Run a batch of nft commands atomically.
+
+        Args:
+            lines (list of str): nft commands, one per line.
+
+        Returns:
+            bool: True if nft applied the batch.
+        """
+        try:
+            subprocess.run(['nft', '-f', '-'], input='\n'.join(lines) + '\n',
+                           capture_output=True, text=True, check=True)
+            return True
+        except (subprocess.CalledProcessError, OSError) as e:
+            error = getattr(e, 'stderr', None) or e
+            log.log(f"nft batch failed: {error}", logging.WARNING)
+            return False
+
+
+class RecordingOffload(NftablesOffload):
+    """Dry-run backend that records the nft batches instead of running them.
+
+    Useful for inspecting or testing the offload logic without root.
+    """
+
+    def __init__(self, table=TABLE_NAME, priority=-10):
+        super().__init__(table, priority)
+        self.batches = []
+
+    def _execute(self, lines):
+        self.batches.append(list(lines))
+        log.log(f"[dry-run] nft batch of {len(lines)} commands", logging.DEBUG)
+        return True
+
+
+def make_offload(backend):
+    """Create a kernel offload backend by name.
+
+    Args:
+        backend (str or None): 'nftables', 'dry-run', or None/'none' to
+            disable offloading.
+
+    Returns:
+        NftablesOffload or None: The backend, or None when disabled.
+    """
+    if backend in (None, '', 'none'):
+        return None
+    if backend == 'nftables':
+        return NftablesOffload()
+    if backend == 'dry-run':
+        return RecordingOffload()
+    log.log(f"Unknown kernel offload backend: {backend}", logging.WARNING)
+    return None
@@ -0,0 +1,357 @@
+"""
+Multi-queue, multi-process packet filter.
+
+Binds a range of NFQUEUE numbers (to be used with iptables
+`--queue-balance first:last`) with one worker process per queue, so
+filtering scales across cores. The parent process keeps the single
+authoritative rule table: it expires and adds rules, merges the pattern
+counts reported by every worker, runs detection and pushes the updated
+rule set to every worker, whose local replica is swapped in atomically.
+"""
+import logging
+import multiprocessing
+import queue
+import subprocess
+import threading
+import time
+from src.net_manager.arp_protection import ArpProtection, set_arp_protection_level
+from src.net_manager.buffer import PacketBuffer
+from src.net_manager.intra_sys_coms import RULE_PORT, network_thread, queue_rules, drain_messages
+from src.net_manager.intra_sys_coms import register_metrics as register_message_metrics
+from src.net_manager.kernel_offload import make_offload
+from src.net_manager.neigh_monitor import start_neighbour_monitor
+from src.net_manager.packet_sources import NfqueueSource
+from src.net_manager.pipeline import PacketPipeline
+from src.net_manager.rules import Rules, RuleSendFilter
+from src.tools import event_log
+from src.tools.logger import Logger
+from src.tools.metrics import REGISTRY, serve_metrics
+from src.tools.profiler import PROFILER, install_signal_toggle, serve_control_socket
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+
+def run_queue_worker(queue_num, rule_queue, stats_queue, pacify, debug_decode, flow_cache_size, period,
+                     buffer_options, profile_socket=''):
+    """Entry point of a worker process filtering one NFQUEUE.
+
+    Args:
+        queue_num (int): NFQUEUE number to bind.
+        rule_queue (multiprocessing.Queue): Rule snapshots from the coordinator.
+        stats_queue (multiprocessing.Queue): Pattern counts sent to the coordinator.
+        pacify (bool): Filter packets; when False every packet is accepted.
+        debug_decode (bool): Decode every packet with scapy (slow).
+        flow_cache_size (int): Flows whose verdict is cached (0 disables).
+        period (float): Seconds between pattern count reports.
+        buffer_options (dict): Keyword arguments of the worker's PacketBuffer.
+        profile_socket (str): Profiler control socket of the coordinator; the
+            worker's own is `<profile_socket>.<queue_num>` (empty disables it).
+    """
+    if profile_socket:
+        serve_control_socket(f"{profile_socket}.{queue_num}")
+
+    packet_buffer = PacketBuffer(**buffer_options)
+    rules = Rules()
+    pipeline = PacketPipeline(packet_buffer, rules, pacify, debug_decode, flow_cache_size)
+
+    sync = threading.Thread(
+        target=sync_with_coordinator,
+        daemon=True,
+        args=(queue_num, pipeline, rule_queue, stats_queue, period))
+    sync.start()
+
+    source = NfqueueSource(queue_num)
+    try:
+        source.run(pipeline.print_and_check)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+
+
+def sync_with_coordinator(queue_num, pipeline, rule_queue, stats_queue, period):
+    """Apply rule snapshots as they arrive and report pattern counts every period.
+
+    Args:
+        queue_num (int): NFQUEUE number of this worker.
+        pipeline (PacketPipeline): The worker's packet buffer, local replica
+            of the coordinator's rule table and verdict counters.
+        rule_queue (multiprocessing.Queue): Rule snapshots from the coordinator.
+        stats_queue (multiprocessing.Queue): Pattern counts and pipeline
+            statistics sent to the coordinator.
+        period (float): Seconds between pattern count reports.
+    """
+    packet_buffer = pipeline.packet_buffer
+    deadline = time.time() + period
+    while True:
+        try:
+            snapshot = rule_queue.get(timeout=max(0, deadline - time.time()))
+            pipeline.rules.replace_rules(snapshot)
+        except queue.Empty:
+            deadline += period
+            stats = {
+                'accept': pipeline.accepted,
+                'drop': pipeline.dropped,
+                'buffered': len(packet_buffer),
+                'capacity': packet_buffer.capacity,
+                'latency': pipeline.callback_latency.reset(),
+            }
+            stats_queue.put((queue_num, packet_buffer.pattern_counts(), stats))
+
+
+class MultiQueueFilter:
+    """Coordinator of one filtering process per NFQUEUE in a range."""
+
+    def __init__(self, first_queue, last_queue, router_id, pacify=False, debug_decode=False,
+                 offload_backend=None, flow_cache_size=65536, buffer_options=None,
+                 neighbour_monitor=True, arp_hold_time=30.0, metrics_port=0,
+                 profile_socket='', profile_sample_every=100):
+        """Start the worker processes and run the coordination loop until interrupted.
+
+        Args:
+            first_queue (int): First NFQUEUE number of the balanced range.
+            last_queue (int): Last NFQUEUE number of the balanced range.
+            router_id (int): Router number, used for inter-router messaging.
+                The coordinator receives rules on 172.16.0.<router_id>:RULE_PORT
+                (5002), in place of the queue-2 process of a single-queue router.
+            pacify (bool): Filter packets; when False every packet is accepted.
+            debug_decode (bool): Decode every packet with scapy (slow).
+            offload_backend (str, optional): Kernel offload backend name.
+            flow_cache_size (int): Flows whose verdict is cached per worker.
+            buffer_options (dict, optional): Keyword arguments of each
+                worker's PacketBuffer (ring capacity, detection window).
+            neighbour_monitor (bool): Raise ARP rules from rtnetlink neighbour
+                events instead of polling the ARP table every cycle.
+            arp_hold_time (float): Seconds a lower ARP alert level must persist
+                before the kernel protection is relaxed.
+            metrics_port (int): Local HTTP port serving the metrics of all
+                workers (0 disables it).
+            profile_socket (str): Unix socket path toggling the stage profiler
+                of the coordinator; each worker listens on `<path>.<queue>`
+                (empty disables the sockets). SIGUSR2 toggles the profiler
+                of the process it is sent to.
+            profile_sample_every (int): Profile one packet out of this many.
+        """
+        self.router_id = router_id
+        freq = 0.2
+        self.period = 1/freq
+        self.workers = []
+        self.send_filter = RuleSendFilter(2 * self.period)
+        # Latest statistics reported by each worker, by queue number
+        self.worker_stats = {}
+        # Latest window counts reported by each worker, when they do not drain
+        self.worker_counts = {}
+        self.packets_per_second = 0.0
+        self.last_cycle = time.time()
+
+        try:
+            set_arp_protection_level(1)
+            subprocess.run([
+                'sudo', 'ip', 'neigh', 'flush', 'all'
+            ], check=True)
+
+            # Only evaluates the counts merged from the workers' buffers,
+            # with the same detection backend
+            self.packer_buffer = PacketBuffer(**{**(buffer_options or {}), 'capacity': 1})
+            self.offload = make_offload(offload_backend)
+            if self.offload is not None and not self.offload.setup():
+                log.log("Kernel offload unavailable, filtering in userspace only", logging.WARNING)
+                self.offload = None
+            self.rules = Rules(offload=self.offload, arp_protection=ArpProtection(arp_hold_time))
+
+            # Inherited by the workers: each toggles its own profiler
+            PROFILER.sample_every = max(1, profile_sample_every)
+            install_signal_toggle()
+
+            # Fork the workers before starting any thread in this process;
+            # the logger restarts its writer in the children and the event
+            # log is left to the coordinator
+            context = multiprocessing.get_context('fork')
+            self.stats_queue = context.Queue()
+            for queue_num in range(first_queue, last_queue + 1):
+                rule_queue = context.Queue()
+                process = context.Process(
+                    target=run_queue_worker,
+                    name=f"nfqueue-{queue_num}",
+                    daemon=True,
+                    args=(queue_num, rule_queue, self.stats_queue, pacify, debug_decode,
+                          flow_cache_size, self.period, buffer_options or {}, profile_socket))
+                process.start()
+                self.workers.append((queue_num, process, rule_queue))
+
+            # Inter-router messaging is handled once, by the coordinator,
+            # listening on the port every router sends its rules to
+            self.network_thread = threading.Thread(
+                target=network_thread,
+                daemon=True,
+                args=(router_id, first_queue),
+                kwargs={'port': RULE_PORT})
+            self.network_thread.start()
+            self.neighbour_monitor = None
+            if neighbour_monitor:
+                self.neighbour_monitor = start_neighbour_monitor(self.apply_rules, self.resume_arp_polling)
+                if self.neighbour_monitor is not None:
+                    self.packer_buffer.arp_polling = False
+            self.register_metrics(REGISTRY)
+            self.metrics_server = serve_metrics(metrics_port)
+            self.profile_server = serve_control_socket(profile_socket)
+
+            log.log(f"[*] Filtering NFQUEUE {first_queue}-{last_queue} "
+                    f"with {len(self.workers)} worker processes", logging.INFO)
+            print("[*] Press Ctrl+C to exit")
+
+            # Sleep until the next cycle or the next rule expiry
+            next_cycle = time.time() + self.period
+            while True:
+                with self.rules.update_lock:
+                    next_expiry = self.rules.next_expiry()
+                deadline = next_cycle if next_expiry is None else min(next_cycle, next_expiry)
+                time.sleep(max(0.0, deadline - time.time()))
+                now = time.time()
+                if now >= next_cycle:
+                    next_cycle = max(next_cycle + self.period, now)
+                    self.run_cycle()
+                else:
+                    self.expire_rules(now)
+
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            log.log(f"\n[!] Error: {e}", logging.ERROR)
+        finally:
+            if getattr(self, 'neighbour_monitor', None) is not None:
+                self.neighbour_monitor.stop()
+            if getattr(self, 'metrics_server', None) is not None:
+                self.metrics_server.shutdown()
+            if getattr(self, 'profile_server', None) is not None:
+                self.profile_server.shutdown()
+            for queue_num, process, rule_queue in self.workers:
+                process.terminate()
+                process.join(timeout=1)
+            if getattr(self, 'offload', None) is not None:
+                self.offload.teardown()
+
+    def resume_arp_polling(self):
+        """Poll the ARP table every cycle again once the neighbour monitor has stopped."""
+        self.packer_buffer.arp_polling = True
+
+    def register_metrics(self, registry):
+        """Expose the rule table and the statistics reported by the workers.
+
+        Args:
+            registry (MetricsRegistry): Registry the metrics are added to.
+        """
+        self.latency_metric = registry.histogram(
+            'router_callback_latency_seconds', 'NFQUEUE callback latency, all workers')
+        self.analysis_metric = registry.histogram(
+            'router_analysis_duration_seconds', 'Duration of the merged analysis of a cycle')
+        registry.counter('router_packets_total', 'Packets given a verdict, by verdict',
+                         lambda: {verdict: sum(stats[verdict] for stats in list(self.worker_stats.values()))
+                                  for verdict in ('accept', 'drop')},
+                         label='verdict')
+        registry.gauge('router_packets_per_second', 'Packets per second over the last analysis cycle',
+                       lambda: self.packets_per_second)
+        registry.gauge('router_buffer_packets', 'Packets held in the packet buffer rings',
+                       lambda: sum(stats['buffered'] for stats in list(self.worker_stats.values())))
+        registry.gauge('router_buffer_capacity', 'Packets the packet buffer rings can hold',
+                       lambda: sum(stats['capacity'] for stats in list(self.worker_stats.values())))
+        registry.gauge('router_rules_active', 'Active rules, by field',
+                       lambda: {field: count for field, count in list(self.rules.field_counts.items()) if count},
+                       label='field')
+        registry.gauge('router_arp_protection_level', 'Kernel ARP protection level in effect (1-4)',
+                       lambda: self.rules.arp_protection.level)
+        register_message_metrics(registry)
+
+    def collect_counts(self):
+        """Return the pattern counts of the workers to merge this cycle.
+
+        Reports are sent on the workers' own timers, so a cycle may get
+        none or several from one queue. Counts that drain (snapshot,
+        sketch) are all merged; sliding-window counts already cover the
+        whole window, so only the latest report of each queue is used.
+
+        The pipeline statistics sent along are kept in `worker_stats`, and
+        their callback latency samples merged into the metrics.
+        """
+        drains = self.packer_buffer.counts_drain
+        counts_list = []
+        packets = 0
+        while True:
+            try:
+                queue_num, counts, stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            if drains:
+                counts_list.append(counts)
+            else:
+                self.worker_counts[queue_num] = counts
+            latency = stats.pop('latency')
+            packets += latency.total
+            self.latency_metric.merge(latency)
+            self.worker_stats[queue_num] = stats
+        now = time.time()
+        self.packets_per_second = packets / max(now - self.last_cycle, 1e-6)
+        self.last_cycle = now
+        if not drains:
+            return list(self.worker_counts.values())
+        return counts_list
+
+    def expire_rules(self, time_current):
+        """Remove expired rules and push the table to the workers if any expired.
+
+        Args:
+            time_current (float): Expiry reference time.
+        """
+        with self.rules.update_lock:
+            if self.rules.clear_rules(time_current):
+                self.push_rules()
+
+    def push_rules(self):
+        """Send a snapshot of the rule table to every worker."""
+        snapshot = list(self.rules.all_rules)
+        for queue_num, process, rule_queue in self.workers:
+            rule_queue.put(snapshot)
+
+    def apply_rules(self, rule_strs, time_current=None):
+        """Expire old rules, add new ones and push the table to the workers.
+
+        Safe to call from other threads, e.g. the neighbour monitor.
+
+        Args:
+            rule_strs (list): Rule strings or Rule objects to add.
+            time_current (float, optional): Expiry reference time, defaults
+                to the current time.
+        """
+        if time_current is None:
+            time_current = time.time()
+        with self.rules.update_lock:
+            self.rules.clear_rules(time_current)
+            self.rules.add_rules(rule_strs)
+            self.push_rules()
+
+    def run_cycle(self):
+        """Update the shared rule table, push it to the workers and run detection.
+
+        Returns:
+            tuple:
+                results (dict): Analysis metrics over all queues.
+                new_rules (list of str): Rules generated and sent this cycle
+                    (new, or refreshing ones about to expire).
+        """
+        with PROFILER.stage('messages'):
+            rule_strs = drain_messages()
+        with PROFILER.stage('expiry'):
+            self.apply_rules(rule_strs)
+
+        counts = self.packer_buffer.merge_counts(self.collect_counts())
+        analysis_start = time.perf_counter_ns()
+        with PROFILER.stage('analysis'):
+            results, new_rules = self.packer_buffer.analyze_counts(counts)
+        self.analysis_metric.observe(time.perf_counter_ns() - analysis_start)
+        event_log.emit(event_log.ANALYSIS, **self.packer_buffer.results_summary(results, new_rules))
+        new_rules = self.send_filter.filter(new_rules)
+        if new_rules:
+            queue_rules("172.16.0."+str(self.router_id), new_rules, self.router_id)
+        PROFILER.end_cycle()
+
+        return results, new_rules
@@ -0,0 +1,340 @@
+"""
+Event-driven neighbour-table monitoring for ARP flood detection.
+
+Subscribes to rtnetlink RTM_NEWNEIGH/RTM_DELNEIGH notifications and keeps
+live neighbour and unique-MAC counts plus the rate at which new MACs
+appear. `arp///20` rules are raised as soon as a threshold is crossed,
+instead of once per analysis period when the table happens to be polled.
+A replay source feeds recorded or synthetic events for tests.
+"""
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import Counter, namedtuple
+from src.net_manager.window_counters import SlidingWindowCounter
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+# rtnetlink constants (linux/rtnetlink.h, linux/neighbour.h)
+NETLINK_ROUTE = 0
+RTMGRP_NEIGH = 0x4
+NLMSG_DONE = 3
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NDA_DST = 1
+NDA_LLADDR = 2
+# asm-generic/socket.h
+SO_RCVBUFFORCE = 33
+
+# Receive buffer asked for, so an ARP flood does not overflow the socket
+RECEIVE_BUFFER = 4 << 20
+
+_NLMSG_HDR = struct.Struct('=IHHII')
+_NDMSG = struct.Struct('=BxxxiHBB')
+_RTATTR = struct.Struct('=HH')
+
+# kind is 'new', 'del', 'done' (end of a table dump) or 'resync' (events
+# were lost, a new dump follows)
+NeighbourEvent = namedtuple('NeighbourEvent', ['time', 'kind', 'ifindex', 'ip', 'mac'])
+
+
+def parse_neighbour_messages(data, now=None):
+    """Parse the neighbour messages of one rtnetlink datagram.
+
+    Args:
+        data (bytes): Datagram received from a NETLINK_ROUTE socket.
+        now (float, optional): Timestamp given to the events.
+
+    Returns:
+        list of NeighbourEvent: IPv4 neighbour changes in the datagram.
+    """
+    if now is None:
+        now = time.time()
+    events = []
+    offset = 0
+    while offset + _NLMSG_HDR.size <= len(data):
+        length, msg_type, _, _, _ = _NLMSG_HDR.unpack_from(data, offset)
+        if length < _NLMSG_HDR.size:
+            break
+        end = offset + length
+        if msg_type == NLMSG_DONE:
+            events.append(NeighbourEvent(now, 'done', 0, None, None))
+        elif msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            family, ifindex, _, _, _ = _NDMSG.unpack_from(data, offset + _NLMSG_HDR.size)
+            ip = mac = None
+            attr = offset + _NLMSG_HDR.size + _NDMSG.size
+            while attr + _RTATTR.size <= end:
+                attr_len, attr_type = _RTATTR.unpack_from(data, attr)
+                if attr_len < _RTATTR.size:
+                    break
+                value = data[attr + _RTATTR.size:attr + attr_len]
+                if attr_type == NDA_DST and family == socket.AF_INET and len(value) == 4:
+                    ip = socket.inet_ntoa(value)
+                elif attr_type == NDA_LLADDR:
+                    mac = ':'.join(f'{byte:02x}' for byte in value)
+                attr += (attr_len + 3) & ~3
+            if family == socket.AF_INET:
+                kind = 'new' if msg_type == RTM_NEWNEIGH else 'del'
+                events.append(NeighbourEvent(now, kind, ifindex, ip, mac))
+        offset += (length + 3) & ~3
+    return events
+
+
+class NetlinkNeighbourSource:
+    """Live neighbour events from the kernel, starting with a dump of the current table.
+
+    When the socket overflows (ENOBUFS) the lost events are recovered by
+    dumping the table again, announced by a 'resync' event.
+    """
+
+    # The events start with a dump of the existing table, ended by 'done'
+    initial_dump = True
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            # SO_RCVBUFFORCE ignores net.core.rmem_max but needs CAP_NET_ADMIN
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, RECEIVE_BUFFER)
+        except OSError:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        self.sock.bind((0, RTMGRP_NEIGH))
+        self.closed = False
+        self.dump_sequence = 0
+
+    def request_dump(self):
+        """Ask for the current IPv4 table; the replies end with NLMSG_DONE."""
+        self.dump_sequence += 1
+        request = _NDMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        header = _NLMSG_HDR.pack(_NLMSG_HDR.size + len(request), RTM_GETNEIGH,
+                                 NLM_F_REQUEST | NLM_F_DUMP, self.dump_sequence, 0)
+        self.sock.send(header + request)
+
+    def events(self):
+        """Yield neighbour events until the source is closed."""
+        self.request_dump()
+        while not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except OSError as e:
+                if self.closed:
+                    return
+                if e.errno != errno.ENOBUFS:
+                    log.log(f"Netlink receive error: {e}", logging.WARNING)
+                    return
+                # Notifications were dropped, e.g. during an ARP flood
+                log.log("Netlink socket overflowed, dumping the neighbour table again", logging.WARNING)
+                yield NeighbourEvent(time.time(), 'resync', 0, None, None)
+                try:
+                    self.request_dump()
+                except OSError as e:
+                    log.log(f"Netlink dump request failed: {e}", logging.WARNING)
+                    return
+                continue
+            yield from parse_neighbour_messages(data)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+
+class ReplayNeighbourSource:
+    """Stand-in event source replaying a list of NeighbourEvents."""
+
+    def __init__(self, events, realtime=False, initial_dump=False):
+        """Initialise the replay.
+
+        Args:
+            events (iterable of NeighbourEvent): Events to replay in order.
+            realtime (bool): Sleep between events to honour their timestamps.
+            initial_dump (bool): The events start with a table dump ended by
+                a 'done' event, whose entries are not counted as growth.
+        """
+        self.replay = list(events)
+        self.realtime = realtime
+        self.initial_dump = initial_dump
+        self.closed = False
+
+    def events(self):
+        """Yield the recorded events."""
+        previous = None
+        for event in self.replay:
+            if self.closed:
+                return
+            if self.realtime and previous is not None and event.time > previous:
+                time.sleep(event.time - previous)
+            previous = event.time
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class NeighbourMonitor(threading.Thread):
+    """Keep live neighbour counts and raise ARP rules when thresholds are crossed.
+
+    The number of `arp///20` rules wanted at any time mirrors the polling
+    detector: one per table-size threshold exceeded and one per new-MAC
+    growth threshold exceeded (growth counted over `window` seconds).
+    Rules are only raised for the part of that level not already covered
+    by rules raised within the rule TTL.
+    """
+
+    RULE = 'arp///20'
+    RULE_TTL = 20
+
+    def __init__(self, source, on_rules, size_thresholds=(1024, 1536),
+                 growth_thresholds=(64, 128, 256), window=5.0, on_exit=None):
+        """Initialise the monitor.
+
+        Args:
+            source: Event source with `events()` and `close()` methods and an
+                `initial_dump` flag.
+            on_rules (callable): Called with a list of rule strings whenever
+                new rules are raised.
+            size_thresholds (tuple of int): Unique-MAC counts that each warrant a rule.
+            growth_thresholds (tuple of int): New MACs within `window` seconds
+                that each warrant a rule.
+            window (float): Seconds over which MAC growth is measured.
+            on_exit (callable, optional): Called without arguments if the
+                monitor stops before `stop` is called, e.g. to fall back to
+                polling the ARP table.
+        """
+        super().__init__(name="neighbour-monitor", daemon=True)
+        self.source = source
+        self.on_rules = on_rules
+        self.size_thresholds = size_thresholds
+        self.growth_thresholds = growth_thresholds
+        self.window = window
+        self.on_exit = on_exit
+        self.stopping = False
+        # (ifindex, ip) -> mac, and number of entries per mac
+        self.entries = {}
+        self.mac_refs = Counter()
+        self.growth = SlidingWindowCounter(window, window / 5)
+        # Initial table dump is counted but not treated as growth
+        self.seeded = not source.initial_dump
+        # Entries not seen again yet in the dump following a resync
+        self.stale = None
+        self.raised = []
+
+    @property
+    def mac_count(self):
+        """Number of unique MAC addresses in the neighbour table."""
+        return len(self.mac_refs)
+
+    def growth_rate(self, now=None):
+        """Return the average number of new MACs per second over the window."""
+        total, _ = self.growth.snapshot(now)
+        return total / self.window
+
+    def run(self):
+        """Process events until the source is exhausted or closed."""
+        try:
+            for event in self.source.events():
+                self.handle(event)
+        except Exception as e:
+            log.log(f"Neighbour monitor stopped: {e}", logging.ERROR)
+        finally:
+            if not self.stopping and self.on_exit is not None:
+                log.log("Neighbour monitor ended, falling back to ARP table polling", logging.WARNING)
+                self.on_exit()
+
+    def stop(self):
+        self.stopping = True
+        self.source.close()
+
+    def handle(self, event):
+        """Apply one neighbour event and raise rules if a threshold is crossed.
+
+        Args:
+            event (NeighbourEvent): Event to apply.
+
+        Returns:
+            list of str: Rules raised by this event.
+        """
+        if event.kind == 'done':
+            self.seeded = True
+            if self.stale:
+                # Entries deleted while notifications were being dropped
+                for key in self.stale:
+                    self._release(self.entries.pop(key))
+            self.stale = None
+            return []
+        if event.kind == 'resync':
+            self.stale = set(self.entries)
+            return []
+
+        key = (event.ifindex, event.ip)
+        if self.stale is not None:
+            self.stale.discard(key)
+        old_mac = self.entries.get(key)
+        if event.kind == 'del' or not event.mac:
+            if old_mac is not None:
+                del self.entries[key]
+                self._release(old_mac)
+            return []
+        if old_mac == event.mac:
+            return []
+
+        if old_mac is not None:
+            self._release(old_mac)
+        self.entries[key] = event.mac
+        is_new_mac = event.mac not in self.mac_refs
+        self.mac_refs[event.mac] += 1
+        if not is_new_mac or not self.seeded:
+            return []
+
+        self.growth.add(None, event.time)
+        return self._check(event.time)
+
+    def _release(self, mac):
+        """Drop one neighbour entry reference to a MAC address."""
+        self.mac_refs[mac] -= 1
+        if self.mac_refs[mac] <= 0:
+            del self.mac_refs[mac]
+
+    def _check(self, now):
+        """Raise the rules needed to cover the current alert level."""
+        growth, _ = self.growth.snapshot(now)
+        level = sum(1 for threshold in self.size_thresholds if self.mac_count > threshold)
+        level += sum(1 for threshold in self.growth_thresholds if growth > threshold)
+
+        self.raised = [raised_at for raised_at in self.raised if now - raised_at <= self.RULE_TTL]
+        missing = level - len(self.raised)
+        if missing <= 0:
+            return []
+
+        self.raised += [now] * missing
+        rules = [self.RULE] * missing
+        log.log(f"Neighbour table: {self.mac_count} MACs, {growth} new in {self.window}s, "
+                f"raising {missing} ARP rule(s)", logging.WARNING)
+        self.on_rules(rules)
+        return rules
+
+
+def start_neighbour_monitor(on_rules, on_exit=None):
+    """Start a neighbour monitor on the live kernel table.
+
+    Args:
+        on_rules (callable): Called with the list of raised rule strings.
+        on_exit (callable, optional): Called if the monitor stops on its own.
+
+    Returns:
+        NeighbourMonitor or None: Running monitor, or None if rtnetlink is
+            unavailable (ARP detection then falls back to polling).
+    """
+    try:
+        source = NetlinkNeighbourSource()
+    except OSError as e:
+        log.log(f"Neighbour monitor unavailable: {e}", logging.WARNING)
+        return None
+    monitor = NeighbourMonitor(source, on_rules, on_exit=on_exit)
+    monitor.start()
+    return monitor
@@ -0,0 +1,101 @@
+"""
+Lightweight IPv4 header parser for the NFQUEUE hot path.
+
+Reads only the fields the filter pipeline needs (addresses, protocol,
+ports and TCP flags) directly from the raw payload bytes, without building
+a scapy packet. A scapy based decoder with the same output is kept for
+debugging.
+"""
+import socket
+import struct
+from collections import namedtuple
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+TCP_SYN = 0x02
+
+# Compact per-packet record shared by the verdict path and PacketBuffer.
+# Addresses are kept both as dotted strings (rule lookups) and as 32-bit
+# integers (compact buffer storage).
+PacketRecord = namedtuple('PacketRecord', ['src', 'dst', 'proto', 'sport', 'dport', 'flags',
+                                           'src_ip', 'dst_ip'])
+
+_IPV4_ADDRS = struct.Struct('!4s4s')
+_L4_PORTS = struct.Struct('!HH')
+_FRAG_FIELD = struct.Struct('!H')
+_inet_ntoa = socket.inet_ntoa
+_from_bytes = int.from_bytes
+
+
+def ip_to_int(address):
+    """Convert a dotted IPv4 address to a 32-bit integer."""
+    return _from_bytes(socket.inet_aton(address), 'big')
+
+
+def int_to_ip(value):
+    """Convert a 32-bit integer to a dotted IPv4 address."""
+    return _inet_ntoa(int(value).to_bytes(4, 'big'))
+
+
+def parse_packet(payload):
+    """Extract the filter-relevant header fields from a raw IPv4 packet.
+
+    Args:
+        payload (bytes): Raw packet starting at the IPv4 header, as returned
+            by NetfilterQueue's `get_payload`.
+
+    Returns:
+        PacketRecord or None: Parsed header fields, or None if the payload
+            is not a well-formed IPv4 packet. Ports and flags are 0 when the
+            packet carries no TCP/UDP header (or is a non-first fragment).
+    """
+    if len(payload) < 20 or payload[0] >> 4 != 4:
+        return None
+
+    ihl = (payload[0] & 0x0f) * 4
+    proto = payload[9]
+    src, dst = _IPV4_ADDRS.unpack_from(payload, 12)
+    sport = dport = flags = 0
+
+    # Only the first fragment carries the transport header
+    if proto in (PROTO_TCP, PROTO_UDP) and not _FRAG_FIELD.unpack_from(payload, 6)[0] & 0x1fff:
+        if len(payload) >= ihl + 4:
+            sport, dport = _L4_PORTS.unpack_from(payload, ihl)
+        if proto == PROTO_TCP and len(payload) > ihl + 13:
+            flags = payload[ihl + 13]
+
+    return PacketRecord(_inet_ntoa(src), _inet_ntoa(dst), proto, sport, dport, flags,
+                        _from_bytes(src, 'big'), _from_bytes(dst, 'big'))
+
+
+def parse_packet_scapy(payload):
+    """Decode a raw IPv4 packet with scapy and return the same record.
+
+    Much slower than `parse_packet`; intended for debugging only.
+
+    Args:
+        payload (bytes): Raw packet starting at the IPv4 header.
+
+    Returns:
+        tuple:
+            record (PacketRecord or None): Parsed header fields.
+            ip_packet (scapy.layers.inet.IP): Fully decoded scapy packet.
+    """
+    from scapy.all import IP
+
+    ip_packet = IP(payload)
+    if ip_packet.version != 4:
+        return None, ip_packet
+
+    sport = dport = flags = 0
+    if ip_packet.haslayer('TCP'):
+        tcp_layer = ip_packet['TCP']
+        sport, dport, flags = tcp_layer.sport, tcp_layer.dport, int(tcp_layer.flags)
+    elif ip_packet.haslayer('UDP'):
+        udp_layer = ip_packet['UDP']
+        sport, dport = udp_layer.sport, udp_layer.dport
+
+    record = PacketRecord(ip_packet.src, ip_packet.dst, ip_packet.proto, sport, dport, flags,
+                          ip_to_int(ip_packet.src), ip_to_int(ip_packet.dst))
+    return record, ip_packet
@@ -0,0 +1,297 @@
+"""
+Interchangeable packet sources for the filter pipeline.
+
+Every source delivers packets to a callback taking an object with
+`get_payload()` (the IPv4 packet), `accept()` and `drop()`, like a
+NetfilterQueue packet, so the same buffer, detection and rule pipeline
+runs on top of any of them:
+
+    NfqueueSource   - inline filtering of an NFQUEUE (verdicts enforced)
+    AfPacketSource  - passive capture from an AF_PACKET TPACKET_V3
+                      memory-mapped ring, e.g. on a mirror port; detection
+                      only, verdicts are ignored and rules are enforced by
+                      the inline routers they are sent to
+    PcapSource      - replay of a pcap file
+
+Sources share `run(callback)`, which blocks until the source is exhausted
+or `stop()` is called, and `close()`; `inline` tells whether verdicts
+take effect.
+"""
+import logging
+import mmap
+import select
+import socket
+import struct
+import threading
+import time
+from src.tools.logger import Logger
+from src.tools.pcap import ReplayPacket, read_ipv4_packets
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ETH_P_IP = 0x0800
+
+# struct tpacket_req3
+_TPACKET_REQ3 = struct.Struct('=7I')
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+# (block_status, num_pkts, offset_to_first_pkt, ...)
+_BLOCK_STATUS_OFFSET = 8
+_BLOCK_HEADER = struct.Struct('=III')
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+# tp_status, tp_mac, tp_net
+_PACKET_HEADER = struct.Struct('=IIIIIIHH')
+# struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+_PACKET_STATS = struct.Struct('=III')
+
+
+class NfqueueSource:
+    """Inline packets from an NFQUEUE; verdicts are enforced by the kernel."""
+
+    inline = True
+
+    def __init__(self, queue_num):
+        """Bind lazily to an NFQUEUE.
+
+        Args:
+            queue_num (int): Queue number used by the iptables NFQUEUE rule.
+        """
+        self.queue_num = queue_num
+        self.nfqueue = None
+
+    def run(self, callback):
+        """Bind the queue and process packets until interrupted."""
+        from netfilterqueue import NetfilterQueue
+
+        self.nfqueue = NetfilterQueue()
+        # Make sure your iptables rule uses the same queue number
+        self.nfqueue.bind(self.queue_num, callback)
+        log.log(f"[*] Waiting for packets in NFQUEUE {self.queue_num}...", logging.INFO)
+        self.nfqueue.run()
+
+    def stop(self):
+        """NetfilterQueue.run only returns on an interrupt; nothing to signal."""
+
+    def close(self):
+        """Unbind from the queue."""
+        if self.nfqueue is not None:
+            try:
+                self.nfqueue.unbind()
+            except Exception:
+                pass
+            self.nfqueue = None
+
+
+class CapturedPacket:
+    """Packet of a passive source: verdicts are accepted and ignored.
+
+    The payload may be a memoryview into the capture ring, valid only
+    during the callback.
+    """
+
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get_payload(self):
+        """Return the IPv4 packet."""
+        return self.payload
+
+    def accept(self):
+        pass
+
+    def drop(self):
+        pass
+
+
+class AfPacketSource:
+    """Passive IPv4 capture from an AF_PACKET TPACKET_V3 memory-mapped ring.
+
+    The kernel fills blocks of the ring shared with this process; packets
+    are handed to the callback as memoryviews into the ring, without a
+    copy or a system call per packet, and each block is returned to the
+    kernel once all its packets were processed.
+    """
+
+    inline = False
+
+    def __init__(self, interface, block_size=1 << 20, block_count=64, frame_size=2048,
+                 block_timeout_ms=50):
+        """Configure the capture.
+
+        Args:
+            interface (str): Interface to capture on, e.g. a mirror port.
+            block_size (int): Bytes per ring block, a multiple of the page size.
+            block_count (int): Blocks in the ring.
+            frame_size (int): Frame slot size given to the kernel (TPACKET_V3
+                packs variable-length frames, this only bounds the count).
+            block_timeout_ms (int): Milliseconds after which the kernel hands
+                over a block that is not full yet.
+        """
+        self.interface = interface
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.sock = None
+        self.ring = None
+        self.stop_event = threading.Event()
+
+    def open(self):
+        """Create the socket and map the ring."""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+        try:
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_count = self.block_size * self.block_count // self.frame_size
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _TPACKET_REQ3.pack(
+                self.block_size, self.block_count, self.frame_size, frame_count,
+                self.block_timeout_ms, 0, 0))
+            self.ring = mmap.mmap(sock.fileno(), self.block_size * self.block_count,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            sock.bind((self.interface, ETH_P_IP))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        log.log(f"[*] Capturing passively on {self.interface} "
+                f"({self.block_count} x {self.block_size >> 10} KiB ring)", logging.INFO)
+
+    def run(self, callback):
+        """Process captured packets until `stop` is called."""
+        if self.sock is None:
+            self.open()
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN | select.POLLERR)
+        ring = self.ring
+        view = memoryview(ring)
+        block = 0
+        try:
+            while not self.stop_event.is_set():
+                offset = block * self.block_size
+                status = struct.unpack_from('=I', ring, offset + _BLOCK_STATUS_OFFSET)[0]
+                if not status & TP_STATUS_USER:
+                    poller.poll(100)
+                    continue
+                self._process_block(view, offset, callback)
+                # Hand the block back to the kernel
+                struct.pack_into('=I', ring, offset + _BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+                block = (block + 1) % self.block_count
+        finally:
+            view.release()
+
+    @staticmethod
+    def _process_block(view, offset, callback):
+        """Deliver the packets of one filled block."""
+        _, packet_count, packet_offset = _BLOCK_HEADER.unpack_from(view, offset + _BLOCK_STATUS_OFFSET)
+        position = offset + packet_offset
+        for _ in range(packet_count):
+            next_offset, _, _, snaplen, _, _, mac, net = _PACKET_HEADER.unpack_from(view, position)
+            start = position + net
+            payload = view[start:position + mac + snaplen]
+            try:
+                callback(CapturedPacket(payload))
+            finally:
+                payload.release()
+            position += next_offset
+
+    def statistics(self):
+        """Return the packets received and dropped by the kernel since the last call."""
+        if self.sock is None:
+            return {'packets': 0, 'drops': 0}
+        packets, drops, _ = _PACKET_STATS.unpack(
+            self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _PACKET_STATS.size))
+        return {'packets': packets, 'drops': drops}
+
+    def stop(self):
+        """Ask `run` to return."""
+        self.stop_event.set()
+
+    def close(self):
+        """Unmap the ring and close the socket."""
+        if self.sock is not None:
+            stats = self.statistics()
+            log.log(f"Capture on {self.interface}: {stats['packets']} packets, "
+                    f"{stats['drops']} dropped by the kernel", logging.INFO)
+            self.ring.close()
+            self.sock.close()
+            self.sock = None
+
+
+class PcapSource:
+    """Replay of the IPv4 packets of a pcap file."""
+
+    inline = False
+
+    def __init__(self, path, speed=1.0):
+        """Configure the replay.
+
+        Args:
+            path (str): pcap file.
+            speed (float): Replay speed relative to the capture timestamps;
+                0 replays as fast as possible.
+        """
+        self.path = path
+        self.speed = speed
+        self.stop_event = threading.Event()
+
+    def run(self, callback):
+        """Replay the file once, or until `stop` is called."""
+        log.log(f"[*] Replaying {self.path}", logging.INFO)
+        first = start = None
+        replayed = 0
+        for timestamp, payload in read_ipv4_packets(self.path):
+            if self.stop_event.is_set():
+                break
+            if self.speed > 0:
+                if first is None:
+                    first, start = timestamp, time.monotonic()
+                delay = (timestamp - first) / self.speed - (time.monotonic() - start)
+                if delay > 0 and self.stop_event.wait(delay):
+                    break
+            callback(ReplayPacket(payload))
+            replayed += 1
+        log.log(f"Replayed {replayed} packets from {self.path}", logging.INFO)
+
+    def stop(self):
+        """Ask `run` to return."""
+        self.stop_event.set()
+
+    def close(self):
+        pass
+
+
+def make_packet_source(kind, queue_num=1, interface='', pcap_file='', pcap_speed=1.0):
+    """Create a packet source by name.
+
+    Args:
+        kind (str): 'nfqueue', 'af_packet' or 'pcap'.
+        queue_num (int): NFQUEUE number of the nfqueue source.
+        interface (str): Capture interface of the af_packet source.
+        pcap_file (str): File of the pcap source.
+        pcap_speed (float): Replay speed of the pcap source (0: unpaced).
+
+    Returns:
+        NfqueueSource, AfPacketSource or PcapSource: The source.
+
+    Raises:
+        ValueError: If the kind is unknown or its required option is missing.
+    """
+    if kind in (None, '', 'nfqueue'):
+        return NfqueueSource(queue_num)
+    if kind == 'af_packet':
+        if not interface:
+            raise ValueError("The af_packet source needs a capture_interface")
+        return AfPacketSource(interface)
+    if kind == 'pcap':
+        if not pcap_file:
+            raise ValueError("The pcap source needs a pcap_file")
+        return PcapSource(pcap_file, pcap_speed)
+    raise ValueError(f"Unknown packet source {kind}")
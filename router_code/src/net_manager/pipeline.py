@@ -0,0 +1,186 @@
+"""
+Per-packet verdict pipeline shared by every packet filter front end.
+
+Holds the state touched by the NFQUEUE callback (packet buffer, rule set,
+flow verdict cache and latency histogram) and implements the callback
+itself: parse, buffer append, lookup, verdict. Packets of a passive
+source are only parsed and buffered: no verdict can be enforced on them.
+"""
+import logging
+import time
+from src.net_manager.flow_cache import FlowCache
+from src.net_manager.packet_parser import parse_packet, parse_packet_scapy, PROTO_TCP, TCP_SYN
+from src.tools.latency import LatencyHistogram
+from src.tools.logger import Logger
+from src.tools.profiler import PROFILER
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+
+class PacketPipeline:
+    """Parse, buffer and issue a verdict for each queued packet."""
+
+    def __init__(self, packet_buffer, rules, pacify=False, debug_decode=False, flow_cache_size=65536,
+                 profiler=PROFILER, inline=True):
+        """Initialise the pipeline.
+
+        Args:
+            packet_buffer (PacketBuffer): Buffer receiving parsed packets.
+            rules (Rules): Rule set the verdicts are based on.
+            pacify (bool): Filter packets; when False every packet is accepted.
+            debug_decode (bool): Decode every packet with scapy (slow).
+            flow_cache_size (int): Flows whose verdict is cached (0 disables).
+            profiler (StageProfiler): Per-stage profiler of sampled packets.
+            inline (bool): The packets wait for a verdict; when False they
+                are only parsed and buffered for detection.
+        """
+        self.packet_buffer = packet_buffer
+        self.rules = rules
+        self.pacify = pacify
+        self.inline = inline
+        # Full scapy dissection of every packet, for debugging only
+        self.debug_decode = debug_decode
+        # Per-flow verdicts, invalidated whenever the rule set changes; a
+        # passive source never looks a verdict up
+        self.flow_cache = FlowCache(flow_cache_size) if inline and flow_cache_size > 0 else None
+        self.callback_latency = LatencyHistogram()
+        self.profiler = profiler
+        # Verdicts issued, read by the metrics endpoint
+        self.accepted = 0
+        self.dropped = 0
+
+    def print_and_check(self, pkt):
+        """
+        Callback function that prints packet info and accepts the packet
+        to be forwarded through iptables
+
+        Only parses, buffers, looks up and issues a verdict; the periodic
+        analysis runs on the AnalysisWorker thread.
+        """
+        start = time.perf_counter_ns()
+        try:
+            if self.profiler.enabled and self.profiler.sample():
+                self.check_packet_profiled(pkt)
+            else:
+                self.check_packet(pkt)
+        finally:
+            self.callback_latency.record(time.perf_counter_ns() - start)
+
+    def check_packet(self, pkt):
+        """Parse a queued packet, buffer it and accept or drop it."""
+        if not self.pacify:
+            if self.inline:
+                self.give_verdict(pkt, True)
+            return
+
+        record = self.parse(pkt.get_payload())
+        if record is None:
+            # Not an IPv4 packet, no rule can match it
+            if self.inline:
+                self.give_verdict(pkt, True)
+            return
+
+        self.packet_buffer.add_packet(record)
+        if self.inline:
+            self.give_verdict(pkt, self.lookup(record))
+
+    def check_packet_profiled(self, pkt):
+        """`check_packet` with every stage timed by the profiler.
+
+        Runs the same stage methods; only the timing calls are added, so
+        the unprofiled path pays none of them.
+        """
+        record = self.profiler.record
+        clock = time.perf_counter_ns
+        if not self.pacify:
+            if self.inline:
+                start = clock()
+                self.give_verdict(pkt, True)
+                record('verdict', clock() - start)
+            return
+
+        start = clock()
+        payload = pkt.get_payload()
+        fetched = clock()
+        record('payload', fetched - start)
+        packet_record = self.parse(payload)
+        parsed = clock()
+        record('parse', parsed - fetched)
+
+        if packet_record is None:
+            if self.inline:
+                self.give_verdict(pkt, True)
+                record('verdict', clock() - parsed)
+            return
+
+        self.packet_buffer.add_packet(packet_record)
+        buffered = clock()
+        record('buffer', buffered - parsed)
+        if not self.inline:
+            return
+        verdict = self.lookup(packet_record)
+        looked_up = clock()
+        record('lookup', looked_up - buffered)
+        self.give_verdict(pkt, verdict)
+        record('verdict', clock() - looked_up)
+
+    def parse(self, payload):
+        """Read the header fields straight from the payload bytes.
+
+        Returns:
+            PacketRecord or None: Parsed header fields, None if not IPv4.
+        """
+        if self.debug_decode:
+            record, ip_packet = parse_packet_scapy(payload)
+            log.log(f"Decoded packet: {ip_packet.summary()}", logging.DEBUG)
+            return record
+        return parse_packet(payload)
+
+    def lookup(self, record):
+        """Return the verdict of a packet: True to forward it, False to drop it."""
+        flag = ""
+        if record.proto == PROTO_TCP and record.flags & TCP_SYN:
+            flag = "SYN"
+
+        if self.flow_cache is None:
+            return self.rules.blocking_rules(record.src, record.dst, flag, record.src_ip, record.dst_ip)
+        flow = (record.src, record.dst, record.proto, record.sport, record.dport, flag)
+        generation = self.rules.generation
+        verdict = self.flow_cache.lookup(flow, generation)
+        if verdict is None:
+            verdict = self.rules.blocking_rules(record.src, record.dst, flag, record.src_ip, record.dst_ip)
+            self.flow_cache.store(flow, generation, verdict)
+        return verdict
+
+    def give_verdict(self, pkt, verdict):
+        """Accept or drop a packet and count the verdict."""
+        # Accept the packet - this puts it back into the iptables flow to be forwarded
+        if verdict:
+            pkt.accept()
+            self.accepted += 1
+        else:
+            pkt.drop()
+            self.dropped += 1
+
+    def verdict_counts(self):
+        """Return the number of packets accepted and dropped so far."""
+        return {'accept': self.accepted, 'drop': self.dropped}
+
+    def register_metrics(self, registry):
+        """Expose the verdict counters, buffer occupancy, active rules and ARP level.
+
+        Args:
+            registry (MetricsRegistry): Registry the metrics are added to.
+        """
+        registry.counter('router_packets_total', 'Packets given a verdict, by verdict',
+                         self.verdict_counts, label='verdict')
+        packet_buffer = self.packet_buffer
+        registry.gauge('router_buffer_packets', 'Packets held in the packet buffer ring',
+                       packet_buffer.__len__)
+        registry.gauge('router_buffer_capacity', 'Packets the packet buffer ring can hold',
+                       lambda: packet_buffer.capacity)
+        registry.gauge('router_rules_active', 'Active rules, by field',
+                       lambda: {field: count for field, count in list(self.rules.field_counts.items()) if count},
+                       label='field')
+        registry.gauge('router_arp_protection_level', 'Kernel ARP protection level in effect (1-4)',
+                       lambda: self.rules.arp_protection.level)
@@ -0,0 +1,183 @@
+"""
+IPv4 prefix matching for CIDR rules.
+
+`PrefixTrie` is a binary radix trie over 32-bit addresses: each level
+consumes one address bit, so a lookup visits at most as many nodes as the
+longest stored prefix is long, independent of the number of prefixes.
+`aggregate_prefixes` folds many offending hosts into covering prefixes.
+"""
+from collections import defaultdict
+from src.net_manager.packet_parser import int_to_ip, ip_to_int
+
+# Node layout: [child for bit 0, child for bit 1, value]
+_ZERO, _ONE, _VALUE = 0, 1, 2
+
+
+def parse_prefix(target):
+    """Parse a CIDR target such as "10.3.0.0/16".
+
+    Host bits below the prefix length are cleared.
+
+    Args:
+        target (str): Address with an optional "/length" suffix.
+
+    Returns:
+        tuple: (network as int, prefix length)
+
+    Raises:
+        ValueError: If the address or length is invalid.
+    """
+    address, _, length = target.partition('/')
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise ValueError(f"Invalid prefix length in {target}")
+    try:
+        network = ip_to_int(address)
+    except OSError:
+        raise ValueError(f"Invalid address in {target}")
+    mask = (0xffffffff << (32 - length)) & 0xffffffff
+    return network & mask, length
+
+
+def format_prefix(network, length):
+    """Return the canonical target string of a prefix ("a.b.c.d" for a /32)."""
+    if length == 32:
+        return int_to_ip(network)
+    return f"{int_to_ip(network)}/{length}"
+
+
+class PrefixTrie:
+    """Map IPv4 prefixes to values and find every prefix covering an address."""
+
+    def __init__(self):
+        self.root = [None, None, None]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, network, length, value):
+        """Store a value for a prefix, replacing any previous one.
+
+        Args:
+            network (int): Network address.
+            length (int): Prefix length, 0-32.
+            value: Value to store (not None).
+        """
+        node = self.root
+        for depth in range(length):
+            bit = (network >> (31 - depth)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        if node[_VALUE] is None:
+            self.size += 1
+        node[_VALUE] = value
+
+    def remove(self, network, length):
+        """Remove a prefix, pruning nodes left without values or children.
+
+        Args:
+            network (int): Network address.
+            length (int): Prefix length, 0-32.
+        """
+        path = []
+        node = self.root
+        for depth in range(length):
+            bit = (network >> (31 - depth)) & 1
+            child = node[bit]
+            if child is None:
+                return
+            path.append((node, bit))
+            node = child
+        if node[_VALUE] is None:
+            return
+        node[_VALUE] = None
+        self.size -= 1
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if child[_ZERO] is not None or child[_ONE] is not None or child[_VALUE] is not None:
+                break
+            parent[bit] = None
+
+    def matches(self, address):
+        """Return the values of every stored prefix covering an address.
+
+        Args:
+            address (int): IPv4 address.
+
+        Returns:
+            list: Values from the shortest to the longest matching prefix.
+        """
+        found = []
+        node = self.root
+        depth = 0
+        while node is not None:
+            if node[_VALUE] is not None:
+                found.append(node[_VALUE])
+            if depth == 32:
+                break
+            node = node[(address >> (31 - depth)) & 1]
+            depth += 1
+        return found
+
+    def copy(self):
+        """Return an independent copy of the trie (values are shared)."""
+        clone = PrefixTrie()
+        clone.size = self.size
+        stack = [(self.root, clone.root)]
+        while stack:
+            source, target = stack.pop()
+            target[_VALUE] = source[_VALUE]
+            for bit in (_ZERO, _ONE):
+                if source[bit] is not None:
+                    target[bit] = [None, None, None]
+                    stack.append((source[bit], target[bit]))
+        return clone
+
+
+def aggregate_prefixes(hosts, density=0.0625, lengths=(24, 16)):
+    """Fold offending hosts into covering prefixes where they are dense enough.
+
+    A prefix is used once the offending hosts inside it make up at least
+    `density` of its addresses; lengths are tried from the longest to the
+    shortest, so dense /24s can in turn be folded into a /16.
+
+    Args:
+        hosts (iterable of str): Offending host addresses.
+        density (float): Fraction of a prefix's addresses that must be
+            offending; 0 disables aggregation.
+        lengths (tuple of int): Candidate prefix lengths, longest first.
+
+    Returns:
+        tuple:
+            prefixes (list of str): Covering prefixes, e.g. "10.3.0.0/24".
+            covered (set of str): Hosts covered by one of the prefixes.
+    """
+    hosts = set(hosts)
+    if density <= 0 or not hosts:
+        return [], set()
+
+    # (network, length) -> offending hosts inside it
+    groups = {(ip_to_int(host), 32): {host} for host in hosts}
+    for length in lengths:
+        mask = (0xffffffff << (32 - length)) & 0xffffffff
+        by_parent = defaultdict(list)
+        for network, group_length in groups:
+            if group_length > length:
+                by_parent[network & mask].append((network, group_length))
+        for parent, children in by_parent.items():
+            members = set().union(*(groups[child] for child in children))
+            if len(members) >= density * (1 << (32 - length)):
+                for child in children:
+                    del groups[child]
+                groups[(parent, length)] = members
+
+    prefixes = []
+    covered = set()
+    for (network, length), members in sorted(groups.items()):
+        if length < 32:
+            prefixes.append(format_prefix(network, length))
+            covered |= members
+    return prefixes, covered
@@ -0,0 +1,174 @@
+"""
+Binary inter-router rule protocol.
+
+Packs many rules into one UDP datagram instead of sending one text rule
+per datagram. Every datagram starts with a fixed header:
+
+    magic     2s  b'RR'
+    version   B   PROTOCOL_VERSION
+    sender    B   router number of the sender
+    epoch     I   random nonce of the sending process, new on every start
+    sequence  I   per-process datagram counter
+    count     H   number of rule records that follow
+
+followed by `count` fixed-size rule records:
+
+    field     B   FIELD_CODES
+    flag      B   FLAG_CODES
+    target    4s  IPv4 (network) address in network order, zero for arp rules
+    length    B   prefix length of the target, 32 for a single host
+    ttl       H   seconds
+
+All integers are big-endian. Records are decoded from a memoryview of the
+received datagram without copying it.
+"""
+import logging
+import struct
+from src.net_manager.prefix_trie import format_prefix, parse_prefix
+from src.net_manager.rules import Rule
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+MAGIC = b'RR'
+PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct('!2sBBIIH')
+RECORD = struct.Struct('!BB4sBH')
+
+# Keep datagrams within a typical 1500-byte MTU
+MAX_DATAGRAM = 1400
+MAX_RULES_PER_DATAGRAM = (MAX_DATAGRAM - HEADER.size) // RECORD.size
+
+FIELD_CODES = {'arp': 0, 'src': 1, 'dst': 2}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+FLAG_CODES = {'': 0, 'SYN': 1}
+FLAG_NAMES = {code: name for name, code in FLAG_CODES.items()}
+
+
+def is_rule_datagram(data):
+    """Return True if a received datagram uses the binary rule protocol."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def encode_rules(rules, sender, sequence, epoch=0):
+    """Pack rules into one datagram.
+
+    Args:
+        rules (list of Rule): At most MAX_RULES_PER_DATAGRAM rules.
+        sender (int): Router number of the sender.
+        sequence (int): Datagram sequence number of the sending process.
+        epoch (int): Nonce of the sending process, see `SequenceTracker`.
+
+    Returns:
+        bytes: Encoded datagram.
+
+    Raises:
+        ValueError: If a rule has a field, flag or target that cannot be encoded.
+    """
+    if len(rules) > MAX_RULES_PER_DATAGRAM:
+        raise ValueError(f"{len(rules)} rules do not fit in one datagram")
+    buffer = bytearray(HEADER.size + RECORD.size * len(rules))
+    HEADER.pack_into(buffer, 0, MAGIC, PROTOCOL_VERSION, sender, epoch & 0xffffffff,
+                     sequence & 0xffffffff, len(rules))
+    offset = HEADER.size
+    for rule in rules:
+        try:
+            field = FIELD_CODES[rule.field]
+            flag = FLAG_CODES[rule.flag or '']
+            network, length = parse_prefix(rule.target) if rule.target else (0, 32)
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Cannot encode rule {rule.field}/{rule.target}/{rule.flag}: {e}")
+        # A rule that expired while queued is sent with a zero TTL
+        ttl = max(0, min(int(rule.ttl), 0xffff))
+        RECORD.pack_into(buffer, offset, field, flag, network.to_bytes(4, 'big'), length, ttl)
+        offset += RECORD.size
+    return bytes(buffer)
+
+
+def decode_rules(data):
+    """Unpack a rule datagram.
+
+    Args:
+        data (bytes): Received datagram.
+
+    Returns:
+        tuple:
+            sender (int): Router number of the sender.
+            epoch (int): Nonce of the sending process.
+            sequence (int): Datagram sequence number.
+            rules (list of Rule): Decoded rules, timestamped now.
+
+    Raises:
+        ValueError: If the datagram is malformed or of an unknown version.
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise ValueError("Datagram shorter than the header")
+    magic, version, sender, epoch, sequence, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a rule datagram")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    end = HEADER.size + RECORD.size * count
+    if len(view) < end:
+        raise ValueError(f"Truncated datagram: {count} rules announced")
+
+    rules = []
+    for field, flag, target, length, ttl in RECORD.iter_unpack(view[HEADER.size:end]):
+        field_name = FIELD_NAMES.get(field)
+        if field_name is None or length > 32:
+            log.log(f"Skipping invalid rule record (field {field}, length {length})", logging.WARNING)
+            continue
+        if field_name == 'arp':
+            target_ip = ''
+        else:
+            target_ip = format_prefix(int.from_bytes(target, 'big'), length)
+        rules.append(Rule(field_name, target_ip, FLAG_NAMES.get(flag, ''), ttl))
+    return sender, epoch, sequence, rules
+
+
+class SequenceTracker:
+    """Drop duplicate or replayed datagrams and report lost ones, per sending process.
+
+    Several processes of one router (one per queue) send rules with the
+    same router number, each numbering its datagrams from 1. They are told
+    apart by their source address and epoch, a nonce drawn when the
+    process starts: a new epoch from a source means the process restarted,
+    and the sequences of its previous epochs are forgotten.
+    """
+
+    def __init__(self):
+        # (source address, sender, epoch) -> last sequence number
+        self.last_sequence = {}
+        self.lost = 0
+        self.duplicates = 0
+
+    def accept(self, sender, sequence, epoch, source=None):
+        """Check a datagram's sequence number.
+
+        Args:
+            sender (int): Router number of the sender.
+            sequence (int): Datagram sequence number.
+            epoch (int): Nonce of the sending process.
+            source (tuple, optional): Source address of the datagram.
+
+        Returns:
+            bool: True if the datagram is new and should be processed.
+        """
+        key = (source, sender, epoch)
+        last = self.last_sequence.get(key)
+        if last is None:
+            # The sending process started or restarted
+            for stale in [other for other in self.last_sequence if other[:2] == key[:2]]:
+                del self.last_sequence[stale]
+        else:
+            if sequence <= last:
+                self.duplicates += 1
+                return False
+            if sequence > last + 1:
+                self.lost += sequence - last - 1
+                log.log(f"Lost {sequence - last - 1} rule datagram(s) from router {sender} at {source}",
+                        logging.WARNING)
+        self.last_sequence[key] = sequence
+        return True
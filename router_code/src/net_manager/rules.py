@@ -1,7 +1,14 @@
+import heapq
+import itertools
 import time
 import logging
+import threading
+from collections import Counter
 from src.tools.logger import Logger
-from src.net_manager.arp_protection import set_arp_protection_level
+from src.net_manager.arp_protection import ArpProtection
+from src.net_manager.packet_parser import ip_to_int
+from src.net_manager.prefix_trie import PrefixTrie, format_prefix, parse_prefix
+from src.tools import event_log
 import subprocess
 import re
 log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
@@ -10,77 +17,387 @@ log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
 class Rule():
     def __init__(self, field, target, flag="", ttl=30):
         self.field = field # src, dst, arp
-        self.target = target # ip address
+        self.target = target # ip address, or network/length for a prefix rule
         self.time = time.time()
         self.flag = flag
         self.ttl = ttl
 
 
+def parse_rule(rule_str):
+    """Parse a rule string such as "src/1.2.3.4/SYN/30" or "arp///20".
+
+    The target may carry a prefix length ("src/10.3.0.0/16/SYN/30"); it is
+    stored in canonical form, with a /32 written as a plain address.
+
+    Args:
+        rule_str (str): "field/target", optionally followed by "/length",
+            "/flag" and "/ttl".
+
+    Returns:
+        Rule or None: The rule, or None if the string is malformed.
+    """
+    rule_settings = rule_str.strip().split('/')
+    # A numeric third part is a prefix length, flags are names
+    if len(rule_settings) > 2 and rule_settings[2].isdigit():
+        rule_settings[1:3] = [f"{rule_settings[1]}/{rule_settings[2]}"]
+    rule_settings_len = len(rule_settings)
+
+    if not 2 <= rule_settings_len <= 4:
+        log.log(f"Rule Len Invalid: {rule_settings_len} {str(rule_settings)}", logging.WARNING)
+        return None
+
+    target = rule_settings[1]
+    if '/' in target:
+        try:
+            target = format_prefix(*parse_prefix(target))
+        except ValueError as e:
+            log.log(f"Rule Target Invalid: {e}", logging.WARNING)
+            return None
+
+    new_rule = Rule(rule_settings[0], target)
+    if rule_settings_len > 2 and rule_settings[2] != "None":
+        new_rule.flag = rule_settings[2]
+    if rule_settings_len > 3:
+        try:
+            new_rule.ttl = int(rule_settings[3])
+        except ValueError:
+            log.log(f"Rule TTL Invalid: {rule_str}", logging.WARNING)
+            return None
+    return new_rule
+
+
 class Rules():
-    def __init__(self):
-        self.all_rules = []
-        self.past_alert_level = 1
+    def __init__(self, offload=None, arp_protection=None, clock=time.time):
+        """Initialise an empty rule set.
+
+        Args:
+            offload (NftablesOffload, optional): Kernel backend mirroring the
+                active src/dst rules so matching packets are dropped before
+                reaching the queue.
+            arp_protection (ArpProtection, optional): Applies the ARP alert
+                level derived from the active arp rules to the kernel.
+            clock (callable): Timestamps the rules added from rule strings.
+        """
+        # Insertion-ordered set of active rules (dict keys)
+        self.all_rules = {}
+        # (field, target, flag) -> active Rule; a repeated detection
+        # refreshes that rule instead of adding a copy. arp rules are not
+        # deduplicated, their number is the ARP alert level
+        self.rule_keys = {}
+        # Number of active rules per field, e.g. "arp" for the alert level
+        self.field_counts = Counter()
+        # Min-heap of (expiry time, sequence, rule); entries of removed
+        # rules are skipped when they reach the top
+        self.expiry_heap = []
+        self.expiry_sequence = itertools.count()
+        # (field, target) -> {flag: [Rule, ...]}, mirrors all_rules so that
+        # blocking_rules is a couple of dict lookups instead of a full scan
+        self.rule_index = {}
+        self.offload = offload
+        self.clock = clock
+        # Bumped on every change to the active set; cached verdicts tagged
+        # with an older generation are stale
+        self.generation = 0
+        # field -> PrefixTrie of the prefix targets in rule_index, so that
+        # prefix rules are matched in at most 32 steps per address
+        self.prefix_tries = {}
+        # Copies of rule_index and prefix_tries being edited by a batch
+        # update, see begin_update
+        self.staging_index = None
+        self.staging_tries = None
+        # Held by writers for a whole begin_update/publish batch, so rules
+        # raised by the neighbour monitor and the analysis cycle never
+        # edit the staging copy at the same time
+        self.update_lock = threading.Lock()
+        self.arp_protection = arp_protection if arp_protection is not None else ArpProtection()
+
+    def begin_update(self):
+        """Start a batch of rule changes that readers will see all at once.
+
+        Until `publish` is called, add_rule/remove_rule edit a private copy
+        of the index while `blocking_rules` keeps using the current one.
+        """
+        self.staging_index = {
+            key: {flag: list(flag_rules) for flag, flag_rules in bucket.items()}
+            for key, bucket in self.rule_index.items()
+        }
+        self.staging_tries = {field: trie.copy() for field, trie in self.prefix_tries.items()}
+
+    def publish(self):
+        """Atomically replace the live index with the batch-updated copy."""
+        if self.staging_index is None:
+            return
+        # Swap the index before bumping the generation so a verdict cached
+        # under the new generation is always computed from the new index
+        self.prefix_tries, self.staging_tries = self.staging_tries, None
+        self.rule_index, self.staging_index = self.staging_index, None
+        self.generation += 1
+
+    def _writable_index(self):
+        """Return the index that rule changes should be applied to."""
+        if self.staging_index is not None:
+            return self.staging_index
+        return self.rule_index
+
+    def _writable_tries(self):
+        """Return the prefix tries that rule changes should be applied to."""
+        if self.staging_tries is not None:
+            return self.staging_tries
+        return self.prefix_tries
+
+    def _index_changed(self):
+        """Invalidate cached verdicts after an in-place index change."""
+        if self.staging_index is None:
+            self.generation += 1
+
+    def add_rule(self, rule):
+        """Append a rule to the active set and index it for lookups.
+
+        If an equal rule (same field, target and flag) is already active its
+        expiry is extended instead, when the new rule outlives it.
+
+        Args:
+            rule (Rule): Rule to activate.
+
+        Returns:
+            bool: True if the rule was added, False if it refreshed an active rule.
+        """
+        if rule.field != "arp":
+            key = (rule.field, rule.target, rule.flag)
+            active = self.rule_keys.get(key)
+            if active is not None:
+                extension = rule.time + rule.ttl - (active.time + active.ttl)
+                if extension > 0:
+                    # The expiry heap re-queues the rule when its old entry pops
+                    active.time, active.ttl = rule.time, rule.ttl
+                    # Kernel timeouts have a granularity of one second
+                    if self.offload is not None and extension >= 1:
+                        self.offload.refresh(active)
+                    event_log.emit(event_log.RULE_REFRESH, field=rule.field, target=rule.target,
+                                   flag=rule.flag, ttl=rule.ttl)
+                return False
+            self.rule_keys[key] = rule
+
+        self.all_rules[rule] = None
+        self.field_counts[rule.field] += 1
+        heapq.heappush(self.expiry_heap, (rule.time + rule.ttl, next(self.expiry_sequence), rule))
+        index = self._writable_index()
+        key = (rule.field, rule.target)
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = {}
+            if '/' in rule.target:
+                trie = self._writable_tries().setdefault(rule.field, PrefixTrie())
+                trie.insert(*parse_prefix(rule.target), key)
+        bucket.setdefault(rule.flag, []).append(rule)
+        self._index_changed()
+        if self.offload is not None:
+            self.offload.add(rule)
+        event_log.emit(event_log.RULE_ADD, field=rule.field, target=rule.target, flag=rule.flag, ttl=rule.ttl)
+        return True
+
+    def remove_rule(self, rule):
+        """Remove a rule from the active set and from the lookup index.
+
+        Args:
+            rule (Rule): Rule to deactivate.
+        """
+        del self.all_rules[rule]
+        self.field_counts[rule.field] -= 1
+        event_log.emit(event_log.RULE_REMOVE, field=rule.field, target=rule.target, flag=rule.flag)
+        key = (rule.field, rule.target, rule.flag)
+        if self.rule_keys.get(key) is rule:
+            del self.rule_keys[key]
+        if self.offload is not None:
+            self.offload.remove(rule)
+        index = self._writable_index()
+        key = (rule.field, rule.target)
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        flag_rules = bucket.get(rule.flag)
+        if flag_rules is not None:
+            flag_rules.remove(rule)
+            if not flag_rules:
+                del bucket[rule.flag]
+        if not bucket:
+            del index[key]
+            if '/' in rule.target:
+                trie = self._writable_tries().get(rule.field)
+                if trie is not None:
+                    trie.remove(*parse_prefix(rule.target))
+        self._index_changed()
+
+    def replace_rules(self, rules):
+        """Replace the whole active set, publishing the new index atomically.
+
+        Used by replicas of a rule table kept by another process.
+
+        Args:
+            rules (list of Rule): New active rules.
+        """
+        index = {}
+        tries = {}
+        for rule in rules:
+            key = (rule.field, rule.target)
+            if key not in index and '/' in rule.target:
+                tries.setdefault(rule.field, PrefixTrie()).insert(*parse_prefix(rule.target), key)
+            bucket = index.setdefault(key, {})
+            bucket.setdefault(rule.flag, []).append(rule)
+        self.all_rules = dict.fromkeys(rules)
+        self.rule_keys = {(rule.field, rule.target, rule.flag): rule
+                          for rule in rules if rule.field != "arp"}
+        self.field_counts = Counter(rule.field for rule in rules)
+        self.expiry_heap = [(rule.time + rule.ttl, next(self.expiry_sequence), rule) for rule in rules]
+        heapq.heapify(self.expiry_heap)
+        self.staging_index = index
+        self.staging_tries = tries
+        self.publish()
 
     def add_rules(self, new_rules):
-        # for rule in self.all_rules:
-        #    log.log(f"===== Removed Rule - {rule.field} {rule.target}", logging.DEBUG)
-        #    if time_current - rule.time > rule.ttl:
-        #        self.all_rules.remove(rule)
+        """Activate a batch of rules and commit them to the kernel offload.
 
+        Args:
+            new_rules (list): Rule objects, as decoded from the binary
+                inter-router protocol, or rule strings
+                ("field/target/flag/ttl", see `parse_rule`).
+        """
         for rule in new_rules:
-            rule_settings = rule.replace('b', '').replace("'", '')
-            rule_settings = rule_settings.split('/')
-            rule_settings_len = len(rule_settings)
-
-            if 2 <= rule_settings_len <= 4:
-                new_rule = Rule(rule_settings[0], rule_settings[1])
-
-                if rule_settings_len > 2:
-                    if rule_settings[2] == "None":
-                        new_rule.flag == None
-                    else:    
-                        new_rule.flag = rule_settings[2]
-                    if rule_settings_len > 3:
-                        new_rule.ttl = int(rule_settings[3])
-                self.all_rules.append(new_rule)
+            if isinstance(rule, Rule):
+                new_rule = rule
+            else:
+                new_rule = parse_rule(rule)
+                if new_rule is None:
+                    continue
+                new_rule.time = self.clock()
+            if self.add_rule(new_rule):
                 log.log(f"===== Added Rule - {new_rule.field} {new_rule.target}", logging.DEBUG)
-
             else:
-                log.log(f"Rule Len Invalid: {rule_settings_len} {str(rule_settings)}", logging.WARNING)
+                log.log(f"===== Refreshed Rule - {new_rule.field} {new_rule.target}", logging.DEBUG)
+
+        if self.offload is not None:
+            self.offload.commit()
+
+    def next_expiry(self):
+        """Return the time at which the next active rule expires, or None."""
+        heap = self.expiry_heap
+        while heap and heap[0][2] not in self.all_rules:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
 
     def clear_rules(self, time_current):
-        for rule in self.all_rules:
+        """Remove the rules whose TTL has passed and update the ARP alert level.
 
-            if time_current - rule.time > rule.ttl:
-                log.log(f"===== Removed Rule - {rule.field} {rule.target}", logging.DEBUG)
-                self.all_rules.remove(rule)
+        Only the expired rules are visited, in expiry order.
 
-        arp_alert_level = 1
-        for rule in self.all_rules:
-            if rule.field == "arp":
-                arp_alert_level += 1
+        Args:
+            time_current (float): Current time.
 
+        Returns:
+            list of Rule: The rules removed.
+        """
+        expired = []
+        heap = self.expiry_heap
+        while heap and heap[0][0] < time_current:
+            _, _, rule = heapq.heappop(heap)
+            if rule not in self.all_rules:
+                continue
+            # The rule was refreshed after this entry was queued
+            if time_current - rule.time <= rule.ttl:
+                heapq.heappush(heap, (rule.time + rule.ttl, next(self.expiry_sequence), rule))
+                continue
+            log.log(f"===== Removed Rule - {rule.field} {rule.target}", logging.DEBUG)
+            self.remove_rule(rule)
+            expired.append(rule)
 
-        if self.past_alert_level == arp_alert_level or (self.past_alert_level > 3 and arp_alert_level > 3):
-            pass
-        else:
-            if 1 <= arp_alert_level <= 3:
-                if 1 < arp_alert_level:
-                    set_arp_protection_level(arp_alert_level)
-                    log.log(f"===== Arp Protection Level set to - {arp_alert_level}", logging.WARNING)
-            else:
-                log.log(f"===== Arp Protection Level set to - {4}", logging.WARNING)
-                set_arp_protection_level(4)
+        if self.offload is not None:
+            self.offload.commit()
+
+        arp_alert_level = 1 + self.field_counts["arp"]
+        self.arp_protection.update(arp_alert_level, time_current)
+        return expired
+
+    def blocking_rules(self, src, dst, flag="", src_ip=None, dst_ip=None):
+        """Check a packet against the active rules.
 
-        self.past_alert_level = arp_alert_level
+        Args:
+            src (str): Source IP address of the packet.
+            dst (str): Destination IP address of the packet.
+            flag (str): TCP flag name of the packet ("SYN" or "").
+            src_ip (int, optional): Source address as an integer, as parsed
+                in the PacketRecord; derived from `src` when omitted.
+            dst_ip (int, optional): Destination address as an integer.
 
-    def blocking_rules(self, src, dst, flag=""):
-        for rule in self.all_rules:
-            if rule.field == "src" and src == rule.target:
-                if rule.flag == "" or flag == rule.flag:
-                    return False
-            elif rule.field == "dst" and dst == rule.target:
-                if rule.flag == "" or flag == rule.flag:
-                    return False
+        Returns:
+            bool: True if the packet may be forwarded, False if a rule blocks it.
+        """
+        index = self.rule_index
+        for key in (("src", src), ("dst", dst)):
+            bucket = index.get(key)
+            # A rule without a flag blocks every packet of its target
+            if bucket is not None and ("" in bucket or flag in bucket):
+                return False
+
+        tries = self.prefix_tries
+        if tries:
+            for field, address, value in (("src", src, src_ip), ("dst", dst, dst_ip)):
+                trie = tries.get(field)
+                if not trie:
+                    continue
+                for key in trie.matches(ip_to_int(address) if value is None else value):
+                    bucket = index.get(key)
+                    if bucket is not None and ("" in bucket or flag in bucket):
+                        return False
 
         return True
+
+
+class RuleSendFilter:
+    """Suppress generated rules that were sent recently and are still far from expiry.
+
+    While an attack continues the detector generates the same rules every
+    cycle; only rules that are new, or whose last sent copy is about to
+    expire, need to be propagated again. arp rules are always sent since
+    their number sets the ARP alert level.
+    """
+
+    def __init__(self, refresh_margin=10.0):
+        """Initialise an empty filter.
+
+        Args:
+            refresh_margin (float): A rule is sent again once its last sent
+                copy has less than this many seconds left.
+        """
+        self.refresh_margin = refresh_margin
+        # (field, target, flag) -> expiry time of the copy last sent
+        self.sent = {}
+
+    def filter(self, rule_strs, time_current=None):
+        """Return the rules that need sending and remember them as sent.
+
+        Args:
+            rule_strs (list of str): Rules generated this cycle.
+            time_current (float, optional): Current time.
+
+        Returns:
+            list of str: Rules to send, without duplicates.
+        """
+        if time_current is None:
+            time_current = time.time()
+        self.sent = {key: expiry for key, expiry in self.sent.items() if expiry > time_current}
+
+        to_send = []
+        for rule_str in rule_strs:
+            rule = parse_rule(rule_str)
+            if rule is None:
+                continue
+            if rule.field == "arp":
+                to_send.append(rule_str)
+                continue
+            key = (rule.field, rule.target, rule.flag)
+            expiry = self.sent.get(key)
+            if expiry is not None and expiry - time_current >= self.refresh_margin:
+                continue
+            self.sent[key] = time_current + rule.ttl
+            to_send.append(rule_str)
+        return to_send
@@ -0,0 +1,182 @@
+"""
+Bounded-memory heavy-hitter detection for SYN flood and SSH brute force.
+
+A Count-Min Sketch bounds the over-estimation of any key's count and a
+Space-Saving summary keeps the top-K candidate keys, so memory stays fixed
+no matter how many distinct (possibly spoofed) sources are seen. The
+reported count of a heavy hitter is the smaller of the two estimates.
+"""
+import heapq
+import math
+import random
+import threading
+from array import array
+from collections import Counter, defaultdict
+from src.net_manager.packet_parser import int_to_ip, PROTO_TCP, TCP_SYN
+
+# Mersenne prime used by the pairwise-independent row hashes
+_PRIME = (1 << 61) - 1
+
+
+class CountMinSketch:
+    """Count-Min Sketch over integer keys.
+
+    Estimates never under-count; with probability at least 1 - delta the
+    over-count is at most epsilon times the total number of updates.
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01, seed=0):
+        """Initialise an empty sketch.
+
+        Args:
+            epsilon (float): Relative error bound (width = ceil(e / epsilon)).
+            delta (float): Failure probability (depth = ceil(ln(1 / delta))).
+            seed (int): Seed of the row hash functions.
+        """
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        rng = random.Random(seed)
+        self.hashes = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(self.depth)]
+        self.rows = [array('q', bytes(8 * self.width)) for _ in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count `count` occurrences of an integer key."""
+        width = self.width
+        for row, (a, b) in zip(self.rows, self.hashes):
+            row[(a * key + b) % _PRIME % width] += count
+
+    def estimate(self, key):
+        """Return the (over-)estimated count of an integer key."""
+        width = self.width
+        return min(row[(a * key + b) % _PRIME % width] for row, (a, b) in zip(self.rows, self.hashes))
+
+
+class SpaceSaving:
+    """Space-Saving top-K summary.
+
+    Tracks at most `k` keys. Every key occurring more than N/k times is
+    guaranteed to be tracked, and a tracked count over-estimates the true
+    count by at most its recorded error.
+    """
+
+    def __init__(self, k=64):
+        """Initialise an empty summary.
+
+        Args:
+            k (int): Number of counters (tracked keys).
+        """
+        self.k = k
+        # key -> [count, error]
+        self.counters = {}
+        # One (count, key) entry per tracked key; the count may lag behind
+        # the counter, which is fixed up lazily when the entry is popped
+        self.heap = []
+
+    def add(self, key):
+        """Count one occurrence of a key."""
+        counters = self.counters
+        counter = counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+            return
+        if len(counters) < self.k:
+            counters[key] = [1, 0]
+            heapq.heappush(self.heap, (1, key))
+            return
+
+        # Replace the key with the smallest count
+        heap = self.heap
+        while True:
+            count, victim = heapq.heappop(heap)
+            current = counters[victim][0]
+            if current == count:
+                break
+            heapq.heappush(heap, (current, victim))
+        del counters[victim]
+        counters[key] = [count + 1, count]
+        heapq.heappush(heap, (count + 1, key))
+
+    def items(self):
+        """Return the tracked keys with their (count, error) pairs."""
+        return [(key, counter[0], counter[1]) for key, counter in self.counters.items()]
+
+
+class SketchPatternCounter:
+    """Fixed-memory pattern counts for `PacketBuffer`, over tumbling windows.
+
+    Counts accumulate from one `pattern_counts` call to the next (one
+    analysis period). Only the top-K SSH (src, dst) pairs and SYN
+    destinations are reported, with approximate counts. `add` runs on the
+    packet callback thread and `pattern_counts` on the analysis thread, so
+    both hold `lock` while they touch the window.
+    """
+
+    # pattern_counts consumes the counts it reports
+    drains = True
+
+    def __init__(self, epsilon=0.001, delta=0.01, top_k=64):
+        """Initialise the counter.
+
+        Args:
+            epsilon (float): Count-Min relative error bound.
+            delta (float): Count-Min failure probability.
+            top_k (int): Keys tracked per pattern by Space-Saving.
+        """
+        self.epsilon = epsilon
+        self.delta = delta
+        self.top_k = top_k
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Start a new window with empty structures."""
+        self.total = 0
+        self.ssh_sketch = CountMinSketch(self.epsilon, self.delta, seed=1)
+        self.ssh_top = SpaceSaving(self.top_k)
+        self.syn_sketch = CountMinSketch(self.epsilon, self.delta, seed=2)
+        self.syn_top = SpaceSaving(self.top_k)
+
+    def add(self, packet, now=None):
+        """Count one packet.
+
+        Args:
+            packet (PacketRecord): Parsed packet header.
+            now (float, optional): Arrival time (unused, tumbling windows).
+        """
+        with self.lock:
+            self.total += 1
+            if packet.proto == PROTO_TCP and packet.flags & TCP_SYN:
+                if packet.dport == 22:
+                    key = (packet.src_ip << 32) | packet.dst_ip
+                    self.ssh_sketch.add(key)
+                    self.ssh_top.add(key)
+                else:
+                    self.syn_sketch.add(packet.dst_ip)
+                    self.syn_top.add(packet.dst_ip)
+
+    def pattern_counts(self, now=None):
+        """Return the heavy hitters of the window and start a new one.
+
+        Returns:
+            dict: Pattern counts in the format of `PacketBuffer.count_patterns`.
+        """
+        # Swap in the new window under the lock; the old one is read without it
+        with self.lock:
+            total, ssh_sketch, ssh_top = self.total, self.ssh_sketch, self.ssh_top
+            syn_sketch, syn_top = self.syn_sketch, self.syn_top
+            self._reset()
+
+        ssh_attempts_by_source = defaultdict(Counter)
+        for key, count, _ in ssh_top.items():
+            estimate = min(count, ssh_sketch.estimate(key))
+            ssh_attempts_by_source[int_to_ip(key >> 32)][int_to_ip(key & 0xffffffff)] = estimate
+
+        syn_counts_by_destination = defaultdict(int)
+        for dst, count, _ in syn_top.items():
+            syn_counts_by_destination[int_to_ip(dst)] = min(count, syn_sketch.estimate(dst))
+
+        return {
+            'total_packets': total,
+            'ssh_attempts_by_source': ssh_attempts_by_source,
+            'syn_counts_by_destination': syn_counts_by_destination,
+        }
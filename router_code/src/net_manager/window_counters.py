@@ -0,0 +1,156 @@
+"""
+Streaming sliding-window counters for packet pattern detection.
+
+Counts are kept per time bucket and summed into running totals as packets
+arrive; whole buckets are subtracted again once they leave the window.
+Reading the counts of the current window therefore costs O(distinct keys)
+instead of a rescan of every buffered packet.
+"""
+import math
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from src.net_manager.packet_parser import int_to_ip, PROTO_TCP, TCP_SYN
+
+
+class SlidingWindowCounter:
+    """Per-key event counts over the last `window` seconds, in `bucket`-second steps."""
+
+    def __init__(self, window=5.0, bucket=1.0):
+        """Initialise an empty counter.
+
+        Args:
+            window (float): Length of the sliding window in seconds.
+            bucket (float): Expiry granularity in seconds; the window covers
+                the current bucket and the ones before it.
+        """
+        self.bucket = bucket
+        self.num_buckets = max(1, int(math.ceil(window / bucket)))
+        # [bucket_id, events, {key: count}] per live bucket, oldest first
+        self.buckets = deque()
+        self.total = 0
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def add(self, key=None, now=None):
+        """Count one event.
+
+        Args:
+            key (hashable, optional): Key to count the event for; None only
+                counts it in the window total.
+            now (float, optional): Event time, defaults to the current time.
+        """
+        if now is None:
+            now = time.time()
+        bucket_id = int(now // self.bucket)
+        with self.lock:
+            buckets = self.buckets
+            # Late events (clock steps backwards) go into the newest bucket
+            if not buckets or buckets[-1][0] < bucket_id:
+                self._expire(bucket_id)
+                buckets.append([bucket_id, 0, {}])
+            current = buckets[-1]
+            current[1] += 1
+            self.total += 1
+            if key is not None:
+                counts = current[2]
+                counts[key] = counts.get(key, 0) + 1
+                self.totals[key] = self.totals.get(key, 0) + 1
+
+    def _expire(self, bucket_id):
+        """Drop the buckets that fall out of a window ending at `bucket_id`."""
+        oldest = bucket_id - self.num_buckets + 1
+        buckets = self.buckets
+        totals = self.totals
+        while buckets and buckets[0][0] < oldest:
+            _, events, counts = buckets.popleft()
+            self.total -= events
+            for key, count in counts.items():
+                remaining = totals[key] - count
+                if remaining:
+                    totals[key] = remaining
+                else:
+                    del totals[key]
+
+    def snapshot(self, now=None):
+        """Return the counts of the current window.
+
+        Args:
+            now (float, optional): End of the window, defaults to the current time.
+
+        Returns:
+            tuple:
+                total (int): Events counted in the window.
+                counts (dict): Events per key in the window.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._expire(int(now // self.bucket))
+            return self.total, dict(self.totals)
+
+
+class WindowPatternCounter:
+    """Sliding-window pattern counts for `PacketBuffer`.
+
+    Counts every packet, SSH SYNs per (src, dst) pair and other SYNs per
+    destination over the last `window` seconds.
+    """
+
+    # pattern_counts reports the whole window and does not consume it
+    drains = False
+
+    def __init__(self, window=5.0, bucket=1.0):
+        """Initialise the counters.
+
+        Args:
+            window (float): Length of the sliding window in seconds.
+            bucket (float): Granularity in seconds at which counts expire.
+        """
+        self.packet_window = SlidingWindowCounter(window, bucket)
+        self.ssh_window = SlidingWindowCounter(window, bucket)
+        self.syn_window = SlidingWindowCounter(window, bucket)
+
+    def add(self, packet, now=None):
+        """Count one packet.
+
+        Args:
+            packet (PacketRecord): Parsed packet header.
+            now (float, optional): Arrival time, defaults to the current time.
+        """
+        if now is None:
+            now = time.time()
+        self.packet_window.add(None, now)
+        if packet.proto == PROTO_TCP and packet.flags & TCP_SYN:
+            if packet.dport == 22:
+                self.ssh_window.add((packet.src_ip, packet.dst_ip), now)
+            else:
+                self.syn_window.add(packet.dst_ip, now)
+
+    def pattern_counts(self, now=None):
+        """Return the pattern counts of the current window.
+
+        Args:
+            now (float, optional): End of the window, defaults to the current time.
+
+        Returns:
+            dict: Pattern counts in the format of `PacketBuffer.count_patterns`.
+        """
+        if now is None:
+            now = time.time()
+        total_packets, _ = self.packet_window.snapshot(now)
+        _, ssh_pairs = self.ssh_window.snapshot(now)
+        _, syn_destinations = self.syn_window.snapshot(now)
+
+        ssh_attempts_by_source = defaultdict(Counter)
+        for (src, dst), count in ssh_pairs.items():
+            ssh_attempts_by_source[int_to_ip(src)][int_to_ip(dst)] = count
+        syn_counts_by_destination = defaultdict(int)
+        for dst, count in syn_destinations.items():
+            syn_counts_by_destination[int_to_ip(dst)] = count
+
+        return {
+            'total_packets': total_packets,
+            'ssh_attempts_by_source': ssh_attempts_by_source,
+            'syn_counts_by_destination': syn_counts_by_destination,
+        }
@@ -0,0 +1,226 @@
+"""
+Structured event stream for detections, rule changes and ARP level changes.
+
+Events are JSON objects, one per line, with at least a timestamp `ts` and
+a `kind`. `emit` only puts the event on a bounded in-memory queue; a
+background thread writes them in batches through a buffered file and
+rotates it by size. When the queue is full events are dropped and
+counted, and the count is written as an `events_dropped` event once the
+writer catches up. A process forked from one with an event log does not
+inherit it: only the parent records events.
+
+Query a log after an incident with:
+    python -m src.tools.event_log events.jsonl --kind rule_add --since 1700000000
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+# Event kinds written by the filter
+ANALYSIS = 'analysis'
+RULE_ADD = 'rule_add'
+RULE_REFRESH = 'rule_refresh'
+RULE_REMOVE = 'rule_remove'
+ARP_LEVEL = 'arp_level'
+EVENTS_DROPPED = 'events_dropped'
+
+
+class EventLog:
+    """Bounded, batched, size-rotated JSONL event writer."""
+
+    def __init__(self, path='events.jsonl', max_bytes=16 << 20, backups=5, queue_size=65536,
+                 batch_size=1024, flush_interval=1.0):
+        """Open the log and start the writer thread.
+
+        Args:
+            path (str): File events are appended to; rotated copies are
+                `path.1` (newest) to `path.<backups>` (oldest).
+            max_bytes (int): Size at which the file is rotated.
+            backups (int): Rotated files kept.
+            queue_size (int): Events held in memory before new ones are dropped.
+            batch_size (int): Maximum events written per batch.
+            flush_interval (float): Seconds after which a partial batch is written.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self.file = open(path, 'ab', buffering=1 << 16)
+        self.size = self.file.tell()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self.thread.start()
+
+    def emit(self, kind, **fields):
+        """Queue an event without blocking.
+
+        Args:
+            kind (str): Event kind.
+            **fields: JSON-serialisable event fields.
+
+        Returns:
+            bool: False if the event was dropped because the queue is full.
+        """
+        fields['ts'] = time.time()
+        fields['kind'] = kind
+        try:
+            self.queue.put_nowait(fields)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """Write the queued events and close the file."""
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+        self.file.close()
+
+    def _run(self):
+        """Writer thread: write queued events in batches."""
+        reported_drops = 0
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self.dropped != reported_drops:
+                batch.append({'ts': time.time(), 'kind': EVENTS_DROPPED,
+                              'dropped': self.dropped - reported_drops, 'total': self.dropped})
+                reported_drops = self.dropped
+            self._write(batch)
+
+    def _write(self, batch):
+        """Write one batch of events and rotate the file if it is full."""
+        data = ''.join(json.dumps(event, separators=(',', ':'), default=str) + '\n'
+                       for event in batch).encode('utf-8')
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        self.written += len(batch)
+        if self.size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """Shift path.N -> path.N+1 and start a new file."""
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'ab', buffering=1 << 16)
+        self.size = 0
+
+
+# Process-wide event log, None until configured
+_event_log = None
+
+
+def configure_event_log(path, **options):
+    """Start the process-wide event log.
+
+    Args:
+        path (str): Log file, or an empty string to disable event logging.
+        **options: Keyword arguments of EventLog.
+
+    Returns:
+        EventLog or None: The event log.
+    """
+    global _event_log
+    if _event_log is not None:
+        _event_log.close()
+        _event_log = None
+    if path:
+        _event_log = EventLog(path, **options)
+    return _event_log
+
+
+def _forget_event_log_after_fork():
+    """Leave the parent's event log alone in a forked child.
+
+    Its writer thread does not survive the fork and its queue lock may
+    have been held at that moment; the child would also race the parent
+    on writes and rotation of the same file.
+    """
+    global _event_log
+    _event_log = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_event_log_after_fork)
+
+
+def emit(kind, **fields):
+    """Record an event in the process-wide event log, if one is configured."""
+    if _event_log is not None:
+        _event_log.emit(kind, **fields)
+
+
+def read_events(path, kinds=None, since=None, until=None):
+    """Iterate over the events of a log and its rotated copies, oldest first.
+
+    Args:
+        path (str): Log file given to EventLog.
+        kinds (iterable of str, optional): Only yield these kinds.
+        since (float, optional): Only yield events at or after this time.
+        until (float, optional): Only yield events before this time.
+
+    Yields:
+        dict: Events.
+    """
+    kinds = set(kinds) if kinds else None
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    for file_path in list(reversed(rotated)) + [path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                # Cheap prefilter before parsing the whole line
+                if kinds is not None and not any(f'"kind":"{kind}"' in line for kind in kinds):
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if kinds is not None and event.get('kind') not in kinds:
+                    continue
+                if since is not None and event.get('ts', 0) < since:
+                    continue
+                if until is not None and event.get('ts', 0) >= until:
+                    continue
+                yield event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query an event log")
+    parser.add_argument("path", help="Event log file")
+    parser.add_argument("--kind", action="append", help="Event kind to show (repeatable)")
+    parser.add_argument("--since", type=float, help="Unix time of the first event")
+    parser.add_argument("--until", type=float, help="Unix time after the last event")
+    args = parser.parse_args()
+    for event in read_events(args.path, args.kind, args.since, args.until):
+        print(json.dumps(event))
+
+
+if __name__ == '__main__':
+    main()
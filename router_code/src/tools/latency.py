@@ -0,0 +1,112 @@
+"""
+Low-overhead latency histogram.
+
+Values (nanoseconds) are counted in log-linear buckets: four buckets per
+power of two, so any reported percentile is within 25% of the true value.
+Recording a sample is one bit_length call and one list increment under
+an uncontended lock, cheap enough to run on every packet.
+"""
+import threading
+
+NUM_BUCKETS = 256
+
+
+def bucket_index(value):
+    """Return the bucket a non-negative integer value falls into."""
+    if value < 4:
+        return value
+    shift = value.bit_length() - 3
+    return (shift << 2) + (value >> shift)
+
+
+def bucket_upper_bound(index):
+    """Return the largest value counted in a bucket."""
+    if index < 4:
+        return index
+    shift = (index >> 2) - 1
+    top = (index & 3) + 4
+    return ((top + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in nanoseconds.
+
+    `record`, `merge` and `reset` are serialised, so a window taken by
+    `reset` on another thread never loses samples or holds counts, total
+    and maximum that disagree.
+    """
+
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.total = 0
+        self.max_value = 0
+        self.lock = threading.Lock()
+
+    def record(self, value_ns):
+        """Count one latency sample.
+
+        Args:
+            value_ns (int): Latency in nanoseconds.
+        """
+        index = bucket_index(value_ns)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+            if value_ns > self.max_value:
+                self.max_value = value_ns
+
+    def percentile(self, percent):
+        """Return an upper bound of the given latency percentile.
+
+        Args:
+            percent (float): Percentile between 0 and 100.
+
+        Returns:
+            int: Latency in nanoseconds (0 if no samples were recorded).
+        """
+        if not self.total:
+            return 0
+        threshold = self.total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= threshold:
+                return min(bucket_upper_bound(index), self.max_value)
+        return self.max_value
+
+    def merge(self, other):
+        """Add the samples of another histogram to this one."""
+        with self.lock:
+            for index, count in enumerate(other.counts):
+                self.counts[index] += count
+            self.total += other.total
+            self.max_value = max(self.max_value, other.max_value)
+
+    def reset(self):
+        """Return a copy of the current samples and start a fresh window.
+
+        Returns:
+            LatencyHistogram: Samples recorded since the last reset.
+        """
+        window = LatencyHistogram()
+        fresh = [0] * NUM_BUCKETS
+        with self.lock:
+            window.counts, self.counts = self.counts, fresh
+            window.total, self.total = self.total, 0
+            window.max_value, self.max_value = self.max_value, 0
+        return window
+
+    def summary(self):
+        """Return the usual percentiles in microseconds.
+
+        Returns:
+            dict: Sample count plus p50, p90, p99, p99.9 and max latency.
+        """
+        return {
+            'count': self.total,
+            'p50_us': self.percentile(50) / 1000,
+            'p90_us': self.percentile(90) / 1000,
+            'p99_us': self.percentile(99) / 1000,
+            'p999_us': self.percentile(99.9) / 1000,
+            'max_us': self.max_value / 1000,
+        }
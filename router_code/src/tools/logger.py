@@ -2,18 +2,25 @@
 A custom logging module that provides colored console output and file logging capabilities.
 This module includes a ColorFormatter for console output and a main logger class that
 handles both console and file logging with appropriate formatting.
+
+Records are handed to a background QueueListener thread that does the
+formatting and I/O, so logging from the packet path only costs a level
+check, a cached call-site lookup and a queue put.
 """
 
+import atexit
 import logging
-import inspect
+import logging.handlers
 import os
+import queue
+import sys
 
 
 class ColorFormatter(logging.Formatter):
     """
     A custom formatter that adds color to log messages based on their level.
     """
-    
+
     COLORS = {
         logging.DEBUG: "\033[94m",    # Blue
         logging.INFO: "\033[92m",     # Green
@@ -30,75 +37,120 @@ class ColorFormatter(logging.Formatter):
         return f"{log_color}{message}{self.RESET}"
 
 
+# Context string per code object: path/to/file.py:Class.method
+_context_cache = {}
+
+# Background writer shared by every Logger instance of the process
+_queue_handler = None
+_listener = None
+
+_LEVELS = (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL)
+
+
+def _start_listener(handlers):
+    """Route records through a queue to a listener thread owning `handlers`."""
+    global _queue_handler, _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_listener_after_fork():
+    """Give a forked child its own listener; the parent's thread does not survive fork."""
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def flush_logs():
+    """Stop the listener thread after it has written every queued record."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(flush_logs)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def _frame_context(frame):
+    """Return the context string of a frame, cached per code object."""
+    code = frame.f_code
+    context = _context_cache.get(code)
+    if context is None:
+        try:
+            rel_path = os.path.relpath(code.co_filename)
+        except ValueError:
+            rel_path = code.co_filename
+        # co_qualname (Python 3.11+) already includes the class name; before
+        # that, take it from the method's `self` on the first call
+        name = getattr(code, 'co_qualname', None)
+        if name is None:
+            name = code.co_name
+            owner = frame.f_locals.get('self')
+            if owner is not None:
+                name = f"{owner.__class__.__name__}.{name}"
+        context = f"{rel_path}:{name}"
+        _context_cache[code] = context
+    return context
+
+
 class Logger:
     """
     A custom logger class that provides both console and file logging capabilities.
     Includes file path, class name, and method name in log messages.
     """
-    
-    def __init__(self, log_file='app.log', log_level=logging.INFO):
-        """Initialize the logger with specified file and level settings."""
+
+    def __init__(self, log_file='app.log', log_level=logging.INFO, console=True):
+        """Initialize the logger with specified file and level settings.
+
+        Args:
+            log_file (str): File the records are appended to.
+            log_level (int): Minimum level of the shared logger.
+            console (bool): Also write records to stderr.
+        """
         self.logger = logging.getLogger('BasicLogger')
         self.logger.setLevel(log_level)
 
         if not self.logger.hasHandlers():
             # Format: timestamp [path/to/file.py:Class.method] [LEVEL] message
             log_format = '%(asctime)s [%(context)s] [%(levelname)s] %(message)s'
-            
+
             file_formatter = logging.Formatter(log_format)
             console_formatter = ColorFormatter(log_format)
 
-            console_handler = logging.StreamHandler()
-            console_handler.setFormatter(console_formatter)
+            handlers = []
+            if console:
+                console_handler = logging.StreamHandler()
+                console_handler.setFormatter(console_formatter)
+                handlers.append(console_handler)
 
             file_handler = logging.FileHandler(log_file)
             file_handler.setFormatter(file_formatter)
+            handlers.append(file_handler)
 
-            self.logger.addHandler(console_handler)
-            self.logger.addHandler(file_handler)
-
-    def _get_context(self):
-        """
-        Get the context of where the log was called from.
-        Returns formatted string: path/to/file.py:Class.method or path/to/file.py:method
-        """
-        # Get the caller's frame (2 frames up to skip the logging function)
-        frame = inspect.currentframe().f_back.f_back
-        
-        # Get file path and convert to relative path
-        file_path = inspect.getframeinfo(frame).filename
-        rel_path = os.path.relpath(file_path)
-        
-        # Get function name
-        func_name = frame.f_code.co_name
-        
-        # Try to get class name if method is part of a class
-        try:
-            class_name = frame.f_locals['self'].__class__.__name__
-            return f"{rel_path}:{class_name}.{func_name}"
-        except (KeyError, AttributeError):
-            # If not in a class method, just return the function name
-            return f"{rel_path}:{func_name}"
+            _start_listener(handlers)
+            self.logger.addHandler(_queue_handler)
 
     def log(self, message, level=logging.INFO):
         """
         Log a message with the specified level.
-        
+
         Args:
             message (str): The message to log
             level: The logging level to use (default: logging.INFO)
         """
-        extra = {'context': self._get_context()}
-        
-        if level == logging.DEBUG:
-            self.logger.debug(message, extra=extra)
-        elif level == logging.INFO:
-            self.logger.info(message, extra=extra)
-        elif level == logging.WARNING:
-            self.logger.warning(message, extra=extra)
-        elif level == logging.ERROR:
-            self.logger.error(message, extra=extra)
-        elif level == logging.CRITICAL:
-            self.logger.critical(message, extra=extra)
-        else:
-            self.logger.info(message, extra=extra)
\ No newline at end of file
+        if level not in _LEVELS:
+            level = logging.INFO
+        if not self.logger.isEnabledFor(level):
+            return
+
+        extra = {'context': _frame_context(sys._getframe(1))}
+        self.logger.log(level, message, extra=extra)
@@ -0,0 +1,214 @@
+"""
+Prometheus-style metrics for the filter pipeline.
+
+Metrics are collected when they are scraped rather than pushed when they
+change: each metric reads its value(s) from a callable, usually plain
+integer attributes of the pipeline, buffer or rule set, so the per-packet
+cost is an integer increment the pipeline already does. Latency
+distributions are exported from LatencyHistogram objects as cumulative
+Prometheus histograms.
+
+The registry is served in the text exposition format on a local HTTP
+port:
+    curl http://127.0.0.1:9101/metrics
+"""
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.tools.latency import NUM_BUCKETS, LatencyHistogram, bucket_upper_bound
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+# Upper bounds (nanoseconds) of the exported histogram buckets
+HISTOGRAM_BOUNDS_NS = (
+    1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+    1000000, 2500000, 5000000, 10000000, 25000000, 100000000, 1000000000,
+)
+
+# First exported bucket each LatencyHistogram bucket falls into (len() for +Inf)
+_EXPORT_BUCKET = []
+for _index in range(NUM_BUCKETS):
+    _upper = bucket_upper_bound(_index)
+    _EXPORT_BUCKET.append(next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_NS) if _upper <= bound),
+                               len(HISTOGRAM_BOUNDS_NS)))
+
+
+def _format_labels(labels):
+    """Return the `{name="value",...}` part of a sample line."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Metric:
+    """Counter or gauge whose value is read from a callable at scrape time."""
+
+    def __init__(self, name, help_text, kind, read, label=None):
+        """Initialise the metric.
+
+        Args:
+            name (str): Metric name.
+            help_text (str): Description shown in the exposition.
+            kind (str): 'counter' or 'gauge'.
+            read (callable): Returns a number, or a dict of label value ->
+                number when `label` is set.
+            label (str, optional): Label name of a labelled metric.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.read = read
+        self.label = label
+
+    def render(self):
+        """Return the exposition lines of the metric."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        value = self.read()
+        if self.label is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            for label_value, sample in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels([(self.label, label_value)])} {sample}")
+        return lines
+
+
+class Histogram:
+    """Cumulative latency histogram exported in seconds."""
+
+    def __init__(self, name, help_text, histogram=None):
+        """Initialise the histogram.
+
+        Args:
+            name (str): Metric name.
+            help_text (str): Description shown in the exposition.
+            histogram (LatencyHistogram, optional): Samples in nanoseconds,
+                never reset; a new one is created if not given.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.histogram = histogram if histogram is not None else LatencyHistogram()
+        self.sum_ns = 0
+
+    def observe(self, value_ns):
+        """Count one sample in nanoseconds."""
+        self.histogram.record(value_ns)
+        self.sum_ns += value_ns
+
+    def merge(self, window):
+        """Add a window of samples, e.g. one returned by `LatencyHistogram.reset`.
+
+        The sum of a merged window is estimated from its bucket bounds.
+        """
+        self.histogram.merge(window)
+        self.sum_ns += sum(count * bucket_upper_bound(index)
+                           for index, count in enumerate(window.counts) if count)
+
+    def render(self):
+        """Return the exposition lines of the histogram."""
+        buckets = [0] * (len(HISTOGRAM_BOUNDS_NS) + 1)
+        for index, count in enumerate(self.histogram.counts):
+            if count:
+                buckets[_EXPORT_BUCKET[index]] += count
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_NS, buckets):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound / 1e9:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.histogram.total}')
+        lines.append(f"{self.name}_sum {self.sum_ns / 1e9}")
+        lines.append(f"{self.name}_count {self.histogram.total}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named set of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        # Registering a name again replaces the metric, e.g. after a restart of the filter
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, read, label=None):
+        """Register a monotonically increasing metric read from `read`."""
+        return self._register(Metric(name, help_text, 'counter', read, label))
+
+    def gauge(self, name, help_text, read, label=None):
+        """Register a metric that can go up and down, read from `read`."""
+        return self._register(Metric(name, help_text, 'gauge', read, label))
+
+    def histogram(self, name, help_text, histogram=None):
+        """Register a latency histogram.
+
+        Returns:
+            Histogram: The metric, to observe samples or merge windows into.
+        """
+        return self._register(Histogram(name, help_text, histogram))
+
+    def render(self):
+        """Return the text exposition of every metric."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                log.log(f"Could not collect metric {metric.name}: {e}", logging.WARNING)
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry the pipeline components register with
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the registry on /metrics."""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+
+def serve_metrics(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve a registry over HTTP from a daemon thread.
+
+    Args:
+        port (int): TCP port, or 0 to disable the endpoint.
+        host (str): Address to listen on; local only by default.
+        registry (MetricsRegistry): Metrics to serve.
+
+    Returns:
+        ThreadingHTTPServer or None: The server (call `shutdown` to stop
+            it), or None if disabled or the port could not be bound.
+    """
+    if not port:
+        return None
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        log.log(f"Metrics endpoint unavailable on {host}:{port}: {e}", logging.WARNING)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.log(f"Serving metrics on http://{host}:{port}/metrics", logging.INFO)
+    return server
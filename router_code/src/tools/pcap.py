@@ -0,0 +1,156 @@
+"""
+Minimal pcap file support for offline replay.
+
+Reads classic libpcap files (microsecond or nanosecond timestamps, either
+byte order) without scapy, and turns their frames into the IPv4 packets
+NFQUEUE would hand to the filter. `ReplayPacket` stands in for a
+NetfilterQueue packet so the verdict pipeline can run without root or a
+live queue.
+"""
+import struct
+
+# Magic numbers of the two timestamp resolutions, as read little-endian
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+GLOBAL_HEADER = struct.Struct('IHHiIII')
+RECORD_HEADER = struct.Struct('IIII')
+
+
+def read_pcap(path):
+    """Iterate over the frames of a pcap file.
+
+    Args:
+        path (str): pcap file.
+
+    Yields:
+        tuple:
+            timestamp (float): Capture time in seconds.
+            linktype (int): Link-layer header type of the file.
+            frame (bytes): Captured bytes.
+
+    Raises:
+        ValueError: If the file is not a classic pcap file (pcapng is not
+            supported).
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    view = memoryview(data)
+    if len(view) < GLOBAL_HEADER.size:
+        raise ValueError(f"{path}: too short for a pcap header")
+
+    magic = struct.unpack_from('<I', view, 0)[0]
+    byte_order = '<'
+    if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        magic = struct.unpack_from('>I', view, 0)[0]
+        byte_order = '>'
+        if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            raise ValueError(f"{path}: not a pcap file (pcapng is not supported)")
+    fraction = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+    global_header = struct.Struct(byte_order + GLOBAL_HEADER.format)
+    record_header = struct.Struct(byte_order + RECORD_HEADER.format)
+    linktype = global_header.unpack_from(view, 0)[6] & 0xffff
+
+    offset = global_header.size
+    end = len(view)
+    while offset + record_header.size <= end:
+        seconds, fractional, captured, _ = record_header.unpack_from(view, offset)
+        offset += record_header.size
+        if offset + captured > end:
+            break
+        yield seconds + fractional * fraction, linktype, bytes(view[offset:offset + captured])
+        offset += captured
+
+
+def ipv4_payload(linktype, frame):
+    """Return the IPv4 packet carried by a frame, or None for anything else.
+
+    Args:
+        linktype (int): Link-layer header type of the capture.
+        frame (bytes): Captured frame.
+
+    Returns:
+        bytes or None: IPv4 header and payload, as NFQUEUE delivers it.
+    """
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        offset = 0
+    elif linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        offset = 12
+        ethertype = int.from_bytes(frame[12:14], 'big')
+        # Skip 802.1Q / 802.1ad tags
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = int.from_bytes(frame[offset:offset + 2], 'big')
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+        offset += 2
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16 or int.from_bytes(frame[14:16], 'big') != ETHERTYPE_IPV4:
+            return None
+        offset = 16
+    else:
+        return None
+    if len(frame) < offset + 20 or frame[offset] >> 4 != 4:
+        return None
+    # Drop the Ethernet padding of short frames
+    total_length = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+    if 20 <= total_length < len(frame) - offset:
+        return frame[offset:offset + total_length]
+    return frame[offset:]
+
+
+def read_ipv4_packets(path):
+    """Iterate over the IPv4 packets of a pcap file.
+
+    Args:
+        path (str): pcap file.
+
+    Yields:
+        tuple:
+            timestamp (float): Capture time in seconds.
+            payload (bytes): IPv4 packet.
+    """
+    for timestamp, linktype, frame in read_pcap(path):
+        payload = ipv4_payload(linktype, frame)
+        if payload is not None:
+            yield timestamp, payload
+
+
+class ReplayPacket:
+    """Stand-in for a NetfilterQueue packet, recording the verdict given."""
+
+    __slots__ = ('payload', 'verdict')
+
+    ACCEPT = 1
+    DROP = 0
+
+    def __init__(self, payload):
+        """Wrap an IPv4 packet.
+
+        Args:
+            payload (bytes): IPv4 header and payload.
+        """
+        self.payload = payload
+        self.verdict = None
+
+    def get_payload(self):
+        """Return the IPv4 packet, like `netfilterqueue.Packet.get_payload`."""
+        return self.payload
+
+    def accept(self):
+        """Record an accept verdict."""
+        self.verdict = self.ACCEPT
+
+    def drop(self):
+        """Record a drop verdict."""
+        self.verdict = self.DROP
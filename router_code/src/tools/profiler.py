@@ -0,0 +1,250 @@
+"""
+Runtime-toggleable per-stage profiler for the packet filter.
+
+Splits the NFQUEUE callback into stages (payload fetch, parse, buffer
+append, rule lookup, verdict) and the analysis cycle into stages (message
+read, rule expiry, analysis), and records stage latencies in
+LatencyHistograms. Packets are sampled 1-in-N; analysis cycles are always
+timed, together with the memory blocks and garbage collections of each
+cycle. While disabled the callback pays a single attribute check.
+
+Toggle it without restarting the filter:
+    kill -USR2 <pid>                      (toggle; the report is logged when turned off)
+    echo "on 50" | nc -U <profile_socket> (or: off, toggle, report, reset)
+"""
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from src.tools.latency import LatencyHistogram
+from src.tools.logger import Logger
+
+log = Logger(log_file='SP_Log.log', log_level=logging.DEBUG)
+
+PACKET_STAGES = ('payload', 'parse', 'buffer', 'lookup', 'verdict')
+CYCLE_STAGES = ('messages', 'expiry', 'analysis')
+
+
+class _Stage:
+    """Context manager timing one stage of a cycle."""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter_ns() - self.start)
+
+
+class _NoStage:
+    """Context manager used for stages while profiling is off."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class StageProfiler:
+    """Per-stage latency histograms and per-cycle allocation counts."""
+
+    def __init__(self, sample_every=100, cycles_kept=60):
+        """Initialise the profiler, disabled.
+
+        Args:
+            sample_every (int): Profile one packet out of this many.
+            cycles_kept (int): Analysis cycles whose allocation counts are kept.
+        """
+        self.enabled = False
+        self.sample_every = max(1, sample_every)
+        self.countdown = self.sample_every
+        self.stages = {stage: LatencyHistogram() for stage in PACKET_STAGES + CYCLE_STAGES}
+        self.cycles = deque(maxlen=cycles_kept)
+        self.enabled_at = None
+        self.cycle_start = None
+
+    def enable(self, sample_every=None):
+        """Start profiling, optionally with a new sampling rate."""
+        if sample_every is not None:
+            self.sample_every = max(1, int(sample_every))
+        self.countdown = self.sample_every
+        self.enabled_at = time.time()
+        self.cycle_start = self._allocation_state()
+        self.enabled = True
+        log.log(f"Profiling enabled, sampling 1 in {self.sample_every} packets", logging.INFO)
+
+    def disable(self):
+        """Stop profiling; the samples are kept until `reset`."""
+        self.enabled = False
+        log.log(f"Profiling disabled: {json.dumps(self.report())}", logging.INFO)
+
+    def toggle(self):
+        """Enable the profiler if it is off, disable it otherwise."""
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def reset(self):
+        """Discard the samples recorded so far."""
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.cycles.clear()
+
+    def sample(self):
+        """Return True for one call out of `sample_every`; only called while enabled."""
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.sample_every
+        return True
+
+    def record(self, stage, value_ns):
+        """Count one latency sample of a stage."""
+        self.stages[stage].record(value_ns)
+
+    def stage(self, stage):
+        """Return a context manager timing a stage of the analysis cycle."""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self.stages[stage])
+
+    @staticmethod
+    def _allocation_state():
+        """Return the allocated memory blocks and collections per GC generation."""
+        return sys.getallocatedblocks(), [generation['collections'] for generation in gc.get_stats()]
+
+    def end_cycle(self):
+        """Record the allocations of the analysis cycle that just ended."""
+        if not self.enabled:
+            return
+        blocks, collections = self._allocation_state()
+        start_blocks, start_collections = self.cycle_start
+        self.cycles.append({
+            'time': time.time(),
+            'blocks': blocks - start_blocks,
+            'gc_collections': [end - start for end, start in zip(collections, start_collections)],
+        })
+        self.cycle_start = (blocks, collections)
+
+    def report(self):
+        """Return the stage latencies and recent cycle allocations.
+
+        Returns:
+            dict: Profiler state, latency summaries per stage (in
+                microseconds) and the allocations of the kept cycles.
+        """
+        return {
+            'enabled': self.enabled,
+            'sample_every': self.sample_every,
+            'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()
+                       if histogram.total},
+            'cycles': list(self.cycles),
+        }
+
+
+# Profiler of this process, shared by the pipeline and the analysis loop
+PROFILER = StageProfiler()
+
+
+def install_signal_toggle(signum=signal.SIGUSR2, profiler=PROFILER):
+    """Toggle a profiler when the process receives a signal.
+
+    Must be called from the main thread. Handlers are inherited by worker
+    processes forked afterwards, each toggling its own profiler.
+
+    Returns:
+        bool: True if the handler was installed.
+    """
+    try:
+        signal.signal(signum, lambda received, frame: profiler.toggle())
+    except ValueError as e:
+        log.log(f"Profiler signal toggle unavailable: {e}", logging.WARNING)
+        return False
+    return True
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """Handle one profiler command per line."""
+
+    profiler = PROFILER
+
+    def handle(self):
+        for line in self.rfile:
+            command, *args = line.decode('utf-8', 'replace').split() or ['']
+            try:
+                if command == 'on':
+                    self.profiler.enable(int(args[0]) if args else None)
+                elif command == 'off':
+                    self.profiler.disable()
+                elif command == 'toggle':
+                    self.profiler.toggle()
+                elif command == 'reset':
+                    self.profiler.reset()
+                elif command != 'report':
+                    raise ValueError(f"unknown command {command!r}")
+                reply = self.profiler.report()
+            except (ValueError, IndexError) as e:
+                reply = {'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def _socket_in_use(path):
+    """Return True if a process accepts connections on a Unix socket path."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def serve_control_socket(path, profiler=PROFILER):
+    """Accept profiler commands on a Unix stream socket from a daemon thread.
+
+    Commands, one per line: `on [N]`, `off`, `toggle`, `report`, `reset`.
+    Each is answered with the JSON report of the profiler.
+
+    Args:
+        path (str): Socket path, or an empty string to disable the socket.
+        profiler (StageProfiler): Profiler controlled through the socket.
+
+    Returns:
+        socketserver.ThreadingUnixStreamServer or None: The server, or None
+            if disabled or the socket could not be created.
+    """
+    if not path:
+        return None
+    try:
+        if os.path.exists(path):
+            if _socket_in_use(path):
+                log.log(f"Profiler control socket {path} is used by another process", logging.WARNING)
+                return None
+            # Left behind by a process that did not exit cleanly
+            os.unlink(path)
+        handler = type('ControlHandler', (_ControlHandler,), {'profiler': profiler})
+        server = socketserver.ThreadingUnixStreamServer(path, handler)
+    except OSError as e:
+        log.log(f"Profiler control socket unavailable at {path}: {e}", logging.WARNING)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="profiler-control", daemon=True).start()
+    log.log(f"Profiler control socket at {path}", logging.INFO)
+    return server
@@ -0,0 +1,64 @@
+"""Tests of the multi-queue coordinator's merging of worker reports."""
+import queue
+import time
+import unittest
+from src.net_manager.buffer import PacketBuffer
+from src.net_manager.multi_queue import MultiQueueFilter
+from src.net_manager.packet_parser import PROTO_TCP, TCP_SYN, PacketRecord, ip_to_int
+from src.tools.latency import LatencyHistogram
+from src.tools.metrics import MetricsRegistry
+
+
+def make_coordinator(detection):
+    """Build a coordinator with only the state collect_counts uses."""
+    coordinator = MultiQueueFilter.__new__(MultiQueueFilter)
+    coordinator.packer_buffer = PacketBuffer(capacity=1, detection=detection)
+    coordinator.stats_queue = queue.Queue()
+    coordinator.worker_stats = {}
+    coordinator.worker_counts = {}
+    coordinator.packets_per_second = 0.0
+    coordinator.last_cycle = time.time()
+    coordinator.latency_metric = MetricsRegistry().histogram('latency', 'Callback latency')
+    return coordinator
+
+
+def report(coordinator, queue_num, detection, syns):
+    """Queue the pattern counts of a worker buffer that saw `syns` SYNs to one host."""
+    worker_buffer = PacketBuffer(capacity=1024, detection=detection)
+    for port in range(syns):
+        worker_buffer.add_packet(PacketRecord('10.0.0.1', '10.2.0.9', PROTO_TCP, 1024 + port, 80, TCP_SYN,
+                                              ip_to_int('10.0.0.1'), ip_to_int('10.2.0.9')))
+    stats = {'accept': 0, 'drop': 0, 'buffered': 0, 'capacity': 1024, 'latency': LatencyHistogram()}
+    coordinator.stats_queue.put((queue_num, worker_buffer.pattern_counts(), stats))
+
+
+class CollectCountsTest(unittest.TestCase):
+
+    def merged_syns(self, coordinator):
+        counts = coordinator.packer_buffer.merge_counts(coordinator.collect_counts())
+        return counts['syn_counts_by_destination'].get('10.2.0.9', 0)
+
+    def test_window_reports_of_one_queue_are_not_summed(self):
+        coordinator = make_coordinator('window')
+        report(coordinator, 1, 'window', 15)
+        report(coordinator, 1, 'window', 15)
+        self.assertEqual(self.merged_syns(coordinator), 15)
+
+    def test_window_counts_are_kept_until_the_next_report(self):
+        coordinator = make_coordinator('window')
+        report(coordinator, 1, 'window', 15)
+        report(coordinator, 2, 'window', 5)
+        self.assertEqual(self.merged_syns(coordinator), 20)
+        report(coordinator, 2, 'window', 7)
+        self.assertEqual(self.merged_syns(coordinator), 22)
+
+    def test_draining_reports_are_summed(self):
+        coordinator = make_coordinator('sketch')
+        report(coordinator, 1, 'sketch', 15)
+        report(coordinator, 1, 'sketch', 15)
+        self.assertEqual(self.merged_syns(coordinator), 30)
+        self.assertEqual(self.merged_syns(coordinator), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()